@@ -0,0 +1,17 @@
+from pypcb import *
+import timeit
+
+# Build time of a single GerberLayer should grow linearly with the number of
+# commands: the time per command must stay (roughly) constant.
+
+def buildLayer(numberOfCommands):
+    gerberFile = GerberFile('Benchmark')
+    apertureNumber = gerberFile.addCircularAperture(0.35)
+    layer = gerberFile[0]
+    for number in range(numberOfCommands):
+        layer.flashAperture(Location(0.01*number,0.),apertureNumber)
+    return str(gerberFile)
+
+for numberOfCommands in [2500,5000,10000,20000,40000]:
+    seconds = min(timeit.repeat(lambda: buildLayer(numberOfCommands),repeat=3,number=1))
+    print '{commands:6d} commands: {seconds:7.3f} s ({perCommand:5.1f} us/command)'.format(commands=numberOfCommands,seconds=seconds,perCommand=1e6*seconds/numberOfCommands)
@@ -0,0 +1,13 @@
+from pypcb import *
+import numpy
+import time
+
+# Drill path optimisation of 20000 holes in two tools should take seconds.
+
+numpy.random.seed(0)
+drillFile = Excellon('Benchmark',plated=True)
+for (x,y) in numpy.random.uniform(0.,200.,(20000,2)):
+    drillFile.addHole(Location(x,y),0.4 if x < 150. else 1.)
+start = time.time()
+(travelBefore,travelAfter) = drillFile.optimiseDrillPath()
+print 'travel {before:.0f} mm -> {after:.0f} mm in {seconds:.1f} s'.format(before=travelBefore,after=travelAfter,seconds=time.time()-start)
@@ -0,0 +1,16 @@
+from pypcb import *
+import time
+
+# A 100x100 mm plane with clearances and pads for a few hundred vias, written
+# with polarity layers and flattened into positive regions.
+
+gerberFile = GerberFile('Benchmark')
+gerberFile[0].addOutline([Stroke(Location(0.,0.)),Stroke(Location(100.,0.)),Stroke(Location(100.,100.)),Stroke(Location(0.,100.))])
+locations = numpy.random.RandomState(1).uniform(2.,98.,(500,2))
+gerberFile[1].addFlashes(locations,gerberFile.addCircularAperture(1.2))
+gerberFile[2].addFlashes(locations,gerberFile.addCircularAperture(0.8))
+
+startTime = time.time()
+flatFile = gerberFile.flattened()
+seconds = time.time()-startTime
+print 'flattened {vias:d} vias in {seconds:.2f} s: {layered:d} bytes with polarity layers, {flat:d} bytes positive only'.format(vias=len(locations),seconds=seconds,layered=len(str(gerberFile)),flat=len(str(flatFile)))
@@ -0,0 +1,19 @@
+from pypcb import *
+import numpy
+import os
+import time
+
+# A 100 x 100 mm board at 2400 DPI is rendered tile by tile into a portable
+# bitmap, so memory stays bounded by the tile size.
+
+gerberFile = GerberFile('Benchmark')
+Rectangle(bottomLeft=Location(0.,0.),topRight=Location(100.,100.),gerberLayer=gerberFile[0]).draw()
+viaLocations = numpy.random.RandomState(0).uniform(1.,99.,(5000,2))
+gerberFile[1].addFlashes(viaLocations,gerberFile.addCircularAperture(0.8))
+gerberFile[2].addFlashes(viaLocations,gerberFile.addCircularAperture(0.5))
+
+start = time.time()
+rasteriser = GerberRasteriser(gerberFile,dpi=2400.)
+with open(os.devnull,'wb') as bitmapFile:
+    rasteriser.writePbm(bitmapFile)
+print '{rows} x {columns} pixels in {seconds:.1f} s'.format(rows=rasteriser.rows,columns=rasteriser.columns,seconds=time.time()-start)
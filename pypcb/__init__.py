@@ -2,7 +2,10 @@ from geometry import *
 from utility import *
 
 from rs274x import * #GerberFile
-from excellon import Excellon
+from raster import GerberRasteriser
+from flatten import PolarityFlattener
+from excellon import Excellon,ExcellonReader
+from drillpath import pathLength,nearestNeighbourOrder,twoOpt
 from stroketext import *
 from lazy import *
 from stack import Stack,EuroCircuits6C
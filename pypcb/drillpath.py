@@ -0,0 +1,97 @@
+import numpy
+import bisect
+
+from utility import raggedRanges
+
+def pathLength(points,start=(0.,0.)):
+    '''Length of the path from start through the points in order.'''
+    steps = numpy.diff(numpy.vstack([numpy.reshape(start,(1,2)),points]),axis=0)
+    return numpy.hypot(steps[:,0],steps[:,1]).sum()
+
+def nearestNeighbourOrder(points,start=(0.,0.)):
+    '''Greedy order that always moves on to the closest remaining point.'''
+    numberOfPoints = len(points)
+    remaining = numpy.array(points,dtype=float)
+    indices = numpy.arange(numberOfPoints)
+    order = numpy.empty(numberOfPoints,dtype=int)
+    (x,y) = start
+    for step in range(numberOfPoints):
+        last = numberOfPoints-step-1
+        closest = (numpy.square(remaining[:last+1,0]-x)+numpy.square(remaining[:last+1,1]-y)).argmin()
+        order[step] = indices[closest]
+        (x,y) = remaining[closest]
+        # the last remaining point takes the place of the visited one
+        remaining[closest] = remaining[last]
+        indices[closest] = indices[last]
+    return order
+
+def nearestNeighbours(points,count=8):
+    '''
+    (point, neighbour) index pairs to up to count nearest other points,
+    searched in the 3x3 cells around each point of a uniform grid.
+    '''
+    numberOfPoints = len(points)
+    low = points.min(axis=0)
+    extent = points.max(axis=0)-low
+    # about count/2 points per cell on evenly spread holes
+    cellSize = max(numpy.sqrt(extent[0]*extent[1]*count/2./numberOfPoints),extent.max()*count/2./numberOfPoints,1e-6)
+    cells = numpy.floor((points-low)/cellSize).astype(int)+1
+    rowLength = cells[:,0].max()+2
+    keys = cells[:,1]*rowLength+cells[:,0]
+    sortedPoints = numpy.argsort(keys,kind='mergesort')
+    sortedKeys = keys[sortedPoints]
+    neighbourKeys = (keys[:,None]+numpy.array([dy*rowLength+dx for dy in (-1,0,1) for dx in (-1,0,1)])[None,:]).ravel()
+    (pairNumbers,positions) = raggedRanges(numpy.searchsorted(sortedKeys,neighbourKeys,'left'),numpy.searchsorted(sortedKeys,neighbourKeys,'right'))
+    pointNumbers = pairNumbers//9
+    candidates = sortedPoints[positions]
+    other = candidates != pointNumbers
+    (pointNumbers,candidates) = (pointNumbers[other],candidates[other])
+    distances = numpy.hypot(*(points[candidates]-points[pointNumbers]).T)
+    order = numpy.lexsort((distances,pointNumbers))
+    (pointNumbers,candidates) = (pointNumbers[order],candidates[order])
+    firsts = numpy.searchsorted(pointNumbers,pointNumbers,'left')
+    closest = numpy.arange(len(pointNumbers))-firsts < count
+    return (pointNumbers[closest],candidates[closest])
+
+def twoOpt(points,order,start=(0.,0.),neighbours=8,passes=100):
+    '''
+    Improves an open path from start through the points with 2-opt moves
+    that join a point to one of its nearest neighbours. Every pass evaluates
+    all such moves at once and applies the best non-overlapping ones.
+    '''
+    if len(order) < 3:
+        return numpy.array(order)
+    # point 0 is the fixed start, path[0] stays 0
+    allPoints = numpy.vstack([numpy.reshape(start,(1,2)),points])
+    path = numpy.concatenate([[0],numpy.asarray(order)+1])
+    (first,second) = nearestNeighbours(allPoints[1:],neighbours)
+    (first,second) = (first+1,second+1)
+    last = len(path)-1
+    def distance(a,b):
+        return numpy.hypot(*(allPoints[a]-allPoints[b]).T)
+    for passNumber in range(passes):
+        positions = numpy.empty_like(path)
+        positions[path] = numpy.arange(len(path))
+        # replace edges (i,i+1) and (j,j+1) by (i,j) and (i+1,j+1)
+        i = numpy.minimum(positions[first],positions[second])
+        j = numpy.maximum(positions[first],positions[second])
+        valid = j > i+1
+        (i,j) = (i[valid],j[valid])
+        after = numpy.minimum(j+1,last)
+        open = j == last
+        gain = distance(path[i],path[i+1])-distance(path[i],path[j])+numpy.where(open,0.,distance(path[j],path[after])-distance(path[i+1],path[after]))
+        improving = gain > 1e-9
+        if not improving.any():
+            break
+        byGain = numpy.argsort(-gain[improving],kind='mergesort')
+        starts = []
+        ends = []
+        for (low,high) in zip(i[improving][byGain].tolist(),j[improving][byGain].tolist()):
+            # skip moves that touch an edge changed earlier in this pass
+            index = bisect.bisect_left(starts,low)
+            if (index < len(starts) and starts[index] <= high+1) or (index > 0 and ends[index-1] >= low):
+                continue
+            starts.insert(index,low)
+            ends.insert(index,high+1)
+            path[low+1:high+1] = path[low+1:high+1][::-1].copy()
+    return path[1:]-1
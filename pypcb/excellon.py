@@ -1,28 +1,125 @@
 import os
+import re
+import string
+import numpy
+
+from utility import Statistics, GrowingArray
+from drillpath import pathLength, nearestNeighbourOrder, twoOpt
+
+coordinateSeparators = string.maketrans('XY','  ')
 
 class Tool(object):
     def __init__(self,excellon,number,diameter):
         self.diameter = diameter
         self.number = number
         self.excellon = excellon
-        self.drillInstructions = ''
+        self.locations = GrowingArray(2)
     def __str__(self):
         return 'T{number:d}C{diameter:.{precision}f}\n'.format(number=self.number,diameter=self.diameter,precision=self.excellon.decimalPlaces)
+    @property
+    def hits(self):
+        return len(self.locations)
     def addHole(self,location):
-        def lengthToString(lengthInMm):
-            assert lengthInMm < 10.**self.excellon.integerPlaces
-            return '{length:+.0{decimalPlaces}f}'.format(length=lengthInMm,decimalPlaces=self.excellon.decimalPlaces)
-        
-        self.drillInstructions += 'X{x}Y{y}\n'.format(x=lengthToString(location[0]),y=lengthToString(location[1]))
+        self.locations.append([location[0],location[1]])
+    def addHoles(self,locations):
+        self.locations.extend(locations)
+    def reorder(self,order):
+        '''Drills the hits in the given order of their indices.'''
+        locations = self.locations.array[order]
+        self.locations = GrowingArray(2,capacity=max(len(locations),1))
+        self.locations.extend(locations)
+    def hitString(self):
+        '''All hits, formatted in one go.'''
+        locations = self.locations.array
+        if len(locations) == 0:
+            return ''
+        decimalPlaces = self.excellon.decimalPlaces
+        grid = self.excellon.grid
+        if grid is None:
+            assert (numpy.abs(locations) < 10.**self.excellon.integerPlaces).all()
+            hits = ('X%+.{decimalPlaces}fY%+.{decimalPlaces}f\n'.format(decimalPlaces=decimalPlaces)*len(locations)) % tuple(locations.ravel().tolist())
+            if not self.excellon.repeatCodes:
+                return hits
+            # the coordinates as written, in units of the last decimal place
+            integers = numpy.rint(numpy.fromstring(hits.translate(coordinateSeparators),sep=' ')*10**decimalPlaces).astype(numpy.int64).reshape(-1,2)
+        else:
+            # snap once, then round to the file format in integers
+            integers = grid.toDecimalPlaces(grid.snap(locations),decimalPlaces)
+            assert (numpy.abs(integers) < 10**(self.excellon.integerPlaces+decimalPlaces)).all()
+            hits = self._integerPairString('X','Y',integers)
+            if not self.excellon.repeatCodes:
+                return hits
+        return self._withRepeats(hits,integers)
+    def _integerPairString(self,first,second,integers):
+        decimalPlaces = self.excellon.decimalPlaces
+        signs = numpy.where(integers < 0,'-','+').astype(object)
+        (wholes,fractions) = numpy.divmod(numpy.abs(integers),10**decimalPlaces)
+        fields = numpy.column_stack([signs[:,0],wholes[:,0],fractions[:,0],signs[:,1],wholes[:,1],fractions[:,1]])
+        return ('{first}%s%d.%0{decimalPlaces}d{second}%s%d.%0{decimalPlaces}d\n'.format(first=first,second=second,decimalPlaces=decimalPlaces)*len(integers)) % tuple(fields.ravel().tolist())
+    def _withRepeats(self,hits,integers):
+        '''
+        Replaces runs of three or more hits at about the same step by Excellon
+        repeat codes that step on from the hit before. Every repeated hit stays
+        within one unit of the last decimal place of its own coordinates, so
+        that rows at a pitch between two units still repeat.
+        '''
+        if len(integers) < 3:
+            return hits
+        lines = hits.splitlines(True)
+        # three hits can only belong to one run if they are evenly spaced, give or take a unit each
+        even = (numpy.abs(integers[2:]-2*integers[1:-1]+integers[:-2]) <= 4).all(axis=1).tolist()
+        repeated = []
+        hit = 0 # first hit still to be written
+        while hit < len(integers):
+            repeated.append(lines[hit])
+            position = integers[hit]
+            hit += 1
+            while hit+1 < len(integers) and even[hit-1]:
+                (count,step) = self._repeatRun(position,integers[hit:])
+                if count < 2:
+                    break
+                stepString = self._integerPairString('X','Y',step[numpy.newaxis])
+                for remaining in range(count,0,-self.excellon.maximumRepeats):
+                    repeated.append('R{count:02d}{step}'.format(count=min(remaining,self.excellon.maximumRepeats),step=stepString))
+                (position,hit) = (position+count*step,hit+count)
+        return ''.join(repeated)
+    def _repeatRun(self,position,following):
+        '''
+        How many of the following hits one integer step repeats from position,
+        each within a unit, and that step.
+        '''
+        window = 2*self.excellon.maximumRepeats
+        while True:
+            offsets = following[:window]-position
+            multiples = numpy.arange(1,len(offsets)+1)[:,numpy.newaxis]
+            # the steps that keep every hit so far within a unit
+            lowest = numpy.maximum.accumulate(-((1-offsets)//multiples),axis=0)
+            highest = numpy.minimum.accumulate((offsets+1)//multiples,axis=0)
+            possible = (lowest <= highest).all(axis=1)
+            if not possible.all() or len(offsets) < window:
+                break
+            window *= 2
+        count = int(numpy.argmin(possible)) if not possible.all() else len(possible)
+        if count == 0:
+            return (0,None)
+        step = numpy.clip(numpy.rint(offsets[count-1]/float(count)).astype(numpy.int64),lowest[count-1],highest[count-1])
+        return (count,step)
     def drillString(self):
-        return 'T{number:02d}\n{drillInstructions}'.format(number=self.number,drillInstructions=self.drillInstructions)
+        return 'T{number:02d}\n{hits}'.format(number=self.number,hits=self.hitString())
 
 class Excellon(object):
-    def __init__(self,name,plated=None):
+    maximumRepeats = 99
+    def __init__(self,name,plated=None,grid=None,drillIncrement=None,optimisePath=False,repeatCodes=True):
+        self.grid = grid
+        self.optimisePath = optimisePath
+        self.drillTravel = None # (before, after) in mm of the last path optimisation
+        self.repeatCodes = repeatCodes # write runs of equally spaced hits with R codes
         self.decimalPlaces = 3
         self.integerPlaces = 3
+        self.drillIncrement = drillIncrement # tool diameters are normalised to it, if given
         self.lastToolNumber = 0
         self.tools = []
+        self._toolsByDiameter = {}
         
         self.name = name
         self.plated = plated
@@ -35,20 +132,82 @@ FMAT,2
 ;FILE_FORMAT={integerPlaces:d}:{decimalPlaces:d}
 '''.format(integerPlaces=self.integerPlaces,decimalPlaces=self.decimalPlaces)+self.platedString()+ self.toolString()+self.drillString()
 
+    def diameterKey(self,diameter):
+        '''Diameter in steps of the drill increment, or else of the file resolution.'''
+        step = self.drillIncrement or 10.**-self.decimalPlaces
+        return int(round(diameter/step))
+    def _tool(self,diameter):
+        key = self.diameterKey(diameter)
+        if key not in self._toolsByDiameter:
+            self._addTool(key*self.drillIncrement if self.drillIncrement else diameter)
+        return self._toolsByDiameter[key]
     def addHole(self,location,diameter):
-        for existingTool in self.tools:
-            if existingTool.diameter == diameter:
-                tool = existingTool
-                break
-        else:
-            tool = self._addTool(diameter)
-        tool.addHole(location)
+        self._tool(diameter).addHole(location)
+    def addHoles(self,locations,diameter):
+        '''Adds an (n,2) array of hit locations with the same diameter.'''
+        self._tool(diameter).addHoles(locations)
 
     def _addTool(self,diameter):
         self.lastToolNumber += 1
         newTool = Tool(self,self.lastToolNumber,diameter)
         self.tools.append(newTool)
+        self._toolsByDiameter[self.diameterKey(diameter)] = newTool
         return newTool
+    def consolidate(self,tolerance):
+        '''
+        Merges the tools whose diameters differ by no more than tolerance
+        from the smallest in their group into the tool of that group with
+        most hits, and renumbers the tools by diameter.
+        '''
+        groups = []
+        for tool in sorted(self.tools,key=lambda tool: tool.diameter):
+            if groups and tool.diameter-groups[-1][0].diameter <= tolerance+1e-9:
+                groups[-1].append(tool)
+            else:
+                groups.append([tool])
+        self.tools = []
+        self._toolsByDiameter = {}
+        for (toolNumber,group) in enumerate(groups):
+            kept = max(group,key=lambda tool: (tool.hits,-tool.diameter))
+            kept.number = toolNumber+1
+            for tool in group:
+                if tool is not kept:
+                    kept.addHoles(tool.locations.array)
+                # later holes of a merged diameter go to the kept tool as well
+                self._toolsByDiameter[self.diameterKey(tool.diameter)] = kept
+            self.tools.append(kept)
+        self.lastToolNumber = len(self.tools)
+
+    def travel(self):
+        '''Length (mm) of the drill path from the origin through all hits.'''
+        if not self.tools:
+            return 0.
+        return pathLength(numpy.vstack([tool.locations.array for tool in self.tools]))
+    def optimiseDrillPath(self,passes=100):
+        '''
+        Orders the tools by diameter and the hits of every tool by nearest
+        neighbour followed by 2-opt, starting where the previous tool ended.
+        Returns the travel (mm) before and after, also kept as drillTravel.
+        '''
+        travelBefore = self.travel()
+        self.tools.sort(key=lambda tool: tool.diameter)
+        position = (0.,0.)
+        for (toolNumber,tool) in enumerate(self.tools):
+            tool.number = toolNumber+1
+            if len(tool.locations):
+                locations = tool.locations.array
+                tool.reorder(twoOpt(locations,nearestNeighbourOrder(locations,position),position,passes=passes))
+                position = tuple(tool.locations.array[-1])
+        self.drillTravel = (travelBefore,self.travel())
+        return self.drillTravel
+
+    def merge(self,other,offset=(0.,0.)):
+        '''Adds the hits of another drill file, moved by offset, to the tools of the same diameter.'''
+        for tool in other.tools:
+            self.addHoles(tool.locations.array+numpy.asarray(offset,dtype=float)[:2],tool.diameter)
+
+    def statistics(self):
+        return Statistics(tools=len(self.tools),hits=sum([tool.hits for tool in self.tools]),bytes=len(str(self)))
 
     def platedString(self):
         if self.plated == None:
@@ -74,6 +233,8 @@ FMAT,2
     def writeOut(self,name=None,zipFile=None):
         if name == None:
             name = self.name
+        if self.optimisePath:
+            self.optimiseDrillPath()
         
         if zipFile:
             zipFile.writestr(name + '.drl',str(self))
@@ -86,6 +247,175 @@ FMAT,2
                 
             self.fileHandle.write(str(self))
             self.fileHandle.close()
+
+    @classmethod
+    def fromString(cls,text,name=None):
+        return ExcellonReader(text,name).read()
+    @classmethod
+    def fromFile(cls,fileOrPath,name=None):
+        if isinstance(fileOrPath,basestring):
+            with open(fileOrPath) as fileObject:
+                return cls.fromString(fileObject.read(),name)
+        else:
+            return cls.fromString(fileOrPath.read(),name)
+
+class ExcellonReader(object):
+    '''
+    Reads Excellon drill files as written by Excellon: the M48 header with
+    METRIC or INCH, TZ or LZ, FMAT,2 and the T/C tool table, followed by
+    tool selections, absolute hits and R repeat codes. The hit coordinates are collected as
+    strings and converted per tool into NumPy arrays.
+    '''
+    toolPattern = re.compile(r'T(\d+)(?:[FSB][\d.]+)*C([\d.]+)')
+    fileFormatPattern = re.compile(r';FILE_FORMAT=(\d+):(\d+)')
+    repeatPattern = re.compile(r'R(\d+)(?:X([+-]?[\d.]+))?(?:Y([+-]?[\d.]+))?$')
+    ignoredCommands = ['VER,1','ICI,OFF','ATC,ON','ATC,OFF','G90','G05','M71']
+    
+    def __init__(self,text,name=None):
+        self.text = text
+        self.name = name
+        
+        self.unit = 1.
+        self.omitLeadingZeroes = True
+        self.integerPlaces = 3
+        self.decimalPlaces = 3
+        self.plated = None
+        self.tools = {} # number: diameter in mm
+    
+    def read(self):
+        lines = [line.strip() for line in self.text.splitlines()]
+        lines = [line for line in lines if line]
+        if not lines or lines[0] != 'M48':
+            raise ValueError, 'Excellon files start with M48'
+        for (lineNumber,line) in enumerate(lines[1:]):
+            if line in ['%','M95']:
+                break
+            self._headerLine(line)
+        else:
+            raise ValueError, 'Unterminated Excellon header'
+        hits = self._hits(lines[lineNumber+2:])
+        
+        excellon = Excellon(self.name or 'Drill',plated=self.plated)
+        excellon.integerPlaces = self.integerPlaces
+        excellon.decimalPlaces = self.decimalPlaces
+        for (number,diameter) in sorted(self.tools.items()):
+            tool = Tool(excellon,number,diameter)
+            excellon.tools.append(tool)
+            excellon._toolsByDiameter.setdefault(excellon.diameterKey(diameter),tool)
+            if number in hits:
+                tool.addHoles(hits[number])
+        excellon.lastToolNumber = max(self.tools.keys() or [0])
+        return excellon
+    
+    def _headerLine(self,line):
+        if line.startswith(';'):
+            fileFormat = self.fileFormatPattern.match(line)
+            if fileFormat:
+                (self.integerPlaces,self.decimalPlaces) = map(int,fileFormat.groups())
+            elif line in [';TYPE=PLATED',';TYPE=NON_PLATED']:
+                self.plated = (line == ';TYPE=PLATED')
+        elif line.startswith('METRIC') or line.startswith('INCH'):
+            fields = line.split(',')
+            self.unit = {'METRIC':1.,'INCH':25.4}[fields[0]]
+            if len(fields) > 1:
+                self.omitLeadingZeroes = {'TZ':True,'LZ':False}[fields[1]]
+            if fields[0] == 'INCH':
+                (self.integerPlaces,self.decimalPlaces) = (2,4)
+        elif line.startswith('FMAT'):
+            if line != 'FMAT,2':
+                raise NotImplementedError, 'Only FMAT,2 Excellon files are supported'
+        elif line.startswith('T'):
+            self._toolDefinition(line)
+        elif line not in self.ignoredCommands:
+            raise NotImplementedError, 'Unsupported Excellon header line {line}'.format(line=line)
+    def _toolDefinition(self,line):
+        match = self.toolPattern.match(line)
+        if not match:
+            raise ValueError, 'Invalid Excellon tool definition {line}'.format(line=line)
+        self.tools[int(match.group(1))] = float(match.group(2))*self.unit
+        return int(match.group(1))
+    
+    def _hits(self,lines):
+        '''{tool number: (n,2) array of hits in mm}'''
+        tool = None
+        hitTools = []
+        xStrings = []
+        yStrings = []
+        repeats = [] # (number of hits before,tool,count,x step,y step)
+        for line in lines:
+            first = line[0]
+            if first in 'XY':
+                if tool is None:
+                    raise ValueError, 'Excellon hit {line} before a tool selection'.format(line=line)
+                (x,separator,y) = line[1:].partition('Y') if first == 'X' else ('','',line[1:])
+                hitTools.append(tool)
+                xStrings.append(x)
+                yStrings.append(y)
+            elif first == 'R':
+                match = self.repeatPattern.match(line)
+                if not match or not hitTools or tool is None:
+                    raise ValueError, 'Invalid Excellon repeat {line}'.format(line=line)
+                (count,x,y) = match.groups()
+                repeats.append((len(hitTools),tool,int(count))+tuple(numpy.nan_to_num(self._coordinates([x or '',y or '']))))
+            elif first == 'T':
+                tool = self._toolDefinition(line) if 'C' in line else int(line[1:])
+                if tool == 0:
+                    tool = None
+                elif tool not in self.tools:
+                    raise ValueError, 'Undefined Excellon tool T{number}'.format(number=tool)
+            elif line == 'M30':
+                break
+            elif first != ';' and line not in self.ignoredCommands:
+                raise NotImplementedError, 'Unsupported Excellon command {line}'.format(line=line)
+        if not hitTools:
+            return {}
+        coordinates = numpy.column_stack([self._coordinates(strings) for strings in [xStrings,yStrings]])
+        (locations,hitTools) = self._repeated(coordinates,numpy.array(hitTools),repeats)
+        return dict([(number,locations[hitTools == number]) for number in numpy.unique(hitTools).tolist()])
+    @classmethod
+    def _repeated(cls,coordinates,hitTools,repeats):
+        '''
+        Locations and tools of all hits, with the hits of the repeat codes
+        inserted: each steps from the hit before, with the tool selected at
+        the code. Coordinates are modal, a missing one repeats the value of
+        the hit before, repeated or not.
+        '''
+        locationPieces = []
+        toolPieces = []
+        (previous,last) = (0,numpy.zeros(2))
+        for (position,tool,count,xStep,yStep) in repeats+[(len(hitTools),0,0,0.,0.)]:
+            explicit = numpy.column_stack([cls._forwardFilled(numpy.append(start,column))[1:] for (start,column) in zip(last,coordinates[previous:position].T)])
+            locationPieces.append(explicit)
+            toolPieces.append(hitTools[previous:position])
+            if len(explicit):
+                last = explicit[-1]
+            previous = position
+            if count:
+                locationPieces.append(last+numpy.arange(1,count+1)[:,None]*numpy.array([[xStep,yStep]]))
+                toolPieces.append(numpy.repeat(tool,count))
+                last = locationPieces[-1][-1]
+        return (numpy.concatenate(locationPieces),numpy.concatenate(toolPieces))
+    def _coordinates(self,strings):
+        '''Coordinates in mm, NaN where missing.'''
+        if all(['.' in string for string in strings]):
+            return numpy.array(strings,dtype=float)*self.unit
+        digits = self.integerPlaces+self.decimalPlaces
+        def value(string):
+            if not string:
+                return numpy.nan
+            if '.' in string:
+                return float(string)
+            if not self.omitLeadingZeroes:
+                # trailing zeroes are omitted
+                (sign,string) = (string[0],string[1:]) if string[0] in '+-' else ('',string)
+                string = sign+string.ljust(digits,'0')
+            return int(string)*10.**-self.decimalPlaces
+        return numpy.array(map(value,strings),dtype=float)*self.unit
+    @classmethod
+    def _forwardFilled(cls,values):
+        present = ~numpy.isnan(values)
+        lastIndices = numpy.maximum.accumulate(numpy.where(present,numpy.arange(len(values)),-1))
+        return numpy.where(lastIndices >= 0,values[numpy.maximum(lastIndices,0)],0.)
         
 if __name__ == '__main__':
     file = Excellon('testDrillFile',plated=True)
@@ -0,0 +1,727 @@
+import numpy
+
+from rs274x import GerberFile,GerberLayer,TextBatch,FlashBatch,StrokeBatch,ContourBatch
+from raster import Aperture,GerberRasteriser,arcPoints,convexHull
+from utility import raggedRanges
+
+def circlePoints(radius,tolerance,startAngle=0.,sweep=2.*numpy.pi,closed=False):
+    '''Points on a (counter-clockwise) circle arc, chords no further than tolerance from it.'''
+    stepAngle = 2.*numpy.arccos(max(1.-tolerance/radius,-1.)) if radius > tolerance else numpy.pi/2.
+    steps = max(2,int(numpy.ceil(abs(sweep)/stepAngle)))
+    angles = startAngle + sweep*numpy.arange(steps+int(closed))/steps
+    return radius*numpy.column_stack([numpy.cos(angles),numpy.sin(angles)])
+
+def polygonEdges(polygons):
+    '''(x0, y0, x1, y1, polygon number) rows of closed polygons, given as an (N, vertices, 2) array.'''
+    (count,vertices) = polygons.shape[0:2]
+    polygonNumbers = numpy.repeat(numpy.arange(count),vertices)[:,numpy.newaxis]
+    return numpy.hstack([numpy.concatenate([polygons,numpy.roll(polygons,-1,axis=1)],axis=2).reshape(-1,4),polygonNumbers])
+
+def signedArea(polygon):
+    (x,y) = (polygon[:,0],polygon[:,1])
+    return 0.5*(numpy.dot(x,numpy.roll(y,-1)) - numpy.dot(numpy.roll(x,-1),y))
+
+def boxesTouch(boxes,others):
+    '''Whether boxes of (xmin, ymin, xmax, ymax) overlap or touch the others, row by row.'''
+    return (boxes[:,0] <= others[:,2]) & (others[:,0] <= boxes[:,2]) & (boxes[:,1] <= others[:,3]) & (others[:,1] <= boxes[:,3])
+
+def boxPairs(boxes,others,margin=0.,maximumCells=64):
+    '''
+    (box numbers, other numbers) of every box that touches one of the others
+    within margin. Boxes are hashed into a grid of cells of about their median
+    size, boxes that span more than maximumCells cells are compared with all
+    others instead. Empty boxes (minimum above maximum) touch nothing.
+    '''
+    boxNumbers = numpy.flatnonzero(numpy.all(boxes[:,0:2] <= boxes[:,2:4],axis=1))
+    otherNumbers = numpy.flatnonzero(numpy.all(others[:,0:2] <= others[:,2:4],axis=1))
+    if not len(boxNumbers) or not len(otherNumbers):
+        return (numpy.zeros(0,dtype=numpy.int64),numpy.zeros(0,dtype=numpy.int64))
+    (boxes,others) = (boxes[boxNumbers],others[otherNumbers] + [-margin,-margin,margin,margin])
+    sizes = numpy.concatenate([boxes[:,2:4]-boxes[:,0:2],others[:,2:4]-others[:,0:2]]).ravel()
+    cellSize = max(numpy.median(sizes[sizes > 0.]) if numpy.any(sizes > 0.) else 0.,margin,1e-6)
+    origin = numpy.minimum(boxes[:,0:2].min(axis=0),others[:,0:2].min(axis=0))
+    def cellRanges(boxes):
+        return (numpy.floor((boxes[:,0:2]-origin)/cellSize).astype(numpy.int64),numpy.floor((boxes[:,2:4]-origin)/cellSize).astype(numpy.int64))
+    ((boxLows,boxHighs),(otherLows,otherHighs)) = (cellRanges(boxes),cellRanges(others))
+    rowLength = max(boxHighs[:,1].max(),otherHighs[:,1].max())+1
+    def cells(lows,highs):
+        '''(box number, cell key) of every cell a box covers.'''
+        (numbers,columns) = raggedRanges(lows[:,0],highs[:,0]+1)
+        (cellNumbers,rows) = raggedRanges(lows[numbers,1],highs[numbers,1]+1)
+        return (numbers[cellNumbers],columns[cellNumbers]*rowLength+rows)
+    (largeBoxes,largeOthers) = [numpy.prod(highs-lows+1,axis=1) > maximumCells for (lows,highs) in [(boxLows,boxHighs),(otherLows,otherHighs)]]
+    (firsts,seconds) = ([],[])
+    for other in numpy.flatnonzero(largeOthers):
+        touching = numpy.flatnonzero(boxesTouch(boxes,others[other:other+1]))
+        (firsts,seconds) = (firsts+[touching],seconds+[numpy.repeat(other,len(touching))])
+    for box in numpy.flatnonzero(largeBoxes):
+        touching = numpy.flatnonzero(boxesTouch(others,boxes[box:box+1]))
+        (firsts,seconds) = (firsts+[numpy.repeat(box,len(touching))],seconds+[touching])
+    (smallBoxes,smallOthers) = (numpy.flatnonzero(~largeBoxes),numpy.flatnonzero(~largeOthers))
+    (boxOwners,boxKeys) = cells(boxLows[smallBoxes],boxHighs[smallBoxes])
+    (otherOwners,otherKeys) = cells(otherLows[smallOthers],otherHighs[smallOthers])
+    order = numpy.argsort(otherKeys,kind='mergesort')
+    (pairNumbers,positions) = raggedRanges(numpy.searchsorted(otherKeys[order],boxKeys,'left'),numpy.searchsorted(otherKeys[order],boxKeys,'right'))
+    (first,second) = (smallBoxes[boxOwners[pairNumbers]],smallOthers[otherOwners[order[positions]]])
+    touching = boxesTouch(boxes[first],others[second])
+    (first,second) = (numpy.concatenate(firsts+[first[touching]]),numpy.concatenate(seconds+[second[touching]]))
+    # boxes that share several cells are found once per cell
+    pairs = numpy.unique(first.astype(numpy.int64)*len(others)+second)
+    return (boxNumbers[pairs//len(others)],otherNumbers[pairs%len(others)])
+
+def touchedBoxes(boxes,others,margin=0.):
+    '''For every box, whether it touches one of the others within margin.'''
+    touched = numpy.zeros(len(boxes),dtype=bool)
+    touched[boxPairs(boxes,others,margin)[0]] = True
+    return touched
+
+class PolarityFlattener(object):
+    '''
+    Evaluates the dark and clear layers of a GerberFile into positive regions.
+    Dark primitives that no later clear primitive touches are kept as they
+    are. Of the rest, curves are replaced by polygons within tolerance, the
+    plane is cut into horizontal slabs at every vertex and edge crossing, the
+    layers are combined slab by slab as sorted span boundaries and the
+    outline of the resulting trapezoids is traced into one polygon per
+    connected area on the grid of the file, its holes joined by cut-ins. Runs
+    of its edges along a circle of the image are written as arcs again.
+    '''
+    def __init__(self,gerberFile,tolerance=0.005):
+        if any([type(batch) is TextBatch for layer in gerberFile.layers+[layer for block in gerberFile.blockApertures for layer in block.layers] for batch in layer._batches]):
+            gerberFile = GerberFile.fromString(str(gerberFile))
+        self.gerberFile = gerberFile
+        self.tolerance = tolerance
+        self.resolution = 10.**-gerberFile.decimalPlaces
+        self._blocks = dict([(block.apertureNumber,block) for block in gerberFile.blockApertures])
+        self._outlines = {}
+        self._separation = None
+
+    def _outline(self,apertureNumber):
+        '''Polygons of an aperture around the origin, a hole clockwise.'''
+        if apertureNumber not in self._outlines:
+            aperture = Aperture(self.gerberFile.apertures[apertureNumber])
+            (halfWidth,halfHeight) = aperture.halfSize
+            if aperture.shape == 'C':
+                polygons = [circlePoints(halfWidth,self.tolerance)]
+            elif aperture.shape == 'R':
+                polygons = [numpy.array([[-1,-1],[+1,-1],[+1,+1],[-1,+1]])*aperture.halfSize]
+            elif aperture.shape == 'O':
+                radius = min(halfWidth,halfHeight)
+                (dx,dy) = (halfWidth-radius,halfHeight-radius)
+                polygons = [self._capsules(numpy.array([[-dx,-dy]]),numpy.array([[dx,dy]]),radius)[0]]
+            else:
+                angles = aperture.rotation + 2.*numpy.pi*numpy.arange(aperture.vertices)/aperture.vertices
+                polygons = [halfWidth*numpy.column_stack([numpy.cos(angles),numpy.sin(angles)])]
+            if aperture.holeDiameter:
+                polygons.append(circlePoints(0.5*aperture.holeDiameter,self.tolerance)[::-1])
+            self._outlines[apertureNumber] = polygons
+        return self._outlines[apertureNumber]
+    def _capsules(self,starts,ends,radius):
+        '''(N, vertices, 2) counter-clockwise outlines of round-ended strokes.'''
+        halfCircle = circlePoints(radius,self.tolerance,-0.5*numpy.pi,numpy.pi,closed=True)
+        directions = numpy.arctan2(ends[:,1]-starts[:,1],ends[:,0]-starts[:,0])
+        (cosines,sines) = (numpy.cos(directions)[:,numpy.newaxis],numpy.sin(directions)[:,numpy.newaxis])
+        rotated = numpy.dstack([cosines*halfCircle[:,0]-sines*halfCircle[:,1],sines*halfCircle[:,0]+cosines*halfCircle[:,1]])
+        return numpy.concatenate([ends[:,numpy.newaxis,:]+rotated,starts[:,numpy.newaxis,:]-rotated],axis=1)
+    def _strokeEdges(self,starts,ends,apertureNumber):
+        '''Edges of the strokes, numbered by stroke.'''
+        aperture = Aperture(self.gerberFile.apertures[apertureNumber])
+        if aperture.shape == 'C':
+            return polygonEdges(self._capsules(starts,ends,0.5*aperture.width))
+        elif aperture.shape == 'R':
+            corners = numpy.array([[-1,-1],[+1,-1],[+1,+1],[-1,+1]])*aperture.halfSize
+            hulls = [polygonEdges(convexHull(numpy.concatenate([start+corners,end+corners]))[numpy.newaxis]) for (start,end) in zip(starts,ends)]
+            for (strokeNumber,hull) in enumerate(hulls):
+                hull[:,4] = strokeNumber
+            return numpy.concatenate([numpy.zeros((0,5))]+hulls)
+        raise NotImplementedError, 'Cannot draw with aperture {definition}'.format(definition=self.gerberFile.apertures[apertureNumber])
+    def _contourEntry(self,contourBatch,offset):
+        '''Edges of the regions and stroked outlines, numbered by contour, and the contours as (vertices, aperture number).'''
+        vertices = contourBatch.inMillimetres()
+        (edges,contours) = ([numpy.zeros((0,5))],[])
+        for (contourNumber,(start,end,apertureNumber)) in enumerate(contourBatch.contourSlices()):
+            contour = vertices[start:end] + numpy.concatenate([offset,[0.],offset])
+            contours.append((contour,apertureNumber))
+            points = [contour[0,0:2]]
+            for (x,y,interpolation,centreX,centreY) in contour[1:].tolist():
+                if interpolation >= ContourBatch.clockWise:
+                    points.extend(arcPoints(points[-1],numpy.array([x,y]),numpy.array([centreX,centreY]),interpolation == ContourBatch.counterClockWise,self.tolerance))
+                else:
+                    points.append(numpy.array([x,y]))
+            points = numpy.array(points)
+            if apertureNumber and len(points) > 1:
+                contourEdges = self._strokeEdges(points[:-1],points[1:],apertureNumber)
+            elif not apertureNumber and len(points) > 2:
+                if signedArea(points) < 0.:
+                    points = points[::-1]
+                contourEdges = polygonEdges(points[numpy.newaxis])
+            else:
+                continue
+            contourEdges[:,4] = contourNumber
+            edges.append(contourEdges)
+        return (numpy.concatenate(edges),(ContourBatch,contours))
+    def _layerGroups(self,layer,offset,dark,groups):
+        '''
+        Adds what the layer draws to the groups, as entries of edges and
+        (batch class, primitives), the primitives indexed by the polygon
+        numbers of the edges.
+        '''
+        entries = []
+        for batch in layer._batches:
+            if type(batch) is FlashBatch:
+                flashes = batch.inMillimetres()
+                isBlock = numpy.in1d(flashes[:,2].astype(int),self._blocks.keys())
+                for (start,end) in GerberRasteriser._runs(isBlock):
+                    if isBlock[start]:
+                        # the block is drawn in between, with its own polarities
+                        self._addGroup(groups,dark,entries)
+                        entries = []
+                        for (x,y,apertureNumber) in flashes[start:end].tolist():
+                            for blockLayer in self._blocks[int(apertureNumber)].layers:
+                                self._layerGroups(blockLayer,offset+[x,y],dark != blockLayer.inverted,groups)
+                    else:
+                        run = flashes[start:end]
+                        for apertureNumber in numpy.unique(run[:,2]).astype(int).tolist():
+                            selected = run[run[:,2] == apertureNumber] + numpy.append(offset,0.)
+                            edges = numpy.concatenate([polygonEdges(selected[:,numpy.newaxis,0:2]+polygon) for polygon in self._outline(apertureNumber)])
+                            entries.append((edges,(FlashBatch,selected)))
+            elif type(batch) is StrokeBatch:
+                strokes = batch.inMillimetres()
+                for apertureNumber in numpy.unique(strokes[:,4]).astype(int).tolist():
+                    selected = strokes[strokes[:,4] == apertureNumber] + numpy.append(numpy.tile(offset,2),0.)
+                    entries.append((self._strokeEdges(selected[:,0:2],selected[:,2:4],apertureNumber),(StrokeBatch,selected)))
+            elif type(batch) is ContourBatch:
+                entries.append(self._contourEntry(batch,offset))
+        self._addGroup(groups,dark,entries)
+    def _circles(self,batchClass,primitives):
+        '''(x, y, radius) of the circles that the outlines of the primitives follow.'''
+        circles = [numpy.zeros((0,3))]
+        def around(centres,radius):
+            circles.append(numpy.column_stack([centres,numpy.broadcast_to(radius,len(centres))]))
+        if batchClass is FlashBatch:
+            for apertureNumber in numpy.unique(primitives[:,2]).astype(int).tolist():
+                centres = primitives[primitives[:,2] == apertureNumber,0:2]
+                aperture = Aperture(self.gerberFile.apertures[apertureNumber])
+                (halfWidth,halfHeight) = aperture.halfSize
+                if aperture.shape == 'C':
+                    around(centres,halfWidth)
+                elif aperture.shape == 'O':
+                    radius = min(halfWidth,halfHeight)
+                    for end in [-1.,+1.]:
+                        around(centres+end*numpy.array([halfWidth-radius,halfHeight-radius]),radius)
+                if aperture.holeDiameter:
+                    around(centres,0.5*aperture.holeDiameter)
+        elif batchClass is StrokeBatch:
+            for apertureNumber in numpy.unique(primitives[:,4]).astype(int).tolist():
+                aperture = Aperture(self.gerberFile.apertures[apertureNumber])
+                if aperture.shape == 'C':
+                    strokes = primitives[primitives[:,4] == apertureNumber]
+                    around(numpy.concatenate([strokes[:,0:2],strokes[:,2:4]]),0.5*aperture.width)
+        else:
+            for (vertices,apertureNumber) in primitives:
+                arcs = numpy.flatnonzero(vertices[1:,2] >= ContourBatch.clockWise)+1
+                (centres,radii) = (vertices[arcs,3:5],numpy.hypot(*(vertices[arcs-1,0:2]-vertices[arcs,3:5]).T))
+                if not apertureNumber:
+                    around(centres,radii)
+                    continue
+                aperture = Aperture(self.gerberFile.apertures[apertureNumber])
+                if aperture.shape == 'C':
+                    halfWidth = 0.5*aperture.width
+                    around(vertices[:,0:2],halfWidth)
+                    around(centres,radii+halfWidth)
+                    around(centres,numpy.abs(radii-halfWidth))
+        return numpy.concatenate(circles)
+    @staticmethod
+    def _addGroup(groups,dark,entries):
+        if not entries or (not groups and not dark):
+            return # nothing drawn, or nothing to clear yet
+        if groups and groups[-1][0] == dark:
+            groups[-1][1].extend(entries)
+        else:
+            groups.append((dark,list(entries)))
+    @staticmethod
+    def _boxes(edges,count):
+        '''(xmin, ymin, xmax, ymax) of polygons 0 to count-1 of the edges, empty where there are none.'''
+        boxes = numpy.tile([numpy.inf,numpy.inf,-numpy.inf,-numpy.inf],(count,1))
+        polygonNumbers = edges[:,4].astype(int)
+        for (low,high) in [(0,2),(1,3)]:
+            numpy.minimum.at(boxes[:,low],polygonNumbers,numpy.minimum(edges[:,low],edges[:,high]))
+            numpy.maximum.at(boxes[:,high],polygonNumbers,numpy.maximum(edges[:,low],edges[:,high]))
+        return boxes
+    @staticmethod
+    def _selected(primitives,numbers):
+        return primitives[numbers] if type(primitives) is not list else [primitives[number] for number in numbers]
+    def _separated(self):
+        '''
+        (groups, kept, circles): the groups of edges still to be flattened, the
+        dark primitives that no later clear primitive touches, as (batch class,
+        primitives) in drawing order, and the circles of the others.
+        '''
+        if self._separation is None:
+            drawn = []
+            for layer in self.gerberFile.layers:
+                self._layerGroups(layer,numpy.zeros(2),not layer.inverted,drawn)
+            (groups,keptByGroup,circles) = ([],[],[numpy.zeros((0,3))])
+            laterClearBoxes = numpy.zeros((0,4))
+            for (dark,entries) in reversed(drawn):
+                (edgeArrays,kept,clearBoxes) = ([],[],[])
+                for (edges,(batchClass,primitives)) in entries:
+                    boxes = self._boxes(edges,len(primitives))
+                    if dark:
+                        touched = touchedBoxes(boxes,laterClearBoxes,self.resolution)
+                        keep = numpy.flatnonzero(~touched)
+                        if len(keep):
+                            kept.append((batchClass,self._selected(primitives,keep)))
+                        edges = edges[touched[edges[:,4].astype(int)]]
+                        circles.append(self._circles(batchClass,self._selected(primitives,numpy.flatnonzero(touched))))
+                    else:
+                        clearBoxes.append(boxes)
+                        circles.append(self._circles(batchClass,primitives))
+                    if len(edges):
+                        edgeArrays.append(edges)
+                laterClearBoxes = numpy.concatenate([laterClearBoxes]+clearBoxes)
+                groups.append((dark,edgeArrays))
+                keptByGroup.append(kept)
+            circles = numpy.round(numpy.concatenate(circles)/self.resolution)
+            if len(circles):
+                circles = numpy.unique(circles,axis=0)
+            circles *= self.resolution
+            self._separation = (groups[::-1],[primitives for kept in keptByGroup[::-1] for primitives in kept],circles)
+        return self._separation
+    def groups(self):
+        '''(dark, edge arrays) still to be flattened, in drawing order, one group per run of equal polarity.'''
+        return self._separated()[0]
+    @staticmethod
+    def edges(groups):
+        '''Upward edges as rows of (x0, y0, x1, y1, winding, group number, polygon number).'''
+        rows = []
+        polygonCount = 0
+        for (groupNumber,(dark,groupEdges)) in enumerate(groups):
+            for edges in groupEdges:
+                upwards = edges[:,3] > edges[:,1]
+                rows.append(numpy.column_stack([numpy.where(upwards[:,numpy.newaxis],edges[:,0:4],edges[:,[2,3,0,1]]),
+                                                numpy.where(upwards,1.,-1.),numpy.repeat(float(groupNumber),len(edges)),edges[:,4]+polygonCount]))
+                polygonCount += edges[:,4].max()+1
+        edges = numpy.round(numpy.concatenate([numpy.zeros((0,7))]+rows),9)
+        return edges[edges[:,3] != edges[:,1]]
+
+    @staticmethod
+    def _clipped(edges,left,right):
+        '''
+        Edges split where they cross x = left and x = right, with the parts
+        outside pushed onto these sides: windings inside are unchanged.
+        '''
+        (starts,ends) = (edges[:,0:2],edges[:,2:4])
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            fractions = (numpy.array([[left,right]])-starts[:,0:1])/(ends[:,0:1]-starts[:,0:1])
+        fractions = numpy.sort(numpy.clip(numpy.nan_to_num(fractions),0.,1.),axis=1)
+        fractions = numpy.column_stack([numpy.zeros(len(edges)),fractions,numpy.ones(len(edges))])
+        pieces = []
+        for piece in range(3):
+            (first,second) = (fractions[:,piece:piece+1],fractions[:,piece+1:piece+2])
+            pieces.append(numpy.column_stack([starts+first*(ends-starts),starts+second*(ends-starts),edges[:,4:]]))
+        pieces = numpy.concatenate(pieces)
+        pieces[:,[0,2]] = numpy.clip(pieces[:,[0,2]],left,right)
+        pieces[:,0:4] = numpy.round(pieces[:,0:4],9)
+        return pieces[pieces[:,3] > pieces[:,1]]
+    @staticmethod
+    def _slabEntries(ys,edges):
+        '''(edge number, slab, x at the slab bottom, x at the slab top) for every edge crossing a slab.'''
+        (edgeNumbers,slabs) = raggedRanges(numpy.searchsorted(ys,edges[:,1]),numpy.searchsorted(ys,edges[:,3]))
+        selected = edges[edgeNumbers]
+        slopes = (selected[:,2]-selected[:,0])/(selected[:,3]-selected[:,1])
+        return (edgeNumbers,slabs,selected[:,0]+(ys[slabs]-selected[:,1])*slopes,selected[:,0]+(ys[slabs+1]-selected[:,1])*slopes)
+    def _stripTrapezoids(self,edges,dark,left,right):
+        # sort keys: slab number plus the middle x, scaled into [0, 1)
+        def keys(slabs,bottoms,tops):
+            return slabs + 0.999*(0.5*(bottoms+tops)-left)/(right-left)
+
+        # split the slabs until no two edges cross inside one
+        ys = numpy.unique(edges[:,[1,3]])
+        while True:
+            (edgeNumbers,slabs,bottoms,tops) = self._slabEntries(ys,edges)
+            order = numpy.argsort(keys(slabs,bottoms,tops))
+            (first,second) = (order[:-1],order[1:])
+            crossing = (slabs[first] == slabs[second]) & ((bottoms[first] > bottoms[second]+1e-9) | (tops[first] > tops[second]+1e-9))
+            (first,second) = (first[crossing],second[crossing])
+            (bottomGaps,topGaps) = (bottoms[first]-bottoms[second],tops[first]-tops[second])
+            fractions = numpy.clip(bottomGaps/(bottomGaps-topGaps),0.,1.)
+            crossingYs = numpy.round(ys[slabs[first]] + fractions*(ys[slabs[first]+1]-ys[slabs[first]]),9)
+            refinedYs = numpy.union1d(ys,crossingYs)
+            if len(refinedYs) == len(ys):
+                break
+            ys = refinedYs
+
+        # combine the groups in order, as span boundaries (slab, bottom x, top x, +1 start/-1 end)
+        (windings,groupNumbers) = (edges[edgeNumbers,4],edges[edgeNumbers,5])
+        boundaries = numpy.zeros((0,4))
+        for groupNumber in numpy.unique(groupNumbers).astype(int).tolist():
+            inGroup = groupNumbers == groupNumber
+            entries = numpy.concatenate([numpy.column_stack([boundaries,numpy.zeros(len(boundaries))]),
+                                         numpy.column_stack([slabs[inGroup],bottoms[inGroup],tops[inGroup],numpy.zeros(inGroup.sum()),windings[inGroup]])])
+            entries = entries[numpy.argsort(keys(*entries[:,0:3].T))]
+            covered = numpy.cumsum(entries[:,3]) > 0.5
+            coveredByGroup = numpy.abs(numpy.cumsum(entries[:,4])) > 0.5
+            covered = (covered | coveredByGroup) if dark[groupNumber] else (covered & ~coveredByGroup)
+            changes = covered != numpy.concatenate([[False],covered[:-1]])
+            boundaries = numpy.column_stack([entries[changes,0:3],numpy.where(covered[changes],1.,-1.)])
+
+        (lefts,rights) = (boundaries[0::2],boundaries[1::2])
+        slabs = lefts[:,0].astype(int)
+        return numpy.column_stack([ys[slabs],ys[slabs+1],lefts[:,1],lefts[:,2],rights[:,1],rights[:,2]])
+    def trapezoids(self,edgesPerStrip=5000):
+        '''
+        Rows of (bottom, top, bottom left, top left, bottom right, top right).
+        The plane is evaluated in vertical strips of about edgesPerStrip edges,
+        so that slabs only hold edges that are close to each other.
+        '''
+        groups = self.groups()
+        edges = self.edges(groups)
+        if not len(edges):
+            return numpy.zeros((0,6))
+        dark = [dark for (dark,groupEdges) in groups]
+        polygonNumbers = edges[:,6].astype(int)
+        (polygonLefts,polygonRights) = (numpy.full(polygonNumbers.max()+1,numpy.inf),numpy.full(polygonNumbers.max()+1,-numpy.inf))
+        numpy.minimum.at(polygonLefts,polygonNumbers,numpy.minimum(edges[:,0],edges[:,2]))
+        numpy.maximum.at(polygonRights,polygonNumbers,numpy.maximum(edges[:,0],edges[:,2]))
+        # strip sides on the grid of the file, so the pieces of the regions meet exactly
+        middles = 0.5*(edges[:,0]+edges[:,2])
+        strips = int(numpy.ceil(len(edges)/float(edgesPerStrip)))
+        sides = numpy.round(numpy.percentile(middles,numpy.linspace(0.,100.,strips+1)[1:-1])/self.resolution)*self.resolution
+        sides = numpy.unique(numpy.concatenate([[polygonLefts.min()],sides,[polygonRights.max()]]))
+        trapezoids = []
+        for (left,right) in zip(sides[:-1],sides[1:]):
+            # polygons completely left or right of the strip do not change its windings
+            inStrip = (polygonLefts[polygonNumbers] < right) & (polygonRights[polygonNumbers] > left)
+            stripEdges = self._clipped(edges[inStrip],left,right)
+            if len(stripEdges):
+                trapezoids.append(self._stripTrapezoids(stripEdges,dark,left,right))
+        trapezoids = numpy.concatenate([numpy.zeros((0,6))]+trapezoids)
+        return trapezoids[(trapezoids[:,4]-trapezoids[:,2] > 1e-9) | (trapezoids[:,5]-trapezoids[:,3] > 1e-9)]
+
+    def regions(self):
+        '''
+        Counter-clockwise polygons (on the grid of the file) that together
+        cover the flattened part of the dark image: one per connected area,
+        holes joined to its outline by cut-ins.
+        '''
+        trapezoids = numpy.round(self.trapezoids()/self.resolution).astype(numpy.int64)
+        trapezoids = trapezoids[trapezoids[:,1] > trapezoids[:,0]] # slabs thinner than the grid
+        if not len(trapezoids):
+            return []
+        (points,regionNumbers) = self._bridged(*self._loops(self._boundary(trapezoids)))
+        (points,regionNumbers) = self._simplified(points,regionNumbers,removeCollinear=False)
+        while True:
+            count = len(points)
+            (points,regionNumbers) = self._simplified(points,regionNumbers,removeCollinear=True)
+            if len(points) == count:
+                break
+        regionStarts = numpy.flatnonzero(numpy.diff(numpy.concatenate([[-1],regionNumbers])))
+        return [region for region in numpy.split(points*self.resolution,regionStarts[1:]) if len(region) >= 3]
+    def contours(self,minimumArcEdges=3):
+        '''
+        The regions as rows of (x, y, interpolation, centre x, centre y), each
+        run of at least minimumArcEdges edges that keeps within tolerance of a
+        circle of the image joined into one arc.
+        '''
+        regions = self.regions()
+        if not regions:
+            return []
+        points = numpy.concatenate(regions)
+        lengths = numpy.array([len(region) for region in regions])
+        firsts = numpy.cumsum(lengths)-lengths
+        nexts = numpy.arange(1,len(points)+1)
+        nexts[firsts+lengths-1] = firsts
+        previous = numpy.zeros(len(points),dtype=nexts.dtype)
+        previous[nexts] = numpy.arange(len(points))
+        # the circles through both ends of an edge, close enough to it
+        circles = self._separated()[2]
+        margin = self.tolerance+self.resolution
+        (vertices,circleNumbers) = boxPairs(numpy.hstack([points,points]),numpy.hstack([circles[:,0:2]-circles[:,2:3],circles[:,0:2]+circles[:,2:3]]),margin)
+        onCircle = numpy.abs(numpy.hypot(*(points[vertices]-circles[circleNumbers,0:2]).T)-circles[circleNumbers,2]) <= margin
+        (vertices,circleNumbers) = (vertices[onCircle],circleNumbers[onCircle])
+        keys = numpy.sort(circleNumbers*len(points)+vertices)
+        followingKeys = circleNumbers*len(points)+nexts[vertices]
+        both = keys[numpy.minimum(numpy.searchsorted(keys,followingKeys),len(keys)-1)] == followingKeys if len(keys) else numpy.zeros(0,dtype=bool)
+        (vertices,circleNumbers) = (vertices[both],circleNumbers[both])
+        (fromCentre,toCentre) = (points[vertices]-circles[circleNumbers,0:2],points[nexts[vertices]]-circles[circleNumbers,0:2])
+        (chords,radii) = (numpy.hypot(*(toCentre-fromCentre).T),circles[circleNumbers,2])
+        turns = numpy.sign(fromCentre[:,0]*toCentre[:,1]-fromCentre[:,1]*toCentre[:,0])
+        close = (chords < 2.*radii) & (radii-numpy.sqrt(numpy.maximum(radii**2-0.25*chords**2,0.)) <= margin) & (turns != 0.)
+        # per edge the first such circle, and +1 counter-clockwise or -1 clockwise around it
+        edgeCircles = numpy.full(len(points),len(circles))
+        numpy.minimum.at(edgeCircles,vertices[close],circleNumbers[close])
+        edgeTurns = numpy.zeros(len(points))
+        chosen = close & (circleNumbers == edgeCircles[vertices])
+        edgeTurns[vertices[chosen]] = turns[chosen]
+        edgeCircles[edgeTurns == 0.] = -1
+        contours = []
+        for (first,length) in zip(firsts.tolist(),lengths.tolist()):
+            loop = numpy.arange(first,first+length)
+            while True:
+                # a vertex is kept where an edge does not continue the arc of the one before
+                starts = loop[(edgeCircles[loop] < 0) | (edgeCircles[loop] != edgeCircles[previous[loop]]) | (edgeTurns[loop] != edgeTurns[previous[loop]])]
+                if not len(starts):
+                    starts = loop[0:1] # a whole circle
+                runLengths = numpy.diff(numpy.append(starts,starts[0]+length))
+                short = (edgeCircles[starts] >= 0) & (runLengths < minimumArcEdges)
+                if not numpy.any(short):
+                    break
+                (runNumbers,positions) = raggedRanges(starts[short]-first,starts[short]-first+runLengths[short])
+                edgeCircles[loop[positions % length]] = -1
+            interpolations = numpy.where(edgeCircles[starts] < 0,ContourBatch.linear,numpy.where(edgeTurns[starts] > 0.,ContourBatch.counterClockWise,ContourBatch.clockWise))
+            centres = numpy.concatenate([circles[:,0:2],numpy.zeros((1,2))])[edgeCircles[starts]] # none for lines
+            contours.append(numpy.column_stack([points[numpy.append(starts,starts[0])],numpy.append(ContourBatch.move,interpolations),numpy.concatenate([numpy.zeros((1,2)),centres])]))
+        return contours
+    @classmethod
+    def _boundary(cls,trapezoids):
+        '''Edges (x0, y0, x1, y1) of the outline of the trapezoids, the inside on their left.'''
+        (bottoms,tops,bottomLefts,topLefts,bottomRights,topRights) = trapezoids.T
+        edges = numpy.concatenate([numpy.column_stack([bottomLefts,bottoms,bottomRights,bottoms]),
+                                   numpy.column_stack([bottomRights,bottoms,topRights,tops]),
+                                   numpy.column_stack([topRights,tops,topLefts,tops]),
+                                   numpy.column_stack([topLefts,tops,bottomLefts,bottoms])])
+        (horizontal,vertical) = (edges[:,1] == edges[:,3],edges[:,0] == edges[:,2])
+        return numpy.concatenate([cls._cancelledAlong(edges[horizontal & ~vertical],0),
+                                  cls._cancelledAlong(edges[vertical & ~horizontal],1),
+                                  cls._cancelledTwins(edges[~horizontal & ~vertical])])
+    @staticmethod
+    def _cancelledAlong(edges,axis):
+        '''
+        Edges along x (axis 0) or y (axis 1) without the parts where edges in
+        opposite directions overlap, as between neighbouring trapezoids.
+        '''
+        (along,across) = ([axis,axis+2],1-axis)
+        (starts,ends) = (edges[:,along[0]],edges[:,along[1]])
+        directions = numpy.where(ends > starts,1,-1)
+        # +direction where an edge starts and -direction where it ends, line by line
+        lines = numpy.concatenate([edges[:,across],edges[:,across]])
+        positions = numpy.concatenate([numpy.minimum(starts,ends),numpy.maximum(starts,ends)])
+        changes = numpy.concatenate([directions,-directions])
+        order = numpy.lexsort((positions,lines))
+        (lines,positions,changes) = (lines[order],positions[order],changes[order])
+        coverage = numpy.cumsum(changes)[:-1]
+        remaining = (lines[:-1] == lines[1:]) & (positions[:-1] < positions[1:]) & (coverage != 0)
+        (lines,lows,highs,forwards) = (lines[:-1][remaining],positions[:-1][remaining],positions[1:][remaining],coverage[remaining] > 0)
+        pieces = numpy.zeros((len(lines),4),dtype=edges.dtype)
+        (pieces[:,across],pieces[:,across+2]) = (lines,lines)
+        (pieces[:,along[0]],pieces[:,along[1]]) = (numpy.where(forwards,lows,highs),numpy.where(forwards,highs,lows))
+        return pieces
+    @staticmethod
+    def _cancelledTwins(edges):
+        '''Edges without the pairs that run between the same points in opposite directions.'''
+        if not len(edges):
+            return edges
+        backwards = (edges[:,0] > edges[:,2]) | ((edges[:,0] == edges[:,2]) & (edges[:,1] > edges[:,3]))
+        canonical = numpy.where(backwards[:,numpy.newaxis],edges[:,[2,3,0,1]],edges)
+        order = numpy.lexsort(canonical.T[::-1])
+        canonical = canonical[order]
+        firsts = numpy.flatnonzero(numpy.concatenate([[True],numpy.any(canonical[1:] != canonical[:-1],axis=1)]))
+        directions = numpy.add.reduceat(numpy.where(backwards[order],-1,1),firsts)
+        (canonical,directions) = (canonical[firsts][directions != 0],directions[directions != 0])
+        return numpy.where((directions < 0)[:,numpy.newaxis],canonical[:,[2,3,0,1]],canonical)
+    @staticmethod
+    def _cycles(successors):
+        '''
+        Order of the indices of a permutation cycle by cycle, each from its
+        smallest index on, and the cycle number at each position.
+        '''
+        count = len(successors)
+        # smallest index of every cycle, by pointer jumping
+        (leaders,jumps) = (numpy.arange(count),successors)
+        while True:
+            newLeaders = numpy.minimum(leaders,leaders[jumps])
+            jumps = jumps[jumps]
+            if numpy.array_equal(newLeaders,leaders):
+                break
+            leaders = newLeaders
+        # steps to the last index of the cycle, the one before its leader
+        isLast = successors == leaders
+        (steps,jumps) = (numpy.where(isLast,0,1),numpy.where(isLast,numpy.arange(count),successors))
+        while numpy.any(jumps[jumps] != jumps):
+            steps = steps + steps[jumps]
+            jumps = jumps[jumps]
+        order = numpy.lexsort((-steps,leaders))
+        return (order,numpy.unique(leaders,return_inverse=True)[1][order])
+    @classmethod
+    def _loops(cls,edges):
+        '''
+        Start points of the edges in the order of the closed loops they form,
+        and the loop number of each. Where loops meet in a vertex, each turns
+        left as far as it can, so that it keeps to its own area.
+        '''
+        origin = edges[:,0:2].min(axis=0)
+        rowLength = edges[:,1].max()-origin[1]+1
+        (starts,ends) = [(edges[:,column]-origin[0])*rowLength+edges[:,column+1]-origin[1] for column in [0,2]]
+        order = numpy.argsort(starts,kind='mergesort')
+        (lows,highs) = (numpy.searchsorted(starts[order],ends,'left'),numpy.searchsorted(starts[order],ends,'right'))
+        assert numpy.all(highs > lows), 'the outline is not closed'
+        successors = order[lows]
+        branches = numpy.flatnonzero(highs-lows > 1)
+        if len(branches):
+            (numbers,positions) = raggedRanges(lows[branches],highs[branches])
+            (incoming,outgoing) = (edges[branches[numbers]].astype(float),edges[order[positions]].astype(float))
+            (inX,inY,outX,outY) = (incoming[:,2]-incoming[:,0],incoming[:,3]-incoming[:,1],outgoing[:,2]-outgoing[:,0],outgoing[:,3]-outgoing[:,1])
+            turns = numpy.arctan2(inX*outY-inY*outX,inX*outX+inY*outY)
+            turns[turns >= numpy.pi] = -numpy.pi # turning back comes last
+            best = numpy.lexsort((turns,numbers))
+            lasts = numpy.flatnonzero(numpy.diff(numpy.append(numbers[best],len(branches))))
+            successors[branches] = order[positions[best[lasts]]]
+        (order,loopNumbers) = cls._cycles(successors)
+        return (edges[order,0:2],loopNumbers)
+    @staticmethod
+    def _clockwiseTurn(xs,ys,p,q,r):
+        '''Twice the area of the triangle of vertices p, q and r, positive when it turns clockwise.'''
+        return (ys[q]-ys[p])*(xs[r]-xs[q]) - (xs[q]-xs[p])*(ys[r]-ys[q])
+    @classmethod
+    def _holeBridge(cls,hole,xs,ys,nexts,previous,rings,active):
+        '''
+        Vertex that the leftmost vertex of a hole can be joined to without
+        crossing an outline, found as in earcut: the end of the closest edge
+        to the left, or the vertex in between at the smallest angle.
+        '''
+        (hx,hy) = (xs[hole],ys[hole])
+        vertices = numpy.flatnonzero(active)
+        followers = nexts[vertices]
+        crossed = (ys[vertices] >= hy) & (ys[followers] <= hy) & (ys[vertices] != ys[followers])
+        (vertices,followers) = (vertices[crossed],followers[crossed])
+        (x0,y0,x1,y1) = [values.astype(float) for values in (xs[vertices],ys[vertices],xs[followers],ys[followers])]
+        crossings = x0 + (hy-y0)*(x1-x0)/(y1-y0)
+        toTheLeft = numpy.flatnonzero(crossings <= hx)
+        if not len(toTheLeft):
+            return None
+        closest = toTheLeft[numpy.argmax(crossings[toTheLeft])]
+        (qx,edgeEnds) = (crossings[closest],[vertices[closest],followers[closest]])
+        if qx == hx:
+            # the hole touches the edge, at one of its ends or in between
+            touching = [vertex for vertex in edgeEnds if xs[vertex] == hx and ys[vertex] == hy]
+            return touching[0] if touching else min(edgeEnds,key=lambda vertex: xs[vertex])
+        bridge = min(edgeEnds,key=lambda vertex: xs[vertex])
+        # vertices of the same outline inside the triangle of the hole vertex, the crossing and the edge end
+        (mx,my) = (xs[bridge],ys[bridge])
+        candidates = numpy.flatnonzero(active & (rings == rings[bridge]))
+        (px,py) = (xs[candidates].astype(float),ys[candidates].astype(float))
+        ((ax,ay),(cx,cy)) = ((hx,hy),(qx,hy)) if hy < my else ((qx,hy),(hx,hy))
+        inside = (hx >= px) & (px >= mx) & (hx != px) & \
+                 ((cx-px)*(ay-py) >= (ax-px)*(cy-py)) & ((ax-px)*(my-py) >= (mx-px)*(ay-py)) & ((mx-px)*(cy-py) >= (cx-px)*(my-py))
+        candidates = candidates[inside]
+        # of those, the ones with the hole vertex inside their corner
+        (before,after) = (previous[candidates],nexts[candidates])
+        holes = numpy.repeat(hole,len(candidates))
+        convex = cls._clockwiseTurn(xs,ys,before,candidates,after) < 0
+        locallyInside = numpy.where(convex,(cls._clockwiseTurn(xs,ys,candidates,holes,after) >= 0) & (cls._clockwiseTurn(xs,ys,candidates,before,holes) >= 0),
+                                           (cls._clockwiseTurn(xs,ys,candidates,holes,before) < 0) | (cls._clockwiseTurn(xs,ys,candidates,after,holes) < 0))
+        candidates = candidates[locallyInside]
+        if len(candidates):
+            tangents = numpy.abs(hy-ys[candidates])/(hx-xs[candidates]).astype(float)
+            bridge = candidates[numpy.lexsort((-xs[candidates],tangents))[0]]
+        return bridge
+    @classmethod
+    def _bridged(cls,points,loopNumbers):
+        '''
+        Points and region numbers of the counter-clockwise loops, with the
+        clockwise loops (holes) joined into the loop around them by a cut-in
+        from their leftmost vertex, leftmost holes first.
+        '''
+        count = len(points)
+        firsts = numpy.flatnonzero(numpy.diff(numpy.concatenate([[-1],loopNumbers])))
+        lasts = numpy.append(firsts[1:],count)-1
+        nexts = numpy.arange(1,count+1)
+        nexts[lasts] = firsts
+        (xs,ys) = (points[:,0],points[:,1])
+        areas = numpy.add.reduceat(xs*ys[nexts]-xs[nexts]*ys,firsts)
+        holes = numpy.flatnonzero(areas < 0)
+        # room for the two vertices every cut-in adds
+        extra = 2*len(holes)
+        (xs,ys,nexts) = [numpy.append(values,numpy.zeros(extra,dtype=values.dtype)) for values in (xs,ys,nexts)]
+        previous = numpy.zeros(count+extra,dtype=nexts.dtype)
+        previous[nexts[:count]] = numpy.arange(count)
+        rings = numpy.append(loopNumbers,numpy.zeros(extra,dtype=loopNumbers.dtype))
+        active = numpy.zeros(count+extra,dtype=bool)
+        active[:count] = areas[loopNumbers] > 0
+        leftmost = numpy.lexsort((ys[:count],xs[:count],loopNumbers))[firsts]
+        size = count
+        for hole in holes[numpy.lexsort((ys[leftmost[holes]],xs[leftmost[holes]]))].tolist():
+            vertex = leftmost[hole]
+            bridge = cls._holeBridge(vertex,xs,ys,nexts,previous,rings[:size],active[:size])
+            if bridge is None:
+                continue # not inside any outline
+            # bridge, vertex, around the hole, vertex copy, bridge copy, what followed the bridge
+            (bridgeCopy,vertexCopy) = (size,size+1)
+            (xs[size:size+2],ys[size:size+2]) = ([xs[bridge],xs[vertex]],[ys[bridge],ys[vertex]])
+            (afterBridge,beforeVertex) = (nexts[bridge],previous[vertex])
+            (nexts[bridge],previous[vertex]) = (vertex,bridge)
+            (nexts[bridgeCopy],previous[afterBridge]) = (afterBridge,bridgeCopy)
+            (nexts[vertexCopy],previous[bridgeCopy]) = (bridgeCopy,vertexCopy)
+            (nexts[beforeVertex],previous[vertexCopy]) = (vertexCopy,beforeVertex)
+            rings[firsts[hole]:lasts[hole]+1] = rings[bridge]
+            rings[size:size+2] = rings[bridge]
+            active[firsts[hole]:lasts[hole]+1] = True
+            active[size:size+2] = True
+            size += 2
+        selected = numpy.flatnonzero(active[:size])
+        compact = numpy.zeros(size,dtype=selected.dtype)
+        compact[selected] = numpy.arange(len(selected))
+        (order,regionNumbers) = cls._cycles(compact[nexts[selected]])
+        return (numpy.column_stack([xs[selected[order]],ys[selected[order]]]),regionNumbers)
+    @staticmethod
+    def _simplified(points,regionNumbers,removeCollinear):
+        '''
+        Polygons without repeated vertices, or without (every other) vertex
+        that lies within one grid step of the line through its neighbours.
+        '''
+        numbers = numpy.arange(len(points))
+        firsts = numpy.flatnonzero(numpy.diff(numpy.concatenate([[-1],regionNumbers])))
+        lasts = numpy.append(firsts[1:],len(points))-1
+        isFirst = numpy.zeros(len(points),dtype=bool)
+        isFirst[firsts] = True
+        isLast = numpy.zeros(len(points),dtype=bool)
+        isLast[lasts] = True
+        previous = numpy.where(isFirst,lasts[numpy.searchsorted(firsts,numbers,side='right')-1],numbers-1)
+        following = numpy.where(isLast,firsts[numpy.searchsorted(firsts,numbers,side='right')-1],numbers+1)
+        if removeCollinear:
+            (toPrevious,toNext) = ((points[previous]-points).astype(float),(points[following]-points).astype(float))
+            chords = numpy.hypot(*(toNext-toPrevious).T)
+            straight = numpy.abs(toPrevious[:,0]*toNext[:,1]-toPrevious[:,1]*toNext[:,0]) <= chords
+            # of a run of straight vertices, only remove every other one per pass
+            runStarts = straight & ~numpy.concatenate([[False],straight[:-1]]) | isFirst
+            runNumbers = numpy.cumsum(runStarts)
+            runFirsts = numpy.flatnonzero(runStarts)
+            keep = ~(straight & ((numbers-runFirsts[runNumbers-1]) % 2 == 0))
+        else:
+            keep = numpy.any(points != points[previous],axis=1)
+        return (points[keep],regionNumbers[keep])
+
+    def flattened(self):
+        '''
+        A GerberFile that draws the same image with a single dark layer: the
+        regions, then the kept primitives with the apertures they use.
+        '''
+        source = self.gerberFile
+        if any([layer.inverted for layer in source.panelLayers]):
+            raise NotImplementedError, 'Cannot flatten clear panel layers'
+        flat = GerberFile(source.name,inverted=source.inverted,decimalPlaces=source.decimalPlaces,physicalLayer=source.physicalLayer,export=source.export,optimise=source.optimise,grid=source.grid)
+        flat.stepAndRepeat = source.stepAndRepeat
+        # one closed G36/G37 contour per region
+        for contour in self.contours():
+            flat[0]._batch(ContourBatch).addContour(contour)
+        kept = self._separated()[1]
+        for (batchClass,primitives) in kept:
+            if batchClass is ContourBatch:
+                for (vertices,apertureNumber) in primitives:
+                    flat[0]._batch(ContourBatch).addContour(vertices,apertureNumber)
+            else:
+                flat[0]._batch(batchClass).extend(primitives)
+        if kept:
+            for apertureNumber in sorted(flat[0].apertureNumbers()):
+                flat.apertures[apertureNumber] = source.apertures[apertureNumber]
+                flat._apertureNumbers[source.apertures[apertureNumber]] = apertureNumber
+            flat._nextApertureNumber = source._nextApertureNumber
+        if source.panelLayers:
+            # panel layers are kept as they are, with the apertures they use
+            flat.apertures = dict(source.apertures)
+            flat.apertureMacros = list(source.apertureMacros)
+            flat.blockApertures = list(source.blockApertures)
+            for layer in source.panelLayers:
+                flat.addPanelLayer(layer.inverted)._batches = layer._batches
+        return flat
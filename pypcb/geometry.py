@@ -1,9 +1,12 @@
 import numpy
-from copy import deepcopy
+import math
+import bisect
+from collections import OrderedDict
 
 from lazy import *
+from utility import raggedRanges
 
-collisionDetection = False # set to False to speed up (useful for debugging)
+collisionDetection = True # set to False to keep loose holes apart (useful for debugging)
 
 def m(lengthInMeters):
     return lengthInMeters*1000.
@@ -80,12 +83,102 @@ class Drawable(object):
     def draw(self):
         raise NotImplementedError
 
+class BlockFootprint(object):
+    '''
+    Mixin for components that are drawn again and again. With useBlockApertures,
+    the first draw() records drawFootprint() as one block aperture per GerberLayer
+    it touches; every placement with the same footprintKey() is then a single
+    flash per layer, plus its holes. Subclasses provide location and stack.
+    drawAt() places the footprint at many locations in one go.
+    '''
+    useBlockApertures = False
+    def footprintKey(self):
+        raise NotImplementedError
+    def drawFootprint(self):
+        raise NotImplementedError
+    def draw(self):
+        from rs274x import BlockRecording
+        if not self.useBlockApertures or BlockRecording.active:
+            self.drawFootprint()
+            return
+        (flashes,holes) = self._blockFootprint()
+        for (gerberLayer,apertureNumber,offset) in flashes:
+            gerberLayer.flashAperture(self.location+offset,apertureNumber)
+        for (hole,fixed) in holes:
+            self.stack.addHole(Hole(hole.location+self.location,hole.diameter,hole.plated,self.stack),fixed)
+    def _blockFootprint(self):
+        key = (self.__class__,self.footprintKey())
+        if key not in self.stack.blockFootprints:
+            (recording,holes) = self._recordFootprint(key)
+            self.stack.blockFootprints[key] = (recording.flashes(self.location),holes)
+        return self.stack.blockFootprints[key]
+    def _recordFootprint(self,key):
+        '''
+        Draws drawFootprint() into a BlockRecording of its own, also inside
+        another one, and returns it with the holes added meanwhile, as
+        [(hole,fixed)] relative to location.
+        '''
+        from rs274x import BlockRecording
+        holes = []
+        def addHole(hole,fixed=True):
+            holes.append((Hole(hole.location-self.location,hole.diameter,hole.plated),fixed))
+        def addHoles(locations,diameter,plated=True,fixed=True):
+            for location in numpy.asarray(locations,dtype=float).reshape(-1,2):
+                addHole(Hole(location,diameter,plated),fixed)
+        def addLooseHoles(locations,diameter,plated=True):
+            addHoles(locations,diameter,plated,fixed=False)
+        stack = self.stack
+        (holeAdders,outerRecording) = ((stack.addHole,stack.addHoles,stack.addLooseHoles),BlockRecording.active)
+        (stack.addHole,stack.addHoles,stack.addLooseHoles) = (addHole,addHoles,addLooseHoles)
+        BlockRecording.active = None
+        try:
+            with BlockRecording(key) as recording:
+                self.drawFootprint()
+        finally:
+            (stack.addHole,stack.addHoles,stack.addLooseHoles) = holeAdders
+            BlockRecording.active = outerRecording
+        return (recording,holes)
+    def flatFootprint(self):
+        '''
+        ([(gerberLayer,apertureNumber,offset)],[(hole,fixed)]) relative to
+        location, as drawFootprint() draws them without block apertures, for
+        footprints of flashes and holes only. None by default: drawAt() then
+        records drawFootprint() once and copies whatever it draws.
+        '''
+        return None
+    def _copiedFootprint(self,locations):
+        '''Draws what drawFootprint() draws at every location and returns ([],holes) as flatFootprint() would.'''
+        (recording,holes) = self._recordFootprint(None)
+        for (targetLayer,blockLayer) in zip(recording.targetLayers,recording.blockLayers):
+            blockLayer.translate(-numpy.asarray(self.location)[:2])
+            targetLayer.addCopies(blockLayer,locations)
+        return ([],holes)
+    def drawAt(self,locations):
+        '''
+        Draws the footprint at every row of an (n,2) array of locations, as
+        draw() would after moving it there: one flash batch per layer and
+        one hole array per hole.
+        '''
+        from rs274x import BlockRecording
+        locations = numpy.asarray(locations,dtype=float).reshape(-1,2)
+        if self.useBlockApertures and not BlockRecording.active:
+            (flashes,holes) = self._blockFootprint()
+        else:
+            (flashes,holes) = self.flatFootprint() or self._copiedFootprint(locations)
+        for (gerberLayer,apertureNumber,offset) in flashes:
+            gerberLayer.addFlashes(locations+offset[:2],apertureNumber)
+        for (hole,fixed) in holes:
+            if fixed:
+                self.stack.addHoles(locations+hole.location[:2],hole.diameter,hole.plated)
+            else:
+                self.stack.addLooseHoles(locations+hole.location[:2],hole.diameter,hole.plated)
+
 class Hole(Drawable):
     margin = 0.1
         
     def __init__(self,location,diameter,plated=True,stack=None):
         assert location is not None
-        self.location = deepcopy(location)
+        self.location = asLocation(location)
         self.diameter = diameter
         self.plated = plated
         self.stack = stack
@@ -102,40 +195,142 @@ class Hole(Drawable):
     def draw(self):
         self.stack.addHole(self)
     def translate(self,translationVector):
-        self.location += translationVector
+        self.location = self.location + translationVector
     def rectangularHull(self):
         return Circle(self.location,self.diameter).rectangularHull()    
         
             
+def closePoints(points,margin):
+    '''Whether every point has another point closer than margin, found in a grid of cells of margin.'''
+    close = numpy.zeros(len(points),dtype=bool)
+    if len(points) < 2:
+        return close
+    cells = numpy.floor((points-points.min(axis=0))/margin).astype(numpy.int64)+1
+    rowLength = cells[:,0].max()+2
+    keys = cells[:,1]*rowLength+cells[:,0]
+    sortedPoints = numpy.argsort(keys,kind='mergesort')
+    sortedKeys = keys[sortedPoints]
+    neighbourKeys = (keys[:,None]+numpy.array([dy*rowLength+dx for dy in (-1,0,1) for dx in (-1,0,1)])[None,:]).ravel()
+    (pairNumbers,positions) = raggedRanges(numpy.searchsorted(sortedKeys,neighbourKeys,'left'),numpy.searchsorted(sortedKeys,neighbourKeys,'right'))
+    (pointNumbers,candidates) = (pairNumbers//9,sortedPoints[positions])
+    distances = numpy.hypot(*(points[candidates]-points[pointNumbers]).T)
+    close[pointNumbers[(candidates != pointNumbers) & (distances < margin)]] = True
+    return close
+
 class HoleFile(object):
     def __init__(self,platedFile,nonPlatedFile):
         self.platedFile = platedFile
         self.nonPlatedFile = nonPlatedFile        
         
         self.fixedHoles = []
-        self.looseHoles = []
-        
+        self.holeArrays = [] # fixed (position in fixedHoles,locations,diameter,plated) added in bulk
+        # loose holes by insertion number, hashed by diameter, plating and cell of Hole.margin
+        self._looseHoles = {}
+        self._looseCells = {}
+        self._nextLooseNumber = 0
         
+    @property
+    def looseHoles(self):
+        return [self._looseHoles[number] for number in sorted(self._looseHoles)]
+    @staticmethod
+    def _cell(hole):
+        return (hole.diameter,hole.plated,int(numpy.floor(hole.location[0]/Hole.margin)),int(numpy.floor(hole.location[1]/Hole.margin)))
+    def _addLooseHole(self,hole,number=None):
+        if number is None:
+            number = self._nextLooseNumber
+            self._nextLooseNumber += 1
+        self._looseHoles[number] = hole
+        self._looseCells.setdefault(self._cell(hole),[]).append(number)
+    def _closeLooseHole(self,newHole):
+        '''Number of the earliest loose hole of the same diameter and plating too close to newHole, or None.'''
+        (diameter,plated,column,row) = self._cell(newHole)
+        candidates = []
+        for cell in [(diameter,plated,column+dc,row+dr) for dc in (-1,0,1) for dr in (-1,0,1)]:
+            candidates += self._looseCells.get(cell,[])
+        for number in sorted(candidates):
+            if self._looseHoles[number].tooClose(newHole):
+                return number
+        return None
     def addHole(self,newHole,fixed=True):
         if fixed or collisionDetection == False:
             self.fixedHoles.append(newHole)
         else:
-            for looseHole in self.looseHoles:
-                if looseHole.tooClose(newHole):
-                    looseHole.mergeInPlace(newHole)
-                    self.fixedHoles.append(looseHole)
-                    self.looseHoles.remove(looseHole)
-                    break
+            number = self._closeLooseHole(newHole)
+            if number is None:
+                self._addLooseHole(newHole)
             else:
-                self.looseHoles.append(newHole)
+                looseHole = self._looseHoles.pop(number)
+                self._looseCells[self._cell(looseHole)].remove(number)
+                looseHole.mergeInPlace(newHole)
+                self.fixedHoles.append(looseHole)
+    def addLooseHoles(self,locations,diameter,plated=True):
+        '''
+        Adds an (n,2) array of loose hole locations with the same diameter,
+        as addHole(Hole(location,diameter,plated),fixed=False) one by one would.
+        Only holes with a neighbour within Hole.margin are merged one by one.
+        '''
+        locations = numpy.array(locations,dtype=float).reshape(-1,2)
+        if not collisionDetection:
+            self.addHoles(locations,diameter,plated)
+            return
+        # only loose holes of the same diameter and plating are merged
+        looseHoles = [hole for hole in self._looseHoles.values() if (hole.diameter,hole.plated) == (diameter,plated)]
+        existing = numpy.array([hole.location[:2] for hole in looseHoles],dtype=float).reshape(-1,2)
+        crowded = closePoints(numpy.vstack([existing,locations]),Hole.margin)[len(existing):]
+        firstNumber = self._nextLooseNumber
+        self._nextLooseNumber += len(locations)
+        for (index,location) in enumerate(locations):
+            hole = Hole(Location(location),diameter,plated)
+            if crowded[index]:
+                number = self._closeLooseHole(hole)
+                if number is not None:
+                    looseHole = self._looseHoles.pop(number)
+                    self._looseCells[self._cell(looseHole)].remove(number)
+                    looseHole.mergeInPlace(hole)
+                    self.fixedHoles.append(looseHole)
+                    continue
+            self._addLooseHole(hole,firstNumber+index)
+    def addHoles(self,locations,diameter,plated=True):
+        '''Adds an (n,2) array of fixed hole locations with the same diameter.'''
+        self.holeArrays.append((len(self.fixedHoles),numpy.array(locations,dtype=float).reshape(-1,2),diameter,plated))
     
-    def writeOut(self,*args,**kwargs):
-        for hole in self.fixedHoles + self.looseHoles:
-            if hole.plated:
-                self.platedFile.addHole(hole.location,hole.diameter)
+    def holeGroups(self):
+        '''
+        (locations,diameter,plated) of all holes, one array per diameter and
+        plating. Fixed holes keep the order they were added in, bulk or not.
+        '''
+        groups = OrderedDict()
+        def addLocations(diameter,plated,locations):
+            pieces = groups.setdefault((diameter,plated),[])
+            if isinstance(locations,numpy.ndarray):
+                pieces.append(locations)
+            elif pieces and isinstance(pieces[-1],list):
+                pieces[-1].append(locations)
             else:
-                self.nonPlatedFile.addHole(hole.location,hole.diameter)
-                
+                pieces.append([locations])
+        start = 0
+        for (position,locations,diameter,plated) in self.holeArrays+[(len(self.fixedHoles),None,None,None)]:
+            for hole in self.fixedHoles[start:position]:
+                addLocations(hole.diameter,hole.plated,hole.location[:2])
+            start = position
+            if locations is not None:
+                addLocations(diameter,plated,locations)
+        for hole in self.looseHoles:
+            addLocations(hole.diameter,hole.plated,hole.location[:2])
+        return [(numpy.vstack([numpy.array(piece,dtype=float).reshape(-1,2) for piece in pieces]),diameter,plated) for ((diameter,plated),pieces) in groups.items()]
+    def fillDrillFiles(self,offsets=None):
+        '''Adds all holes to the plated and non-plated drill files, once per offset.'''
+        if offsets is None:
+            offsets = [Vector([0.,0.])]
+        groups = self.holeGroups()
+        for offset in offsets:
+            for (locations,diameter,plated) in groups:
+                if plated:
+                    self.platedFile.addHoles(locations+offset[:2],diameter)
+                else:
+                    self.nonPlatedFile.addHoles(locations+offset[:2],diameter)
+    def writeOut(self,*args,**kwargs):
+        self.fillDrillFiles(kwargs.pop('offsets',None))
         self.platedFile.writeOut(*args,**kwargs)
         self.nonPlatedFile.writeOut(*args,**kwargs)
 
@@ -181,16 +376,130 @@ class Vector(numpy.ndarray):
     def approximatelyGreaterOrEqualTo(self,other,margin=1e-6):
         return self-other > -margin
 
-class PlaneVector(Vector):
-    def __new__(cls,dx,dy=None):
-        if isinstance(dx,numpy.ndarray):
-            dy=dx[1]
-            dx=dx[0]
-        return Vector.__new__(cls,[float(dx),float(dy)]) 
-    def orthogonal(self):
-        return Vector.__new__(self.__class__,numpy.dot(numpy.array([[0,1],[-1,0]]),self))
+class PlaneVector(object):
+    '''
+    Immutable two-dimensional vector of two Python floats, so it is shared
+    rather than copied. It indexes and iterates like a pair and converts to
+    NumPy with numpy.asarray; arrays of many vectors are handled with
+    toArray and listFromArray.
+    '''
+    __slots__ = ('x','y')
+    __array_priority__ = 100. # NumPy operands defer to the reflected operators
+    def __init__(self,dx,dy=None):
+        if dy is None:
+            (dx,dy) = dx[0],dx[1]
+        _setX(self,float(dx))
+        _setY(self,float(dy))
+    @classmethod
+    def _new(cls,x,y):
+        vector = object.__new__(cls)
+        _setX(vector,x)
+        _setY(vector,y)
+        return vector
+    def __setattr__(self,name,value):
+        raise AttributeError, '{className} is immutable'.format(className=self.__class__.__name__)
+    def __delattr__(self,name):
+        raise AttributeError, '{className} is immutable'.format(className=self.__class__.__name__)
+    @staticmethod
+    def toArray(vectors):
+        '''(n,2) array of the coordinates of vectors.'''
+        return numpy.array([(vector[0],vector[1]) for vector in vectors],dtype=float).reshape(-1,2)
+    @classmethod
+    def listFromArray(cls,array):
+        '''Vectors of this class for the rows of an (n,2) array, taken as they are.'''
+        return [cls._new(x,y) for (x,y) in numpy.asarray(array,dtype=float).reshape(-1,2).tolist()]
+    
+    def __len__(self):
+        return 2
+    def __getitem__(self,index):
+        return (self.x,self.y)[index]
+    def __iter__(self):
+        yield self.x
+        yield self.y
+    def __array__(self,dtype=None):
+        return numpy.array((self.x,self.y),dtype=dtype)
+    def tolist(self):
+        return [self.x,self.y]
+    def __reduce__(self):
+        return (_newPlaneVector,(self.__class__,self.x,self.y))
+    def __copy__(self):
+        return self
+    def __deepcopy__(self,memo):
+        return self
+    def __eq__(self,other):
+        try:
+            return self.x == other[0] and self.y == other[1] and len(other) == 2
+        except (TypeError,IndexError):
+            return False
+    def __ne__(self,other):
+        return not self == other
+    def __hash__(self):
+        return hash((self.x,self.y))
+    def __repr__(self):
+        return '{className}({x!r},{y!r})'.format(className=self.__class__.__name__,x=self.x,y=self.y)
     def __str__(self):
-        return '[{x:8.2f},{y:8.2f}]'.format(x=self[0],y=self[1])
+        return '[{x:8.2f},{y:8.2f}]'.format(x=self.x,y=self.y)
+    
+    # a Location moved by a vector stays a Location, the difference of two is a PlaneVector
+    def __add__(self,other):
+        if isinstance(other,PlaneVector):
+            sumClass = Location if isinstance(self,Location) or isinstance(other,Location) else PlaneVector
+            return sumClass._new(self.x+other.x,self.y+other.y)
+        if isinstance(other,numpy.ndarray) and other.ndim != 1:
+            return numpy.array((self.x,self.y))+other
+        return (Location if isinstance(self,Location) else PlaneVector)._new(self.x+other[0],self.y+other[1])
+    def __radd__(self,other):
+        if isinstance(other,numpy.ndarray) and other.ndim != 1:
+            return other+numpy.array((self.x,self.y))
+        return (Location if isinstance(self,Location) else PlaneVector)._new(other[0]+self.x,other[1]+self.y)
+    def __sub__(self,other):
+        if isinstance(other,PlaneVector):
+            differenceClass = Location if isinstance(self,Location) and not isinstance(other,Location) else PlaneVector
+            return differenceClass._new(self.x-other.x,self.y-other.y)
+        if isinstance(other,numpy.ndarray) and other.ndim != 1:
+            return numpy.array((self.x,self.y))-other
+        return (Location if isinstance(self,Location) else PlaneVector)._new(self.x-other[0],self.y-other[1])
+    def __rsub__(self,other):
+        if isinstance(other,numpy.ndarray) and other.ndim != 1:
+            return other-numpy.array((self.x,self.y))
+        return PlaneVector._new(other[0]-self.x,other[1]-self.y)
+    def _scaledClass(self):
+        return PlaneVector
+    def __mul__(self,factor):
+        if isinstance(factor,(float,int,long,numpy.number)):
+            return self._scaledClass()._new(self.x*factor,self.y*factor)
+        if isinstance(factor,numpy.ndarray) and factor.ndim != 1:
+            return numpy.array((self.x,self.y))*factor
+        return self._scaledClass()._new(self.x*factor[0],self.y*factor[1])
+    def __rmul__(self,factor):
+        if isinstance(factor,(float,int,long,numpy.number)):
+            return self._scaledClass()._new(factor*self.x,factor*self.y)
+        if isinstance(factor,numpy.ndarray) and factor.ndim != 1:
+            return factor*numpy.array((self.x,self.y))
+        return self._scaledClass()._new(factor[0]*self.x,factor[1]*self.y)
+    def __div__(self,divisor):
+        return self._scaledClass()._new(self.x/divisor,self.y/divisor)
+    __truediv__ = __div__
+    def __neg__(self):
+        return self._new(-self.x,-self.y)
+    def __pos__(self):
+        return self
+    
+    def length(self):
+        return math.sqrt(self.x*self.x+self.y*self.y)
+    def assertAlmostEqual(self,other,margin=1e-6):
+        assert self.almostEqualTo(other,margin), '{self} is not almost {other}'.format(self=self,other=other)
+    def almostEqualTo(self,other,margin=1e-6):
+        (dx,dy) = (self.x-other[0],self.y-other[1])
+        return math.sqrt(dx*dx+dy*dy) < margin
+    def approximatelyGreaterOrEqualTo(self,other,margin=1e-6):
+        return numpy.array((self.x-other[0],self.y-other[1])) > -margin
+    def orthogonal(self):
+        return self._new(self.y,-self.x)
+
+(_setX,_setY) = (PlaneVector.x.__set__,PlaneVector.y.__set__)
+def _newPlaneVector(cls,x,y):
+    return cls._new(x,y)
 
 class LocationList(list):
     def containsalmostEqualTo(self,candidate):
@@ -200,34 +509,36 @@ class LocationList(list):
         return False
 
 class Location(PlaneVector):
-    def __sub__(self,other):
-        difference = numpy.ndarray.__sub__(self,other)
-        if type(other) == Location:
-            return PlaneVector(difference[0],difference[1])
-        else:                
-            return Location(difference[0],difference[1])
-    def __add__(self,other):
-        sum = numpy.ndarray.__add__(self,other)
-        return Location(sum[0],sum[1])
+    __slots__ = ()
+    def _scaledClass(self):
+        return Location
     def belowAndLeftOf(self,other):
-        return (self[1] <= other[1]) and (self[0] <= other[0])
+        return (self.y <= other[1]) and (self.x <= other[0])
+
+def asLocation(location):
+    '''The Location itself, which is safe to share, or a new one made from a pair.'''
+    if location is None or isinstance(location,Location):
+        return location
+    return Location(location)
 
 
 class Direction(PlaneVector):
-    def __new__(cls,x,y=None):
-        newVector = PlaneVector.__new__(cls,x,y)
-        newVector /= newVector.length()
-        return newVector
+    __slots__ = ()
+    def __init__(self,x,y=None):
+        PlaneVector.__init__(self,x,y)
+        length = self.length()
+        _setX(self,self.x/length)
+        _setY(self,self.y/length)
     def __str__(self):
         for nominalDirection in ['N','NW','W','SW','S','SE','E','NE']:
             if self.almostEqualTo(eval(nominalDirection)):
                 return nominalDirection
         else:
-            return super(self).__repr__()
+            return self.__repr__()
     def parallelWith(self,other):
         return self.almostEqualTo(other) or self.almostEqualTo(-1*other)
     def angle(self):
-        return numpy.arctan2(self[1],self[0])
+        return math.atan2(self.y,self.x)
 N  = Direction(0,1)
 NW = Direction(-1,1)
 W  = Direction(-1,0)
@@ -305,9 +616,21 @@ class ALine(Convertible):
                 return crossing
 
 class Arrow(object):
+    '''Immutable origin and direction; derived arrows are new objects.'''
+    __slots__ = ('origin','direction')
     def __init__(self,origin,direction):
-        self.origin = deepcopy(origin)
-        self.direction = deepcopy(direction)
+        _setOrigin(self,asLocation(origin))
+        _setDirection(self,direction if isinstance(direction,Direction) else Direction._new(float(direction[0]),float(direction[1])))
+    def __setattr__(self,name,value):
+        raise AttributeError, 'Arrow is immutable'
+    def __delattr__(self,name):
+        raise AttributeError, 'Arrow is immutable'
+    def __reduce__(self):
+        return (Arrow,(self.origin,self.direction))
+    def __copy__(self):
+        return self
+    def __deepcopy__(self,memo):
+        return self
     def __repr__(self):
         return 'Arrow({origin},{direction})'.format(origin=self.origin,direction=self.direction)
     def __add__(self,vector):
@@ -318,20 +641,22 @@ class Arrow(object):
         return self.origin.almostEqualTo(other.origin,margin) and self.direction.almostEqualTo(other.direction,margin)
         
     def angle(self):
-        return Scalar(numpy.arctan2(self.direction[1],self.direction[0]))
+        return Scalar(math.atan2(self.direction[1],self.direction[0]))
     def reversed(self):
         return self.rotated(numpy.pi)
     def rotated(self,rotationAngle):
-        return Arrow(self.origin,Direction(numpy.cos(self.angle()+rotationAngle),numpy.sin(self.angle()+rotationAngle)))
+        angle = self.angle()+rotationAngle
+        return Arrow(self.origin,Direction(math.cos(angle),math.sin(angle)))
     @classmethod
     def rotationMatrix(cls,rotationAngle):
         return numpy.array([[numpy.cos(rotationAngle),-numpy.sin(rotationAngle)],
                       [numpy.sin(rotationAngle), numpy.cos(rotationAngle)]])
     def rotatedAround(self,rotationOrigin,rotationAngle):
-        rotationMatrix = self.rotationMatrix(rotationAngle)
-        radius = self.origin - rotationOrigin
-        newLocation = rotationOrigin + numpy.dot(rotationMatrix,radius)
-        newDirection = Direction(numpy.dot(rotationMatrix,self.direction))
+        (cosine,sine) = (math.cos(rotationAngle),math.sin(rotationAngle))
+        (dx,dy) = (self.origin[0]-rotationOrigin[0],self.origin[1]-rotationOrigin[1])
+        newLocation = Location._new(rotationOrigin[0]+(cosine*dx-sine*dy),rotationOrigin[1]+(sine*dx+cosine*dy))
+        (dx,dy) = (self.direction[0],self.direction[1])
+        newDirection = Direction(cosine*dx-sine*dy,sine*dx+cosine*dy)
         return Arrow(newLocation,newDirection)
     
     def turnedLeft(self):
@@ -350,13 +675,10 @@ class Arrow(object):
     def outsetArrow(self,clearance):
         return Arrow(self.right(clearance),self.direction)
     def repeatRight(self,pitch,repetitions):
-        repeatedArrows = []
-        for clearance in numpy.arange(repetitions)*pitch:
-            repeatedArrows += [self.outsetArrow(clearance)]
-        return repeatedArrows
+        return ArrowArray.fromArrows([self]).outsetArrow(numpy.arange(repetitions)*pitch).arrows()
         
     def along(self,length):
-        return Location(self.origin+self.direction*length)
+        return Location._new(self.origin[0]+self.direction[0]*length,self.origin[1]+self.direction[1]*length)
     def alongArrow(self,length):
         return Arrow(self.along(length),self.direction)
     def translated(self,translationVector):
@@ -364,21 +686,94 @@ class Arrow(object):
     
     def intersection(self,other):
         return ALine(arrow=self).intersection(ALine(arrow=other))
+(_setOrigin,_setDirection) = (Arrow.origin.__set__,Arrow.direction.__set__)
+
+class ArrowArray(object):
+    '''
+    Origins and directions of many arrows as (n,2) arrays. The operations
+    of Arrow apply to all arrows at once; lengths, clearances and angles
+    are scalars or one value per arrow.
+    '''
+    def __init__(self,origins,directions):
+        (self.origins,self.directions) = numpy.broadcast_arrays(numpy.asarray(origins,dtype=float).reshape(-1,2),numpy.asarray(directions,dtype=float).reshape(-1,2))
+    @classmethod
+    def fromArrows(cls,arrows):
+        values = numpy.array([(arrow.origin.x,arrow.origin.y,arrow.direction.x,arrow.direction.y) for arrow in arrows],dtype=float).reshape(-1,4)
+        return cls(values[:,:2],values[:,2:])
+    @classmethod
+    def concatenate(cls,arrowArrays):
+        return cls(numpy.vstack([arrows.origins for arrows in arrowArrays]),numpy.vstack([arrows.directions for arrows in arrowArrays]))
+    def __len__(self):
+        return len(self.origins)
+    def __getitem__(self,index):
+        if isinstance(index,(int,long,numpy.integer)):
+            return Arrow(Location._new(*self.origins[index].tolist()),Direction._new(*self.directions[index].tolist()))
+        return ArrowArray(self.origins[index],self.directions[index])
+    def __iter__(self):
+        return iter(self.arrows())
+    def __repr__(self):
+        return 'ArrowArray({origins},{directions})'.format(origins=self.origins.tolist(),directions=self.directions.tolist())
+    def arrows(self):
+        return [Arrow(origin,direction) for (origin,direction) in zip(Location.listFromArray(self.origins),Direction.listFromArray(self.directions))]
+    @staticmethod
+    def _column(values):
+        return numpy.asarray(values,dtype=float)[...,None]
+    
+    def angles(self):
+        return numpy.arctan2(self.directions[:,1],self.directions[:,0])
+    def reversed(self):
+        return self.rotated(numpy.pi)
+    def rotated(self,rotationAngles):
+        angles = self.angles()+rotationAngles
+        directions = numpy.column_stack([numpy.cos(angles),numpy.sin(angles)])
+        return ArrowArray(self.origins,directions/numpy.sqrt(numpy.square(directions).sum(axis=1))[:,None])
+    def rotatedAround(self,rotationOrigin,rotationAngles):
+        (cosine,sine) = (self._column(numpy.cos(rotationAngles)),self._column(numpy.sin(rotationAngles)))
+        rotationOrigin = numpy.asarray(rotationOrigin,dtype=float)[...,:2]
+        (dx,dy) = ((self.origins-rotationOrigin)[:,:1],(self.origins-rotationOrigin)[:,1:])
+        origins = rotationOrigin+numpy.hstack([cosine*dx-sine*dy,sine*dx+cosine*dy])
+        (dx,dy) = (self.directions[:,:1],self.directions[:,1:])
+        directions = numpy.hstack([cosine*dx-sine*dy,sine*dx+cosine*dy])
+        return ArrowArray(origins,directions/numpy.sqrt(numpy.square(directions).sum(axis=1))[:,None])
+    
+    def turnedLeft(self):
+        return self.rotated(+.5*numpy.pi)
+    def turnedRight(self):
+        return self.rotated(-.5*numpy.pi)
+    def left(self,clearances):
+        return self.turnedLeft().along(clearances)
+    def right(self,clearances):
+        return self.turnedRight().along(clearances)
+    
+    def leftRight(self,clearances):
+        return (self.left(clearances),self.right(clearances))
+    def rightLeft(self,clearances):
+        return (self.right(clearances),self.left(clearances))
+    def outsetArrow(self,clearances):
+        return ArrowArray(self.right(clearances),self.directions)
+    
+    def along(self,lengths):
+        '''(n,2) array of the locations lengths along the arrows.'''
+        return self.origins+self.directions*self._column(lengths)
+    def alongArrow(self,lengths):
+        return ArrowArray(self.along(lengths),self.directions)
+    def translated(self,translationVectors):
+        return ArrowArray(self.origins+numpy.asarray(translationVectors,dtype=float)[...,:2],self.directions)
 
 ## Naked geometry
 class Segment(object):
     pass
 class Stroke(Segment):
     def __init__(self,targetLocation):
-        self.targetLocation = deepcopy(targetLocation)
+        self.targetLocation = asLocation(targetLocation)
     def __repr__(self):
         return 'Stroke({location})'.format(location=self.targetLocation)
     def assertAlmostEqual(self,other):
         self.targetLocation.assertAlmostEqual(other.targetLocation)
 class Arc(Segment):
     def __init__(self,targetLocation,origin,counterClockWise):
-        self.targetLocation = deepcopy(targetLocation)
-        self.origin = deepcopy(origin)
+        self.targetLocation = asLocation(targetLocation)
+        self.origin = asLocation(origin)
         self.counterClockWise = counterClockWise
 class ClosedContour(RotatableList):
     def outset(self,outsetClearance):
@@ -470,7 +865,8 @@ class ClosedStrokeContour(ClosedContour):
 class Path(object):
     def closed(self):
         return self.endArrow.origin.almostEqualTo(self.startArrow.origin)
-    def stamp(self,targetPitch,stampFunctionOfArrow,center=False):
+    def stampLengths(self,targetPitch,center=False):
+        '''Path lengths of the stamps spread evenly at about targetPitch.'''
         if center:
             offset = 0.5*targetPitch
         else:
@@ -481,14 +877,24 @@ class Path(object):
             numberOfSteps = numberOfStamps
         else:
             numberOfSteps = numberOfStamps + 1
-        for length in numpy.arange(numberOfSteps)*realPitch:
-            stampFunctionOfArrow(self.alongArrow(length+offset))
+        return numpy.arange(numberOfSteps)*realPitch+offset
+    def stampArrows(self,targetPitch,center=False):
+        return self.alongArrows(self.stampLengths(targetPitch,center))
+    def stamp(self,targetPitch,stampFunctionOfArrow,center=False):
+        for arrow in self.stampArrows(targetPitch,center):
+            stampFunctionOfArrow(arrow)
+    def stampBatch(self,targetPitch,stampFunctionOfArrows,center=False):
+        '''Like stamp(), but calls stampFunctionOfArrows once with an ArrowArray of all stamps.'''
+        stampFunctionOfArrows(self.stampArrows(targetPitch,center))
+    def alongArrows(self,lengths):
+        '''ArrowArray of alongArrow() at every length.'''
+        return ArrowArray.fromArrows([self.alongArrow(length) for length in numpy.asarray(lengths,dtype=float).tolist()])
     @property
     def halfwayArrow(self):
         return self.alongArrow(self.length/2.)
 class Bend(Path):
     def __init__(self,length,bendRadius,startArrow=Arrow(Location(0.,0.),Direction(1.,0.))):
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
         self.length = length
         self.bendRadius = bendRadius
     def __repr__(self):
@@ -510,6 +916,8 @@ class Bend(Path):
         return arrow.rotated(numpy.pi/2).along(self.bendRadius)
     def alongArrow(self,pathLength):
         return self.startArrow.rotatedAround(self.absoluteOrigin(),pathLength/self.bendRadius)
+    def alongArrows(self,pathLengths):
+        return ArrowArray.fromArrows([self.startArrow]).rotatedAround(self.absoluteOrigin(),numpy.asarray(pathLengths,dtype=float)/self.bendRadius)
   
     def paint(self,gerberLayer,width):
         startEdge = self.startArrow.leftRight(width/2)
@@ -523,7 +931,7 @@ class Bend(Path):
 class MiteredBend(Path):
     def __init__(self,startArrow,width,thickness):
         '''http://www.microwaves101.com/encyclopedia/mitered_bends.cfm'''
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
         self.width = width
         self.thickness = thickness
     @property
@@ -566,7 +974,7 @@ class LineSegment(Path):
             self.startArrow = Arrow(startEnd[0],Direction(delta))
             self.length = delta.length()
         else:
-            self.startArrow = deepcopy(startArrow)
+            self.startArrow = startArrow
             self.length = length
     def __repr__(self):
         return 'LineSegment({length})'.format(length=self.length)
@@ -630,6 +1038,8 @@ class LineSegment(Path):
     
     def alongArrow(self,length):
         return self.startArrow.alongArrow(length)
+    def alongArrows(self,lengths):
+        return ArrowArray.fromArrows([self.startArrow]).alongArrow(numpy.asarray(lengths,dtype=float))
     def paint(self,gerberLayer,width):
         self.outline(width).draw(gerberLayer)
     
@@ -645,11 +1055,11 @@ class LineSegment(Path):
 class Rectangle(Drawable): #was list
     def __init__(self,startArrow=None,width=None,height=None,gerberLayer=None,apertureNumber=None,bottomLeft=None,topRight=None,rectangle=None):
         if rectangle is not None:
-            self.startArrow = deepcopy(rectangle.startArrow)
+            self.startArrow = rectangle.startArrow
             self.width = rectangle.width
             self.height = rectangle.height
         elif type(bottomLeft) is type(None):
-            self.startArrow = deepcopy(startArrow)
+            self.startArrow = startArrow
             self.width = width
             self.height = height
         else:
@@ -716,7 +1126,7 @@ class Square(Rectangle):
         
 class Circle(Drawable):
     def __init__(self,center=None,diameter=None,gerberLayer=None):
-        self.center = deepcopy(center)
+        self.center = asLocation(center)
         self.diameter = diameter
         self.gerberLayer = gerberLayer
     def __str__(self):
@@ -730,7 +1140,7 @@ class Circle(Drawable):
         cornerVector = Vector([0.5,0.5])*self.diameter
         return Rectangle(bottomLeft=self.center-cornerVector,topRight=self.center+cornerVector)
     def translate(self,translationVector):
-        self.center += translationVector
+        self.center = self.center + translationVector
     
     
     #TODO: factor this out
@@ -745,34 +1155,75 @@ class Circle(Drawable):
 class CompositeCurve(RotatableList,Path):
     '''
     Curve that may consist of LineSegments, Bends and Turns. Start and end
-    arrows of segments do not necessarily kiss.
+    arrows of segments do not necessarily kiss. The lengths up to each
+    segment end are cached until segments are added, removed or replaced;
+    segments must not change length once in the curve.
     '''
     @property
     def endArrow(self):
         return self[-1].endArrow
 
+    @property
+    def segmentEnds(self):
+        '''Path lengths at the end of every segment.'''
+        if '_segmentEnds' not in self.__dict__:
+            self._segmentEnds = numpy.cumsum([path.length for path in self]).tolist()
+        return self._segmentEnds
      
     @property
     def length(self):
-        accumulatedLength = 0.
-        for path in self:
-            accumulatedLength += path.length
-        return accumulatedLength
+        if not self:
+            return 0.
+        return self.segmentEnds[-1]
             
     def alongArrow(self,length):
-        accumulatedLength = length
-        for path in self:
-            if accumulatedLength <= path.length:
-                return path.alongArrow(accumulatedLength)
-            else:
-                accumulatedLength -= path.length
-        else:
-            return path.endArrow.alongArrow(accumulatedLength)
+        segmentEnds = self.segmentEnds
+        segmentNumber = bisect.bisect_left(segmentEnds,length)
+        if segmentNumber == len(self):
+            return self[-1].endArrow.alongArrow(length-segmentEnds[-1])
 #             raise ValueError,'{0:f} is longer than {1:f}'.format(length,self.length)
+        if segmentNumber == 0:
+            return self[0].alongArrow(length)
+        return self[segmentNumber].alongArrow(length-segmentEnds[segmentNumber-1])
+    def alongArrows(self,lengths):
+        '''
+        ArrowArray of alongArrow() at every length. LineSegments and Bends are
+        evaluated together from their start arrows, other paths one by one.
+        '''
+        lengths = numpy.asarray(lengths,dtype=float).reshape(-1)
+        segmentStarts = numpy.array([0.]+self.segmentEnds)
+        segmentNumbers = numpy.searchsorted(segmentStarts[1:],lengths,'left')
+        remaining = lengths-segmentStarts[segmentNumbers]
+        # beyond the end, continue straight on from the end arrow
+        startArrows = ArrowArray.fromArrows([path.startArrow for path in self]+[self[-1].endArrow])
+        kinds = numpy.array([0 if isinstance(path,LineSegment) else 1 if isinstance(path,Bend) else 2 for path in self]+[0])[segmentNumbers]
+        bendRadii = numpy.array([getattr(path,'bendRadius',0.) for path in self]+[0.])[segmentNumbers]
+        (origins,directions) = (numpy.empty((len(lengths),2)),numpy.empty((len(lengths),2)))
+        straight = kinds == 0
+        arrows = startArrows[segmentNumbers[straight]].alongArrow(remaining[straight])
+        (origins[straight],directions[straight]) = (arrows.origins,arrows.directions)
+        bent = kinds == 1
+        bendStarts = startArrows[segmentNumbers[bent]]
+        arrows = bendStarts.rotatedAround(bendStarts.turnedLeft().along(bendRadii[bent]),remaining[bent]/bendRadii[bent])
+        (origins[bent],directions[bent]) = (arrows.origins,arrows.directions)
+        for segmentNumber in numpy.unique(segmentNumbers[kinds == 2]).tolist():
+            onPath = segmentNumbers == segmentNumber
+            arrows = self[segmentNumber].alongArrows(remaining[onPath])
+            (origins[onPath],directions[onPath]) = (arrows.origins,arrows.directions)
+        return ArrowArray(origins,directions)
             
     def paint(self,gerberLayer,width):
         for path in self:
             path.paint(gerberLayer,width)
+def _forgettingSegmentEnds(name):
+    listMethod = getattr(list,name)
+    def method(self,*args):
+        self.__dict__.pop('_segmentEnds',None)
+        return listMethod(self,*args)
+    method.__name__ = name
+    return method
+for name in ['append','extend','insert','remove','pop','reverse','sort','__setitem__','__delitem__','__setslice__','__delslice__','__iadd__','__imul__']:
+    setattr(CompositeCurve,name,_forgettingSegmentEnds(name))
 
 
 
@@ -782,7 +1233,7 @@ class Trace(CompositeCurve):
     '''
     def __init__(self,startArrow,width=None):
         super(Trace,self).__init__()
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
         self.width = width
         
     def append(self,newPath):
@@ -797,7 +1248,7 @@ class Trace(CompositeCurve):
     def propagateArrows(self):
         startArrow = self.startArrow
         for path in self:
-            path.startArrow = deepcopy(startArrow)
+            path.startArrow = startArrow
             startArrow = path.endArrow
          
 class LineList(CompositeCurve):
@@ -898,12 +1349,14 @@ class CoplanarTrace(Trace):
             
             viaSpan = self.width+2*self.gap+2*self.viaClearance
             numberOfVias = int((viaEnd-self.viaStartOffset)/self.viaPitch)
-            for (viaNumber,viaAlongLength) in enumerate(numpy.linspace(self.viaStartOffset,viaEnd,numberOfVias)):
-                leftRight = self.alongArrow(viaAlongLength).leftRight(viaSpan/2)
-                if viaNumber not in drillLeftSkip:
-                    drillFile.addHole(Hole(leftRight[0],self.viaDiameter),fixed=False)
-                if viaNumber not in drillRightSkip:
-                    drillFile.addHole(Hole(leftRight[1],self.viaDiameter),fixed=False)
+            viaArrows = self.alongArrows(numpy.linspace(self.viaStartOffset,viaEnd,numberOfVias))
+            (lefts,rights) = viaArrows.leftRight(viaSpan/2)
+            (leftKept,rightKept) = (numpy.ones(numberOfVias,dtype=bool),numpy.ones(numberOfVias,dtype=bool))
+            leftKept[[viaNumber for viaNumber in drillLeftSkip if 0 <= viaNumber < numberOfVias]] = False
+            rightKept[[viaNumber for viaNumber in drillRightSkip if 0 <= viaNumber < numberOfVias]] = False
+            # left and right holes alternate along the trace, as drawn before
+            viaLocations = numpy.stack([lefts,rights],axis=1)[numpy.stack([leftKept,rightKept],axis=1)]
+            drillFile.addLooseHoles(viaLocations,self.viaDiameter)
                 
         
 #         self.append(LineSegment(self.gap))
@@ -986,7 +1439,7 @@ class Sma(object):
             trace.viaEndOffset = mil(25)
         
     def __init__(self,startArrow,trace):
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
         self.trace = trace
     
     def draw(self,topFile,solderMaskTop,solderMaskBottom=None):
@@ -1014,7 +1467,7 @@ class Soic(object):
     dropExcessHeight = 0.15
         
     def __init__(self,startArrow=Arrow(Location(0.,0.),E),padClearance=0.4,solderMaskClearance=.1):
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
         self.padClearance = padClearance
         self.solderMaskClearance = solderMaskClearance
     
@@ -1022,9 +1475,8 @@ class Soic(object):
         heightOffset = float(self.numberOfPins)/4.-0.5
         startTopLeft = self.startArrow.reversed().alongArrow(self.span/2-self.padWidth/2).outsetArrow(heightOffset*self.pitch)
         startBottomRight =        self.startArrow.alongArrow(self.span/2-self.padWidth/2).outsetArrow(heightOffset*self.pitch)
-        padArrows = startTopLeft.repeatRight(-self.pitch,self.numberOfPins/2) + startBottomRight.repeatRight(-self.pitch,self.numberOfPins/2)        
-        padCenters = map(lambda arrow: arrow.along(self.padWidth/2),padArrows)            
-        return (padCenters,padArrows)
+        padArrows = ArrowArray.concatenate([ArrowArray.fromArrows([startArrow]).outsetArrow(numpy.arange(self.numberOfPins/2)*-self.pitch) for startArrow in (startTopLeft,startBottomRight)])
+        return (Location.listFromArray(padArrows.along(self.padWidth/2)),padArrows.arrows())
     
     def endArrows(self):
         return map(lambda padArrow: padArrow.alongArrow(self.padWidth),self.padCentersAndArrows()[1])
@@ -1142,7 +1594,7 @@ class R0805ToGround:
     padGap = 0.76    
     
     def __init__(self,startArrow):
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
     def draw(self,face):
         Rectangle(self.startArrow,self.padLength,self.padWidth).outline().drawToFace(face,solderMask=True,isolation=None)
         Rectangle(self.startArrow.alongArrow(self.padLength+self.padGap),self.padLength,self.padWidth).outline().drawToFace(face,solderMask=True)
@@ -1,7 +1,6 @@
 # -*- coding: windows-1252 -*-
 from geometry import *
 from stroketext import *
-from copy import deepcopy
 
 lightSpeed = m(2.99792458e8) #mm/s
 
@@ -42,10 +41,11 @@ class GtemCard():
         
         stitchingPitch = max(self.stitchingPitch(),stack.classification.viaStitchingPitch(stack.classification.minimumFinishedHoleDiameter))
         
-        def viaStamp(arrowAlongBorder):
-            MinimumVia(arrowAlongBorder.turnedRight(),stack=stack,inner=True).draw()     
-        extraGroundPlane.outline().lines()[0].reversed().stamp(stitchingPitch,viaStamp,center=True)
-        groundVoidRectangle(self.center(),self.bottomWidth,bottomCornerHeight).lines().stamp(stitchingPitch,viaStamp)
+        stitchingVia = MinimumVia(location=Location(0.,0.),stack=stack,inner=True)
+        def viaStamp(arrowsAlongBorder):
+            stitchingVia.drawAt(MinimumVia.locationsAlong(arrowsAlongBorder.turnedRight(),stack,inner=True))
+        extraGroundPlane.outline().lines()[0].reversed().stampBatch(stitchingPitch,viaStamp,center=True)
+        groundVoidRectangle(self.center(),self.bottomWidth,bottomCornerHeight).lines().stampBatch(stitchingPitch,viaStamp)
         
         
         ## registration holes
@@ -100,7 +100,7 @@ class HSensor:
         StrokeText(connector.labelArrow,'H ({loopLength:.2f}x{height:.2f}mm)'.format(loopLength=loopLength,height=self.face.depth-self.face.thickness),self.face.opposite.silkscreen[0],align=0).draw()
 
         
-class Via(DrawGroup):
+class Via(BlockFootprint,DrawGroup):
     def __init__(self,location=None,finishedHoleDiameter=None,padFaceDiameterTuples=[],antipadDiameter=None,isolateFaces=[],skipFaces=[],stack=None):
         self.location = location
         self.finishedHoleDiameter = finishedHoleDiameter
@@ -135,6 +135,19 @@ class Via(DrawGroup):
             self.finishedHoleDiameter = maximumFinishedHoleSize
         assert self.finishedHoleDiameter <= maximumFinishedHoleSize
         self.append(Hole(self.location,self.finishedHoleDiameter,plated=True,stack=self.stack))
+    def footprintKey(self):
+        return (self.finishedHoleDiameter,self.antipadDiameter,tuple(self.padFaceDiameterTuples),tuple(self.isolateFaces),tuple(self.skipFaces))
+    def drawFootprint(self):
+        DrawGroup.draw(self)
+    def flatFootprint(self):
+        flashes = []
+        holes = []
+        for drawable in self:
+            if isinstance(drawable,Hole):
+                holes.append((Hole(drawable.location-self.location,drawable.diameter,drawable.plated),True))
+            else:
+                flashes.append((drawable.gerberLayer,drawable.gerberLayer.gerberFile.addCircularAperture(drawable.diameter),drawable.center-self.location))
+        return (flashes,holes)
         
     
 
@@ -143,13 +156,18 @@ class MinimumVia(Via):
     def __init__(self,startArrow=None,location=None,finishedHoleDiameter=None,stack=None,inner=False,*args,**kwargs):
         if not finishedHoleDiameter:
             finishedHoleDiameter = stack.classification.minimumFinishedHoleDiameter
-        padDiameter = stack.classification.viaClearance(finishedHoleDiameter,inner=inner)
         if type(location) == type(None):
-            location = startArrow.along(padDiameter)
+            location = self.locationsAlong(startArrow,stack,finishedHoleDiameter,inner)
                 
         super(MinimumVia,self).__init__(location = location,finishedHoleDiameter=finishedHoleDiameter,stack=stack,*args,**kwargs)
+    @classmethod
+    def locationsAlong(cls,startArrows,stack,finishedHoleDiameter=None,inner=False):
+        '''Via locations along an Arrow or ArrowArray, as startArrow places a single via.'''
+        if not finishedHoleDiameter:
+            finishedHoleDiameter = stack.classification.minimumFinishedHoleDiameter
+        return startArrows.along(stack.classification.viaClearance(finishedHoleDiameter,inner=inner))
     
-class MolexSma:
+class MolexSma(BlockFootprint):
     '''http://www.molex.com/pdm_docs/sd/732511850_sd.pdf'''
     mountingHoleClearance = 3.58
     mountingHoleDiameter = 2.2#1.6
@@ -173,10 +191,16 @@ class MolexSma:
     @property
     def center(self):
         return self.startArrow.origin 
+    location = center
+    @property
+    def stack(self):
+        return self.face.stack
     @property
     def labelArrow(self):
         return self.startArrow.alongArrow(3.5).turnedRight()
-    def draw(self):     
+    def footprintKey(self):
+        return (tuple(self.startArrow.direction),self.face,tuple(self.signalFaceDiameterTuples),tuple(self.groundFaces),self.groundStartAngle,self.groundStopAngle,self.groundVias)
+    def drawFootprint(self):     
         stack = self.face.stack
         Circle(self.center,self.groundPadDiameter+stack.classification.solderMaskMisalignment*2,self.face.solderMask[10]).draw()       
         Circle(self.center,self.groundPadDiameter,self.face.copper[10]).draw()
@@ -192,8 +216,8 @@ class MolexSma:
             else:
                 viaAngles = numpy.linspace(self.groundStartAngle,self.groundStartAngle+2.*numpy.pi,self.groundVias,endpoint=False)
             
-            for viaAngle in viaAngles:
-                MinimumVia(self.startArrow.rotated(viaAngle).alongArrow(self.groundGapDiameter/2.),inner=True,skipFaces=[self.face]+self.groundFaces,stack=stack).draw()
+            for viaArrow in ArrowArray.fromArrows([self.startArrow]).rotated(viaAngles).alongArrow(self.groundGapDiameter/2.):
+                MinimumVia(viaArrow,inner=True,skipFaces=[self.face]+self.groundFaces,stack=stack).draw()
 
         # Mounting holes
         stack.addHole(Hole(self.startArrow.right(self.mountingHoleClearance),self.mountingHoleDiameter,plated=False))
@@ -202,7 +226,7 @@ class MolexSma:
         # Placement outline
         Rectangle(self.startArrow.alongArrow(-self.keepOutWidth/2).outsetArrow(self.keepOutHeight/2),self.keepOutWidth,self.keepOutHeight,stack[0].silkscreen[0],0).draw()
 
-class MolexSmdSma(DrawGroup):
+class MolexSmdSma(BlockFootprint,DrawGroup):
     padSpacing = 4.75
     groundPadSize = 1.91
     centerPadSize = 1.52    
@@ -212,6 +236,7 @@ class MolexSmdSma(DrawGroup):
         DrawGroup.__init__(self)        
         self.startArrow = startArrow
         self.face = face
+        self.drawVias = drawVias
         
         sides = Square(centerArrow=self.startArrow, width=self.padSpacing).outline().lines()
 
@@ -225,6 +250,16 @@ class MolexSmdSma(DrawGroup):
         signalCopperPad = Circle(self.startArrow.origin,self.centerPadSize)
         signalPad = CirclePad(signalCopperPad,self.face,solderMask = True,isolation=None)
         self.append(signalPad)
+    @property
+    def location(self):
+        return self.startArrow.origin
+    @property
+    def stack(self):
+        return self.face.stack
+    def footprintKey(self):
+        return (tuple(self.startArrow.direction),self.face,self.drawVias)
+    def drawFootprint(self):
+        DrawGroup.draw(self)
 
 class AgilentProbePads(object):
     groundRecess = 0.49
@@ -249,7 +284,7 @@ class RingResonator(DrawGroup):
     gapToTraceWidthRatio = 0.5
 
     def __init__(self,face,traceWidth,firstResonanceFrequency,effectiveRelativePermittivity,startArrow=Arrow(Location(0,0),E),startLayer=10):
-        self.startArrow = deepcopy(startArrow)
+        self.startArrow = startArrow
         self.face = face
         self.firstResonanceFrequency = firstResonanceFrequency
         self.traceWidth = traceWidth
@@ -0,0 +1,389 @@
+import numpy
+
+from rs274x import GerberFile,TextBatch,FlashBatch,StrokeBatch,ContourBatch
+from utility import raggedRanges
+
+def slabInterval(slope,intercept,lower,upper):
+    '''Interval of t where lower <= slope*t + intercept <= upper, empty as (+inf,-inf).'''
+    flat = abs(slope) < 1e-12
+    slope = numpy.where(flat,1.,slope)
+    (first,second) = ((lower-intercept)/slope,(upper-intercept)/slope)
+    inside = (intercept >= lower) & (intercept <= upper)
+    return (numpy.where(flat,numpy.where(inside,-numpy.inf,numpy.inf),numpy.minimum(first,second)),
+            numpy.where(flat,numpy.where(inside,numpy.inf,-numpy.inf),numpy.maximum(first,second)))
+
+def circleChord(dy,radius):
+    '''Half chord of a circle at dy from its centre, -inf where the line misses it.'''
+    squared = radius**2 - dy**2
+    return numpy.where(squared >= 0.,numpy.sqrt(numpy.maximum(squared,0.)),-numpy.inf)
+
+class Aperture(object):
+    '''Standard aperture (C, R, O or P), cut into horizontal spans around its centre.'''
+    def __init__(self,definition):
+        (shape,separator,parameters) = definition.partition(',')
+        if shape not in ['C','R','O','P'] or not parameters:
+            raise NotImplementedError, 'Cannot rasterise aperture {definition}'.format(definition=definition)
+        values = [float(value) for value in parameters.split('X')]
+        self.shape = shape
+        self.rotation = 0.
+        if shape == 'C':
+            (self.width,self.height) = (values[0],values[0])
+            holeValues = values[1:]
+        elif shape == 'P':
+            (self.width,self.height) = (values[0],values[0])
+            self.vertices = int(values[1])
+            if len(values) > 2:
+                self.rotation = numpy.radians(values[2])
+            holeValues = values[3:]
+        else:
+            (self.width,self.height) = values[0:2]
+            holeValues = values[2:]
+        self.holeDiameter = holeValues[0] if holeValues else 0.
+    @property
+    def halfSize(self):
+        return numpy.array([0.5*self.width,0.5*self.height])
+    def spans(self,dy):
+        '''Two (left, right) pieces per dy, empty pieces have left > right.'''
+        (halfWidth,halfHeight) = self.halfSize
+        if self.shape == 'C':
+            right = circleChord(dy,halfWidth)
+            left = -right
+        elif self.shape == 'R':
+            right = numpy.where(abs(dy) <= halfHeight,halfWidth,-numpy.inf)
+            left = -right
+        elif self.shape == 'O':
+            radius = min(halfWidth,halfHeight)
+            right = (halfWidth-radius) + circleChord(numpy.maximum(abs(dy)-(halfHeight-radius),0.),radius)
+            left = -right
+        else:
+            apothem = halfWidth*numpy.cos(numpy.pi/self.vertices)
+            (left,right) = (numpy.full(dy.shape,-numpy.inf),numpy.full(dy.shape,numpy.inf))
+            for normalAngle in self.rotation + (numpy.arange(self.vertices)+0.5)*2.*numpy.pi/self.vertices:
+                (lower,upper) = slabInterval(numpy.cos(normalAngle),dy*numpy.sin(normalAngle),-numpy.inf,apothem)
+                (left,right) = (numpy.maximum(left,lower),numpy.minimum(right,upper))
+        if not self.holeDiameter:
+            return ([left],[right])
+        holeChord = circleChord(dy,0.5*self.holeDiameter)
+        holeChord = numpy.where(holeChord >= 0.,holeChord,-numpy.inf)
+        return ([left,numpy.maximum(left,holeChord)],[numpy.minimum(right,-holeChord),right])
+
+def arcPoints(start,end,centre,counterClockWise,tolerance):
+    '''Points after start along a (G75) arc, no further than tolerance from it.'''
+    radius = numpy.hypot(*(start-centre))
+    startAngle = numpy.arctan2(*(start-centre)[::-1])
+    endAngle = numpy.arctan2(*(end-centre)[::-1])
+    if counterClockWise:
+        sweep = (endAngle-startAngle) % (2.*numpy.pi)
+    else:
+        sweep = -((startAngle-endAngle) % (2.*numpy.pi))
+    if numpy.allclose(start,end):
+        sweep = 2.*numpy.pi if counterClockWise else -2.*numpy.pi
+    stepAngle = 2.*numpy.arccos(max(1.-tolerance/radius,-1.)) if radius > tolerance else numpy.pi
+    steps = max(1,int(numpy.ceil(abs(sweep)/stepAngle)))
+    angles = startAngle + sweep*numpy.arange(1,steps+1)/steps
+    points = centre + radius*numpy.column_stack([numpy.cos(angles),numpy.sin(angles)])
+    points[-1] = end
+    return points
+
+def convexHull(points):
+    '''Convex hull in counter-clockwise order (monotone chain).'''
+    points = sorted(set(map(tuple,numpy.asarray(points).tolist())))
+    if len(points) < 3:
+        return numpy.array(points)
+    def cross(origin,first,second):
+        return (first[0]-origin[0])*(second[1]-origin[1]) - (first[1]-origin[1])*(second[0]-origin[0])
+    lower = []
+    upper = []
+    for point in points:
+        while len(lower) >= 2 and cross(lower[-2],lower[-1],point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2],upper[-1],point) <= 0:
+            upper.pop()
+        upper.append(point)
+    return numpy.array(lower[:-1]+upper[:-1])
+
+class Tile(object):
+    '''Pixel centres xs (left to right) and ys (top to bottom) of a bitmap tile.'''
+    def __init__(self,xs,ys,pixelSize):
+        self.xs = xs
+        self.ys = ys
+        self.pixelSize = pixelSize
+        self.box = numpy.array([xs[0],ys[-1],xs[-1],ys[0]])
+    def overlapping(self,boxes,offset):
+        '''Indices of the boxes (x0,y0,x1,y1), shifted by offset, that overlap the tile.'''
+        shifted = boxes + numpy.tile(offset,2)
+        return numpy.flatnonzero((shifted[:,0] <= self.box[2]) & (shifted[:,2] >= self.box[0]) &
+                                 (shifted[:,1] <= self.box[3]) & (shifted[:,3] >= self.box[1]))
+    def rows(self,bottoms,tops):
+        '''(box number, row) for the pixel rows with bottom <= y <= top.'''
+        starts = numpy.clip(numpy.ceil((self.ys[0]-tops)/self.pixelSize),0,len(self.ys)).astype(int)
+        ends = numpy.clip(numpy.floor((self.ys[0]-bottoms)/self.pixelSize)+1,0,len(self.ys)).astype(int)
+        return raggedRanges(starts,ends)
+    def fillSpans(self,mask,rows,lefts,rights):
+        '''Sets the pixels with left <= x <= right on each row.'''
+        starts = numpy.clip(numpy.ceil((lefts-self.xs[0])/self.pixelSize),0,len(self.xs)).astype(int)
+        ends = numpy.clip(numpy.floor((rights-self.xs[0])/self.pixelSize)+1,0,len(self.xs)).astype(int)
+        isSpan = ends > starts
+        (rows,starts,ends) = (rows[isSpan],starts[isSpan],ends[isSpan])
+        if (ends-starts).sum() > mask.size/8:
+            # mostly covered: count span starts and ends instead of indexing every pixel
+            width = mask.shape[1]+1
+            edges = numpy.bincount(rows*width+starts,minlength=mask.shape[0]*width) - \
+                    numpy.bincount(rows*width+ends,minlength=mask.shape[0]*width)
+            mask |= numpy.cumsum(edges.reshape(-1,width),axis=1)[:,:-1] > 0
+        else:
+            (spanNumbers,columns) = raggedRanges(starts,ends)
+            mask[rows[spanNumbers],columns] = True
+
+class FlashOperation(object):
+    def __init__(self,locations,aperture):
+        self.locations = locations
+        self.aperture = aperture
+        self.boxes = numpy.hstack([locations-aperture.halfSize,locations+aperture.halfSize])
+    def paint(self,mask,tile,offset,indices):
+        locations = self.locations[indices]+offset
+        halfHeight = self.aperture.halfSize[1]
+        (flashNumbers,rows) = tile.rows(locations[:,1]-halfHeight,locations[:,1]+halfHeight)
+        (lefts,rights) = self.aperture.spans(tile.ys[rows]-locations[flashNumbers,1])
+        for (left,right) in zip(lefts,rights):
+            tile.fillSpans(mask,rows,left+locations[flashNumbers,0],right+locations[flashNumbers,0])
+
+class CapsuleOperation(object):
+    '''Linear draws with a circular aperture.'''
+    def __init__(self,starts,ends,radius):
+        self.starts = starts
+        self.ends = ends
+        self.radius = radius
+        self.boxes = numpy.hstack([numpy.minimum(starts,ends)-radius,numpy.maximum(starts,ends)+radius])
+        deltas = ends-starts
+        self.lengths = numpy.hypot(deltas[:,0],deltas[:,1])
+        self.directions = deltas/numpy.where(self.lengths > 0.,self.lengths,1.)[:,numpy.newaxis]
+    def paint(self,mask,tile,offset,indices):
+        boxes = self.boxes[indices]+numpy.tile(offset,2)
+        (drawNumbers,rows) = tile.rows(boxes[:,1],boxes[:,3])
+        drawNumbers = indices[drawNumbers]
+        (starts,ends) = (self.starts[drawNumbers]+offset,self.ends[drawNumbers]+offset)
+        (directions,lengths) = (self.directions[drawNumbers],self.lengths[drawNumbers])
+        dy = tile.ys[rows]-starts[:,1]
+        # the band between both end circles, in x relative to the start
+        (alongLeft,alongRight) = slabInterval(directions[:,0],directions[:,1]*dy,0.,numpy.where(lengths > 0.,lengths,-1.))
+        (acrossLeft,acrossRight) = slabInterval(-directions[:,1],directions[:,0]*dy,-self.radius,self.radius)
+        (bandLeft,bandRight) = (numpy.maximum(alongLeft,acrossLeft),numpy.minimum(alongRight,acrossRight))
+        isBand = bandLeft <= bandRight
+        (bandLeft,bandRight) = (numpy.where(isBand,bandLeft,numpy.inf),numpy.where(isBand,bandRight,-numpy.inf))
+        startChord = circleChord(dy,self.radius)
+        endChord = circleChord(tile.ys[rows]-ends[:,1],self.radius)
+        lefts = numpy.minimum(numpy.minimum(starts[:,0]-startChord,ends[:,0]-endChord),starts[:,0]+bandLeft)
+        rights = numpy.maximum(numpy.maximum(starts[:,0]+startChord,ends[:,0]+endChord),starts[:,0]+bandRight)
+        tile.fillSpans(mask,rows,lefts,rights)
+
+class PolygonOperation(object):
+    '''Regions and draws with a rectangular aperture, as closed even-odd polygons.'''
+    def __init__(self,polygons):
+        self.boxes = numpy.array([numpy.concatenate([polygon.min(0),polygon.max(0)]) for polygon in polygons]).reshape(-1,4)
+        if polygons:
+            self.edgeStarts = numpy.concatenate(polygons)
+            self.edgeEnds = numpy.concatenate([numpy.roll(polygon,-1,axis=0) for polygon in polygons])
+            self.edgePolygons = numpy.repeat(numpy.arange(len(polygons)),[len(polygon) for polygon in polygons])
+    def paint(self,mask,tile,offset,indices):
+        selected = numpy.in1d(self.edgePolygons,indices)
+        (edgeStarts,edgeEnds) = (self.edgeStarts[selected]+offset,self.edgeEnds[selected]+offset)
+        # pixel rows with bottom <= y < top cross an edge; the candidates are
+        # widened as tile.rows() may round a row on a vertex height away
+        (bottoms,tops) = (numpy.minimum(edgeStarts[:,1],edgeEnds[:,1]),numpy.maximum(edgeStarts[:,1],edgeEnds[:,1]))
+        (edgeNumbers,rows) = tile.rows(bottoms-tile.pixelSize,tops+tile.pixelSize)
+        y = tile.ys[rows]
+        keep = (y >= bottoms[edgeNumbers]) & (y < tops[edgeNumbers])
+        (edgeNumbers,rows,y) = (edgeNumbers[keep],rows[keep],y[keep])
+        (start,end) = (edgeStarts[edgeNumbers],edgeEnds[edgeNumbers])
+        crossings = start[:,0] + (y-start[:,1])/(end[:,1]-start[:,1])*(end[:,0]-start[:,0])
+        polygons = self.edgePolygons[selected][edgeNumbers]
+        order = numpy.lexsort([crossings,rows,polygons])
+        (rows,crossings) = (rows[order],crossings[order])
+        tile.fillSpans(mask,rows[0::2],crossings[0::2],crossings[1::2])
+
+class BlockOperation(object):
+    def __init__(self,location,programs,box):
+        self.location = location
+        self.programs = programs
+        self.boxes = box.reshape(1,4)
+
+class LayerProgram(object):
+    '''The primitives of a GerberLayer as rasterisable operations, in drawing order.'''
+    def __init__(self,inverted,operations):
+        self.inverted = inverted
+        self.operations = [operation for operation in operations if len(operation.boxes)]
+        if self.operations:
+            boxes = numpy.concatenate([operation.boxes for operation in self.operations])
+            self.box = numpy.concatenate([boxes[:,0:2].min(0),boxes[:,2:4].max(0)])
+        else:
+            self.box = None
+
+def unionBox(boxes):
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return None
+    boxes = numpy.array(boxes)
+    return numpy.concatenate([boxes[:,0:2].min(0),boxes[:,2:4].max(0)])
+
+class GerberRasteriser(object):
+    '''
+    Renders a GerberFile into a boolean bitmap (True is dark) at the given
+    resolution, with rows from top to bottom. Tiles of tileSize x tileSize
+    pixels are rendered one at a time, applying the polarity layers in order,
+    so memory stays bounded whatever the resolution.
+    '''
+    def __init__(self,gerberFile,dpi=1000.,bottomLeft=None,topRight=None,tileSize=1024):
+        if any([type(batch) is TextBatch for layer in self._allLayers(gerberFile) for batch in layer._batches]):
+            gerberFile = GerberFile.fromString(str(gerberFile))
+        self.gerberFile = gerberFile
+        self.pixelSize = 25.4/dpi
+        self.tileSize = tileSize
+        self._apertures = {}
+        self._programs = {}
+        self._blocks = dict([(block.apertureNumber,block) for block in gerberFile.blockApertures])
+
+        if bottomLeft is None or topRight is None:
+            box = self.boundingBox()
+            if box is None:
+                raise ValueError, 'Nothing to rasterise'
+            (bottomLeft,topRight) = (box[0:2]-self.pixelSize,box[2:4]+self.pixelSize)
+        (self.left,self.top) = (float(bottomLeft[0]),float(topRight[1]))
+        self.columns = int(numpy.ceil((topRight[0]-bottomLeft[0])/self.pixelSize-1e-9))
+        self.rows = int(numpy.ceil((topRight[1]-bottomLeft[1])/self.pixelSize-1e-9))
+
+    @staticmethod
+    def _allLayers(gerberFile):
+        return gerberFile.layers + gerberFile.panelLayers + [layer for block in gerberFile.blockApertures for layer in block.layers]
+    @property
+    def shape(self):
+        return (self.rows,self.columns)
+    def _sequence(self):
+        '''(layer, offset) in drawing order, repeating the step and repeat block.'''
+        offsets = self.gerberFile.stepAndRepeat.offsets() if self.gerberFile.stepAndRepeat else numpy.zeros((1,2))
+        return [(layer,offset) for offset in offsets for layer in self.gerberFile.layers] + \
+               [(layer,numpy.zeros(2)) for layer in self.gerberFile.panelLayers]
+    def boundingBox(self):
+        return unionBox([self._program(layer).box + numpy.tile(offset,2) for (layer,offset) in self._sequence() if self._program(layer).box is not None])
+
+    def _aperture(self,apertureNumber):
+        if apertureNumber not in self._apertures:
+            self._apertures[apertureNumber] = Aperture(self.gerberFile.apertures[apertureNumber])
+        return self._apertures[apertureNumber]
+    def _program(self,layer):
+        if id(layer) not in self._programs:
+            self._programs[id(layer)] = LayerProgram(layer.inverted,self._operations(layer))
+        return self._programs[id(layer)]
+    def _operations(self,layer):
+        operations = []
+        for batch in layer._batches:
+            if type(batch) is FlashBatch:
+                operations += self._flashOperations(batch.inMillimetres())
+            elif type(batch) is StrokeBatch:
+                strokes = batch.inMillimetres()
+                for apertureNumber in numpy.unique(strokes[:,4]).astype(int).tolist():
+                    selected = strokes[strokes[:,4] == apertureNumber]
+                    operations.append(self._drawOperation(selected[:,0:2],selected[:,2:4],apertureNumber))
+            elif type(batch) is ContourBatch:
+                operations += self._contourOperations(batch)
+        return operations
+    def _flashOperations(self,flashes):
+        operations = []
+        isBlock = numpy.in1d(flashes[:,2].astype(int),self._blocks.keys())
+        for (start,end) in self._runs(isBlock):
+            if isBlock[start]:
+                for (x,y,apertureNumber) in flashes[start:end].tolist():
+                    programs = [self._program(blockLayer) for blockLayer in self._blocks[int(apertureNumber)].layers]
+                    box = unionBox([program.box for program in programs])
+                    if box is not None:
+                        operations.append(BlockOperation(numpy.array([x,y]),programs,box+numpy.tile([x,y],2)))
+            else:
+                run = flashes[start:end]
+                for apertureNumber in numpy.unique(run[:,2]).astype(int).tolist():
+                    operations.append(FlashOperation(run[run[:,2] == apertureNumber,0:2],self._aperture(apertureNumber)))
+        return operations
+    @staticmethod
+    def _runs(values):
+        '''(start, end) of the runs of equal values.'''
+        changes = numpy.flatnonzero(values[1:] != values[:-1])+1
+        bounds = [0] + changes.tolist() + [len(values)]
+        return zip(bounds[:-1],bounds[1:])
+    def _drawOperation(self,starts,ends,apertureNumber):
+        aperture = self._aperture(apertureNumber)
+        if aperture.shape == 'C':
+            return CapsuleOperation(starts,ends,0.5*aperture.width)
+        elif aperture.shape == 'R':
+            corners = numpy.array([[-1,-1],[+1,-1],[+1,+1],[-1,+1]])*aperture.halfSize
+            return PolygonOperation([convexHull(numpy.concatenate([start+corners,end+corners])) for (start,end) in zip(starts,ends)])
+        raise NotImplementedError, 'Cannot draw with aperture {definition}'.format(definition=self.gerberFile.apertures[apertureNumber])
+    def _contourOperations(self,contourBatch):
+        tolerance = 0.05*self.pixelSize
+        vertices = contourBatch.inMillimetres()
+        regions = []
+        operations = []
+        for (start,end,apertureNumber) in contourBatch.contourSlices():
+            points = [vertices[start,0:2]]
+            for (x,y,interpolation,centreX,centreY) in vertices[start+1:end].tolist():
+                if interpolation >= ContourBatch.clockWise:
+                    points.extend(arcPoints(points[-1],numpy.array([x,y]),numpy.array([centreX,centreY]),interpolation == ContourBatch.counterClockWise,tolerance))
+                else:
+                    points.append(numpy.array([x,y]))
+            points = numpy.array(points)
+            if apertureNumber:
+                operations.append(self._drawOperation(points[:-1],points[1:],apertureNumber))
+            else:
+                regions.append(points)
+        return operations + [PolygonOperation(regions)]
+
+    def _paint(self,image,tile,program,offset,dark):
+        mask = numpy.zeros_like(image)
+        for operation in program.operations:
+            indices = tile.overlapping(operation.boxes,offset)
+            if not len(indices):
+                continue
+            if type(operation) is BlockOperation:
+                # objects after the block must not be painted before it
+                image[mask] = dark
+                mask[:] = False
+                for blockProgram in operation.programs:
+                    self._paint(image,tile,blockProgram,offset+operation.location,dark != blockProgram.inverted)
+            else:
+                operation.paint(mask,tile,offset,indices)
+        image[mask] = dark
+    def tile(self,rowStart,columnStart,rows,columns):
+        '''Bitmap of the given pixel rows and columns.'''
+        tile = Tile(self.left + (numpy.arange(columnStart,columnStart+columns)+0.5)*self.pixelSize,
+                    self.top - (numpy.arange(rowStart,rowStart+rows)+0.5)*self.pixelSize,
+                    self.pixelSize)
+        image = numpy.zeros((rows,columns),dtype=bool)
+        for (layer,offset) in self._sequence():
+            program = self._program(layer)
+            if program.box is not None and len(tile.overlapping(program.box.reshape(1,4),offset)):
+                self._paint(image,tile,program,offset,not layer.inverted)
+        if self.gerberFile.inverted:
+            image = ~image
+        return image
+    def tiles(self):
+        '''Yields (rowStart, columnStart, bitmap) for every tile.'''
+        for rowStart in range(0,self.rows,self.tileSize):
+            for columnStart in range(0,self.columns,self.tileSize):
+                yield (rowStart,columnStart,self.tile(rowStart,columnStart,min(self.tileSize,self.rows-rowStart),min(self.tileSize,self.columns-columnStart)))
+    def bands(self):
+        '''Yields (rowStart, bitmap) for bands of tileSize full-width rows.'''
+        for rowStart in range(0,self.rows,self.tileSize):
+            rows = min(self.tileSize,self.rows-rowStart)
+            yield (rowStart,numpy.hstack([self.tile(rowStart,columnStart,rows,min(self.tileSize,self.columns-columnStart)) for columnStart in range(0,self.columns,self.tileSize)]))
+    def image(self,out=None):
+        '''The whole bitmap, optionally rendered into out (e.g. a numpy.memmap).'''
+        if out is None:
+            out = numpy.empty(self.shape,dtype=bool)
+        for (rowStart,band) in self.bands():
+            out[rowStart:rowStart+len(band)] = band
+        return out
+    def writePbm(self,fileObject):
+        '''Writes a binary portable bitmap, band by band.'''
+        fileObject.write('P4\n{columns} {rows}\n'.format(columns=self.columns,rows=self.rows))
+        for (rowStart,band) in self.bands():
+            fileObject.write(numpy.packbits(band,axis=1).tostring())
@@ -1,148 +1,653 @@
+import copy
 import numpy
 import os
+import re
+import string
+from StringIO import StringIO
 
 from geometry import *
+from utility import writeToZip,GrowingArray,Statistics,ByteCounter,CoordinateGrid
+
+class TextBatch(object):
+    '''Literal RS-274X commands, passed through unchanged and so never moved.'''
+    def __init__(self,commands=None,grid=None):
+        self.commands = [] if commands is None else [commands]
+    def append(self,commands):
+        self.commands.append(commands)
+    def emit(self,emitter):
+        return emitter.text(self.commands)
+    def coordinates(self):
+        return numpy.zeros((0,2))
+    def translate(self,translationVector):
+        if numpy.any(translationVector):
+            raise ValueError, 'literal commands cannot be translated'
+
+class CoordinateBatch(object):
+    '''
+    Rows of coordinates (in the coordinateColumns) and integer codes. With a
+    CoordinateGrid, rows are int64 and coordinates are snapped to the grid as
+    they are added, otherwise rows are floats in mm.
+    '''
+    coordinateColumns = []
+    def __init__(self,columns,grid=None):
+        self.grid = grid
+        self.rows = GrowingArray(columns,dtype=float if grid is None else numpy.int64)
+    def extend(self,rows):
+        '''Adds rows in mm.'''
+        rows = numpy.array(rows,dtype=float).reshape(-1,self.rows.array.shape[1])
+        if self.grid is not None:
+            rows[:,self.coordinateColumns] = self.grid.snap(rows[:,self.coordinateColumns])
+        self.rows.extend(rows)
+    def inMillimetres(self):
+        if self.grid is None:
+            return self.rows.array
+        rows = self.rows.array.astype(float)
+        rows[:,self.coordinateColumns] = self.grid.millimetres(rows[:,self.coordinateColumns])
+        return rows
+    def coordinates(self):
+        return self.inMillimetres()[:,self.coordinateColumns].reshape(-1,2)
+    def translate(self,translationVector):
+        if self.grid is not None:
+            translationVector = self.grid.snap(translationVector)
+        self.rows.array[:,self.coordinateColumns] += numpy.tile(translationVector,len(self.coordinateColumns)//2)
+
+class FlashBatch(CoordinateBatch):
+    '''Flashes as rows of (x, y, aperture number).'''
+    coordinateColumns = [0,1]
+    def __init__(self,grid=None):
+        CoordinateBatch.__init__(self,3,grid)
+    @property
+    def flashes(self):
+        return self.rows
+    def emit(self,emitter):
+        return emitter.flashes(self.flashes.array)
+
+class StrokeBatch(CoordinateBatch):
+    '''Single linear strokes as rows of (fromX, fromY, toX, toY, aperture number).'''
+    coordinateColumns = [0,1,2,3]
+    def __init__(self,grid=None):
+        CoordinateBatch.__init__(self,5,grid)
+    @property
+    def strokes(self):
+        return self.rows
+    def emit(self,emitter):
+        return emitter.strokes(self.strokes.array)
+
+class ContourBatch(CoordinateBatch):
+    '''
+    Regions and stroked outlines. Vertices are rows of (x, y, interpolation,
+    centreX, centreY), contours are rows of (first vertex, aperture number),
+    where aperture number 0 denotes a G36/G37 region.
+    '''
+    move = 0
+    linear = 1
+    clockWise = 2
+    counterClockWise = 3
+    coordinateColumns = [0,1,3,4]
+    
+    def __init__(self,grid=None):
+        CoordinateBatch.__init__(self,5,grid)
+        self.contours = GrowingArray(2,dtype=numpy.int64)
+    @property
+    def vertices(self):
+        return self.rows
+    def addContour(self,vertices,apertureNumber=None):
+        self.contours.append([len(self.vertices),apertureNumber or 0])
+        self.extend(vertices)
+    def contourSlices(self):
+        starts = self.contours.array[:,0].tolist()
+        return zip(starts,starts[1:]+[len(self.vertices)],self.contours.array[:,1].tolist())
+    def arcOffsets(self):
+        '''Arc centres relative to the previous vertex, as needed for I/J.'''
+        vertices = self.vertices.array
+        offsets = numpy.zeros((len(vertices),2),dtype=vertices.dtype)
+        offsets[1:] = vertices[1:,3:5] - vertices[:-1,0:2]
+        return offsets
+    def emit(self,emitter):
+        return emitter.contours(self)
+    def coordinates(self):
+        vertices = self.inMillimetres()
+        isArc = vertices[:,2] >= self.clockWise
+        offsets = self.arcOffsets()[isArc]
+        if self.grid is not None:
+            offsets = self.grid.millimetres(offsets)
+        return numpy.concatenate([vertices[:,0:2],offsets])
+
+class StepAndRepeat(object):
+    '''Repeats a block of layers on a grid of columns x rows with the given pitches.'''
+    def __init__(self,columns,rows,columnPitch=0.,rowPitch=0.):
+        self.columns = columns
+        self.rows = rows
+        self.columnPitch = columnPitch
+        self.rowPitch = rowPitch
+    def __repr__(self):
+        return 'StepAndRepeat({columns:d}x{rows:d},{columnPitch},{rowPitch})'.format(columns=self.columns,rows=self.rows,columnPitch=self.columnPitch,rowPitch=self.rowPitch)
+    def offsets(self):
+        (columnNumbers,rowNumbers) = numpy.meshgrid(numpy.arange(self.columns),numpy.arange(self.rows))
+        return numpy.column_stack([columnNumbers.ravel()*self.columnPitch,rowNumbers.ravel()*self.rowPitch])
+    def openCommand(self,decimalPlaces):
+        return '%SRX{columns:d}Y{rows:d}I{columnPitch:.{precision}f}J{rowPitch:.{precision}f}*%\n'.format(columns=self.columns,rows=self.rows,columnPitch=self.columnPitch,rowPitch=self.rowPitch,precision=decimalPlaces)
+    def closeCommand(self):
+        return '%SR*%\n'
+
+class GerberEmitter(object):
+    '''Writes primitive batches as self-contained RS-274X blocks.'''
+    def __init__(self,gerberFile):
+        self.gerberFile = gerberFile
+    def text(self,commands):
+        return ''.join(commands)
+    def flashes(self,flashes):
+        locationStrings = self.gerberFile.locationsToStrings(flashes[:,0:2])
+        return ''.join(['G54D%02d*\n%sD03*\n' % flash for flash in zip(flashes[:,2].astype(int).tolist(),locationStrings)])
+    def strokes(self,strokes):
+        fromStrings = self.gerberFile.locationsToStrings(strokes[:,0:2])
+        toStrings = self.gerberFile.locationsToStrings(strokes[:,2:4])
+        return ''.join(['D%02d*\nG75*\nG01%sD02*\nG01%sD01*\n' % stroke for stroke in zip(strokes[:,4].astype(int).tolist(),fromStrings,toStrings)])
+    def contours(self,contourBatch):
+        vertices = contourBatch.vertices.array
+        interpolations = vertices[:,2].astype(int).tolist()
+        targetStrings = self.gerberFile.locationsToStrings(vertices[:,0:2])
+        arcIndices = numpy.flatnonzero(vertices[:,2] >= ContourBatch.clockWise)
+        offsetStrings = dict(zip(arcIndices.tolist(),self.gerberFile.locationsToStrings(contourBatch.arcOffsets()[arcIndices],offset=True)))
+        
+        commands = []
+        for (start,end,apertureNumber) in contourBatch.contourSlices():
+            if apertureNumber:
+                commands.append('D{apertureNumber:02d}*\nG75*\n'.format(apertureNumber=apertureNumber))
+            else:
+                commands.append('G36*\nG75*\n')
+            for index in range(start,end):
+                interpolation = interpolations[index]
+                if interpolation == ContourBatch.move:
+                    commands.append('G01' + targetStrings[index] + 'D02*\n')
+                elif interpolation == ContourBatch.linear:
+                    commands.append('G01' + targetStrings[index] + 'D01*\n')
+                else:
+                    circularInterpolationCommand = 'G03' if interpolation == ContourBatch.counterClockWise else 'G02'
+                    commands.append(circularInterpolationCommand + targetStrings[index] + offsetStrings[index] + 'D01*\n')
+            if not apertureNumber:
+                commands.append('G37*\n')
+        return ''.join(commands)
+
+class CompactGerberEmitter(GerberEmitter):
+    '''
+    Tracks the selected aperture, interpolation mode and current point, and
+    leaves out every code or coordinate that would not change them.
+    '''
+    interpolationCodes = {ContourBatch.linear:'G01',ContourBatch.clockWise:'G02',ContourBatch.counterClockWise:'G03'}
+    
+    def __init__(self,gerberFile):
+        GerberEmitter.__init__(self,gerberFile)
+        # every layer starts without assumptions on the state left by the previous one
+        self._forgetState()
+    def _forgetState(self):
+        self.apertureNumber = None
+        self.interpolation = None
+        self.currentPoint = (None,None)
+    def text(self,commands):
+        # literal commands may change any state
+        self._forgetState()
+        return GerberEmitter.text(self,commands)
+    def _selectAperture(self,apertureNumber):
+        if apertureNumber == self.apertureNumber:
+            return ''
+        self.apertureNumber = apertureNumber
+        return 'D{apertureNumber:02d}*\n'.format(apertureNumber=apertureNumber)
+    def _command(self,x,y,operation,interpolation=None,offset=None):
+        words = []
+        if interpolation is not None and interpolation != self.interpolation:
+            words.append(interpolation)
+            self.interpolation = interpolation
+        if x != self.currentPoint[0]:
+            words.append('X%d' % x)
+        if y != self.currentPoint[1]:
+            words.append('Y%d' % y)
+        if offset is not None:
+            words.append('I%dJ%d' % tuple(offset))
+        words.append(operation + '*\n')
+        self.currentPoint = (x,y)
+        return ''.join(words)
+    
+    def flashes(self,flashes):
+        commands = []
+        for ((x,y),apertureNumber) in zip(self.gerberFile.locationsToIntegers(flashes[:,0:2]),flashes[:,2].astype(int).tolist()):
+            commands.append(self._selectAperture(apertureNumber))
+            commands.append(self._command(x,y,'D03'))
+        return ''.join(commands)
+    def strokes(self,strokes):
+        commands = []
+        for ((fromX,fromY),(toX,toY),apertureNumber) in zip(self.gerberFile.locationsToIntegers(strokes[:,0:2]),self.gerberFile.locationsToIntegers(strokes[:,2:4]),strokes[:,4].astype(int).tolist()):
+            commands.append(self._selectAperture(apertureNumber))
+            if (fromX,fromY) != self.currentPoint:
+                commands.append(self._command(fromX,fromY,'D02'))
+            commands.append(self._command(toX,toY,'D01','G01'))
+        return ''.join(commands)
+    def contours(self,contourBatch):
+        vertices = contourBatch.vertices.array
+        interpolations = vertices[:,2].astype(int).tolist()
+        targets = self.gerberFile.locationsToIntegers(vertices[:,0:2])
+        arcIndices = numpy.flatnonzero(vertices[:,2] >= ContourBatch.clockWise)
+        offsets = dict(zip(arcIndices.tolist(),self.gerberFile.locationsToIntegers(contourBatch.arcOffsets()[arcIndices])))
+        
+        commands = []
+        for (start,end,apertureNumber) in contourBatch.contourSlices():
+            if apertureNumber:
+                commands.append(self._selectAperture(apertureNumber))
+            else:
+                commands.append('G36*\n')
+            for index in range(start,end):
+                interpolation = interpolations[index]
+                if interpolation == ContourBatch.move:
+                    commands.append(self._command(targets[index][0],targets[index][1],'D02'))
+                else:
+                    commands.append(self._command(targets[index][0],targets[index][1],'D01',self.interpolationCodes[interpolation],offsets.get(index)))
+            if not apertureNumber:
+                commands.append('G37*\n')
+                self.currentPoint = (None,None)
+        return ''.join(commands)
 
 class GerberLayer(object):
     def __init__(self,gerberFile,inverted=False):
         self.gerberFile = gerberFile
         self.inverted = inverted
-        self.drawCommands = ''
+        self._batches = []
+        self._sharedBatches = 0 # leading batches that other layers hold as well, see sharedCopy()
     def __repr__(self):
         return ('-' if self.inverted else '+') + ' ' + repr(self.gerberFile)
     def __str__(self):
         return self.layerPolarity()+self.drawCommands
+    def writeTo(self,fileObject):
+        fileObject.write(self.layerPolarity())
+        self.writeCommandsTo(fileObject)
+    def writeCommandsTo(self,fileObject):
+        emitter = self.gerberFile.emitter()
+        for batch in self._batches:
+            fileObject.write(batch.emit(emitter))
+    @property
+    def drawCommands(self):
+        emitter = self.gerberFile.emitter()
+        return ''.join([batch.emit(emitter) for batch in self._batches])
+    @drawCommands.setter
+    def drawCommands(self,commands):
+        self._rejectLiteralsWhileRecording()
+        self._batches = [TextBatch(commands)]
+    def sharedCopy(self,gerberFile):
+        '''
+        A layer of gerberFile that draws the same batches, which it never
+        changes: everything drawn on it afterwards goes into batches of its own.
+        '''
+        copied = GerberLayer(gerberFile,self.inverted)
+        copied._batches = list(self._batches)
+        copied._sharedBatches = len(copied._batches)
+        return copied
     def layerPolarity(self):
         if self.inverted:
             return '%LPC*%\n' # Clear
         else:
             return '%LPD*%\n' # Dark
+    
+    def _batch(self,batchClass):
+        if BlockRecording.active is not None:
+            blockLayer = BlockRecording.active.blockLayer(self)
+            if blockLayer is not self:
+                return blockLayer._batch(batchClass)
+        if not(len(self._batches) > self._sharedBatches and type(self._batches[-1]) is batchClass):
+            self._batches.append(batchClass(grid=self.gerberFile.grid))
+        return self._batches[-1]
+    def _batchesOfType(self,batchClass):
+        return [batch for batch in self._batches if type(batch) is batchClass]
+    @property
+    def flashes(self):
+        return numpy.concatenate([numpy.zeros((0,3))] + [batch.inMillimetres() for batch in self._batchesOfType(FlashBatch)])
+    @property
+    def strokes(self):
+        return numpy.concatenate([numpy.zeros((0,5))] + [batch.inMillimetres() for batch in self._batchesOfType(StrokeBatch)])
+    @property
+    def contourBatches(self):
+        return self._batchesOfType(ContourBatch)
+    def coordinates(self):
+        return numpy.concatenate([numpy.zeros((0,2))] + [batch.coordinates() for batch in self._batches])
+    def translate(self,translationVector):
+        for batch in self._batches:
+            batch.translate(translationVector)
+    def addCopies(self,layer,offsets):
+        '''Draws what another layer draws again, moved by every row of an (n,2) array of offsets.'''
+        offsets = numpy.asarray(offsets,dtype=float).reshape(-1,2)
+        for batch in layer._batches:
+            if type(batch) is TextBatch:
+                raise ValueError, 'literal commands cannot be copied'
+            rows = batch.inMillimetres()
+            shifts = numpy.zeros((len(offsets),rows.shape[1]))
+            shifts[:,batch.coordinateColumns] = numpy.tile(offsets,len(batch.coordinateColumns)//2)
+            target = self._batch(type(batch))
+            if type(batch) is ContourBatch:
+                contours = batch.contours.array
+                firstVertices = len(target.vertices) + contours[numpy.newaxis,:,0] + len(rows)*numpy.arange(len(offsets))[:,numpy.newaxis]
+                target.contours.extend(numpy.column_stack([firstVertices.ravel(),numpy.tile(contours[:,1],len(offsets))]))
+            target.extend((rows[numpy.newaxis]+shifts[:,numpy.newaxis]).reshape(-1,rows.shape[1]))
+    def apertureNumbers(self):
+        '''Apertures (and block apertures) the layer draws with.'''
+        numbers = set(self.flashes[:,2].astype(int).tolist()) | set(self.strokes[:,4].astype(int).tolist())
+        for contourBatch in self.contourBatches:
+            numbers |= set(contourBatch.contours.array[:,1].tolist())
+        return numbers - set([0])
+    def statistics(self):
+        '''Counts of what the layer emits. Literal commands only count in bytes.'''
+        byteCounter = ByteCounter()
+        self.writeCommandsTo(byteCounter)
+        statistics = Statistics(flashes=len(self.flashes),strokes=len(self.strokes),regions=0,regionVertices=0,
+                                apertures=len(self.apertureNumbers()),bytes=byteCounter.bytes)
+        for contourBatch in self.contourBatches:
+            apertureNumbers = contourBatch.contours.array[:,1]
+            vertices = numpy.diff(numpy.append(contourBatch.contours.array[:,0],len(contourBatch.vertices)))
+            statistics['strokes'] += int((vertices-1)[apertureNumbers != 0].sum())
+            statistics['regions'] += int((apertureNumbers == 0).sum())
+            statistics['regionVertices'] += int(vertices[apertureNumbers == 0].sum())
+        return statistics
             
+    def _rejectLiteralsWhileRecording(self):
+        if BlockRecording.active is not None:
+            raise ValueError, 'literal draw commands cannot be recorded into a block aperture, draw primitives instead'
     def addDrawCommands(self,commands):
-        self.drawCommands += commands
+        self._rejectLiteralsWhileRecording()
+        self._batch(TextBatch).append(commands)
     def flashAperture(self,location,apertureNumber):
-        self.addDrawCommands('G54D{apertureNumber:02d}*\n{location}D03*\n'.format(apertureNumber=apertureNumber,location=self.gerberFile.locationToString(location)))
+        self._batch(FlashBatch).extend([location[0],location[1],apertureNumber])
+    def addFlashes(self,locations,apertureNumber):
+        locations = numpy.asarray(locations,dtype=float).reshape(-1,2)
+        self._batch(FlashBatch).extend(numpy.column_stack([locations,numpy.repeat(float(apertureNumber),len(locations))]))
 
     def addSingleStroke(self,fromLocation,toLocation,apertureNumber):
+        self.addStrokes([fromLocation],[toLocation],apertureNumber)
+    def addStrokes(self,fromLocations,toLocations,apertureNumber):
         # TODO: merge with closed outline underneath
-        edgeCommands = self.goTo(fromLocation,exposure=False)
-        edgeCommands += self.goTo(toLocation)
-        self.addDrawCommands('D{apertureNumber:02d}*\nG75*\n'.format(apertureNumber=apertureNumber) + edgeCommands)
+        fromLocations = numpy.asarray(fromLocations,dtype=float).reshape(-1,2)
+        toLocations = numpy.asarray(toLocations,dtype=float).reshape(-1,2)
+        self._batch(StrokeBatch).extend(numpy.column_stack([fromLocations,toLocations,numpy.repeat(float(apertureNumber),len(fromLocations))]))
     
     def addOutline(self,Segments,apertureNumber=None):
-        def safeOffset(absoluteOrigin,point):
-            if absoluteOrigin is not None:
-                return absoluteOrigin - point
-            else:
-                return None
-        
-        
-        edgeCommands = self.goTo(Segments[0].targetLocation,exposure=False)
         assert type(Segments[0]) == Stroke
         if apertureNumber:
             Segments.append(Segments[0])
         
-        for (Segment,previousSegment) in zip(Segments[1:],Segments[:-1]):
-            if type(Segment) == Stroke:
-                edgeCommands += self.goTo(Segment.targetLocation)
+        vertices = [(Segments[0].targetLocation[0],Segments[0].targetLocation[1],ContourBatch.move,0.,0.)]
+        for Segment in Segments[1:]:
+            if type(Segment) != Stroke and Segment.origin is not None:
+                interpolation = ContourBatch.counterClockWise if Segment.counterClockWise else ContourBatch.clockWise
+                vertices.append((Segment.targetLocation[0],Segment.targetLocation[1],interpolation,Segment.origin[0],Segment.origin[1]))
             else:
-                edgeCommands += self.goTo(Segment.targetLocation,relativeCircleOrigin=safeOffset(Segment.origin,previousSegment.targetLocation),counterClockWise=Segment.counterClockWise)
-        if apertureNumber:
-            self.addDrawCommands('D{apertureNumber:02d}*\nG75*\n'.format(apertureNumber=apertureNumber) + edgeCommands)
-        else:
-            self.addDrawCommands('G36*\nG75*\n' + edgeCommands + 'G37*\n')
+                vertices.append((Segment.targetLocation[0],Segment.targetLocation[1],ContourBatch.linear,0.,0.))
+        self._batch(ContourBatch).addContour(vertices,apertureNumber)
     
     def goTo(self,edgePoint,exposure=True,relativeCircleOrigin=None,counterClockWise=None):
         exposureCommand = 'D01' if exposure else 'D02'
-        if relativeCircleOrigin == None:
+        if relativeCircleOrigin is None:
             return 'G01' + self.gerberFile.locationToString(edgePoint) + exposureCommand + '*\n'  
         else:
             assert counterClockWise is not None
             circularInterpolationCommand = 'G03' if counterClockWise else 'G02'
             return circularInterpolationCommand + self.gerberFile.locationToString(edgePoint) + self.gerberFile.locationToString(relativeCircleOrigin,offset=True) + exposureCommand + '*\n'
             
-class GerberFile(object):
+def layersToWrite(layers):
+    '''(layer, polarity changes) for the layers that hold content.'''
+    inverted = None
+    for layer in layers:
+        if not layer._batches:
+            continue
+        yield (layer,layer.inverted != inverted)
+        inverted = layer.inverted
+
+def writeLayers(fileObject,layers):
+    '''Writes the layers that hold content, with a polarity command only where it changes.'''
+    for (layer,polarityChanges) in layersToWrite(layers):
+        if polarityChanges:
+            fileObject.write(layer.layerPolarity())
+        layer.writeCommandsTo(fileObject)
+
+class PolarityLayers(object):
+    '''
+    Sparse, ordered map of polarity layers: layer n is dark for even and clear
+    for odd n. Layers are created on first access and written in order of n.
+    '''
+    def __getitem__(self,layerNumber):
+        if layerNumber not in self._layers:
+            self._layers[layerNumber] = GerberLayer(self.gerberFile,inverted=bool(layerNumber % 2))
+        return self._layers[layerNumber]
+    @property
+    def layers(self):
+        return [self._layers[layerNumber] for layerNumber in sorted(self._layers)]
+    @layers.setter
+    def layers(self,layers):
+        self._layers = {}
+        for layer in layers:
+            self._addLayer(layer)
+    def _addLayer(self,layer):
+        layerNumber = max(self._layers)+1 if self._layers else 0
+        if bool(layerNumber % 2) != layer.inverted:
+            layerNumber += 1
+        self._layers[layerNumber] = layer
+        return layer
+    def addLayer(self,inverted=False):
+        return self._addLayer(GerberLayer(self.gerberFile,inverted))
+
+class BlockAperture(PolarityLayers):
+    '''Layers drawn around the origin, defined once with %AB and placed with a single flash.'''
+    def __init__(self,gerberFile,apertureNumber):
+        self.gerberFile = gerberFile
+        self.apertureNumber = apertureNumber
+        self._layers = {}
+    def coordinates(self):
+        return numpy.concatenate([numpy.zeros((0,2))]+[layer.coordinates() for layer in self.layers])
+    def writeTo(self,fileObject):
+        fileObject.write('%ABD{apertureNumber:02d}*%\n'.format(apertureNumber=self.apertureNumber))
+        writeLayers(fileObject,self.layers)
+        fileObject.write('%AB*%\n')
+
+class BlockRecording(object):
+    '''
+    While active, everything drawn on a GerberLayer is redirected to a dark
+    block layer of the same GerberFile, one per target layer.
+    '''
+    active = None
+    def __init__(self,key):
+        self.key = key
+        self.targetLayers = []
+        self.blockLayers = []
+    def __enter__(self):
+        assert BlockRecording.active is None, 'Block recordings cannot be nested'
+        BlockRecording.active = self
+        return self
+    def __exit__(self,*exceptionInfo):
+        BlockRecording.active = None
+    def blockLayer(self,targetLayer):
+        for (layerNumber,layer) in enumerate(self.targetLayers):
+            if layer is targetLayer:
+                return self.blockLayers[layerNumber]
+        for layer in self.blockLayers:
+            if layer is targetLayer:
+                return layer
+        self.targetLayers.append(targetLayer)
+        self.blockLayers.append(GerberLayer(targetLayer.gerberFile))
+        return self.blockLayers[-1]
+    def flashes(self,origin):
+        '''
+        Defines the recorded blocks around origin and returns
+        [(targetLayer,apertureNumber,offset)]. A layer holding a single flash
+        needs no block: its own aperture is flashed at the offset instead.
+        '''
+        flashes = []
+        for (layerNumber,(targetLayer,blockLayer)) in enumerate(zip(self.targetLayers,self.blockLayers)):
+            blockLayer.translate(-numpy.asarray(origin))
+            if len(blockLayer._batches) == 1 and len(blockLayer.flashes) == 1:
+                (x,y,apertureNumber) = blockLayer.flashes[0]
+                flashes.append((targetLayer,int(apertureNumber),numpy.array([x,y])))
+                continue
+            def drawBlock(block):
+                block.layers = [blockLayer]
+            apertureNumber = targetLayer.gerberFile.addBlockAperture((self.key,layerNumber),drawBlock)
+            flashes.append((targetLayer,apertureNumber,numpy.zeros(2)))
+        return flashes
+
+class GerberFile(PolarityLayers):
     @classmethod
     def comment(cls,commentString):
         return 'G04 {0}*\n'.format(commentString)
         
-    def __init__(self,name,inverted=False,decimalPlaces=5,physicalLayer=None,export=True):
+    def __init__(self,name,inverted=False,decimalPlaces=5,physicalLayer=None,export=True,optimise=False,flatten=False,grid=None):
         self.name = name
         self.inverted = inverted
         self.decimalPlaces = decimalPlaces
+        self.grid = grid # optional CoordinateGrid the primitives are stored on
         self._integerPlaces = 5
+        self.optimise = optimise
+        self.flatten = flatten # write positive regions only, see flattened()
         self.physicalLayer = physicalLayer
         self.export = export
         
-        self.layers = []
-        self.addLayer()
+        self._layers = {}
+        self.stepAndRepeat = None
+        self.panelLayers = [] # written after the step and repeat block
         self.apertures = {}
+        self.apertureMacros = []
+        self._apertureNumbers = {} # interned definitions
+        self.blockApertures = [] # in order of completion, nested blocks first
+        self._blockApertureNumbers = {}
+        self._nextApertureNumber = 10
     def __repr__(self):
         return self.name
-    def addLayer(self,inverted=False):
+    @property
+    def gerberFile(self):
+        return self
+    def sharedCopy(self):
+        '''
+        A copy that shares the primitives drawn so far, see GerberLayer.sharedCopy:
+        drawing on it leaves this file as it is.
+        '''
+        copied = copy.copy(self)
+        copied._layers = dict([(layerNumber,layer.sharedCopy(copied)) for (layerNumber,layer) in self._layers.items()])
+        copied.panelLayers = [layer.sharedCopy(copied) for layer in self.panelLayers]
+        (copied.apertures,copied._apertureNumbers) = (dict(self.apertures),dict(self._apertureNumbers))
+        (copied.apertureMacros,copied.blockApertures,copied._blockApertureNumbers) = (list(self.apertureMacros),list(self.blockApertures),dict(self._blockApertureNumbers))
+        return copied
+    def addPanelLayer(self,inverted=False):
         newLayer = GerberLayer(self,inverted)
-        self.layers.append(newLayer)
+        self.panelLayers.append(newLayer)
         return newLayer
     def getLayerByName(self,name):
         raise DeprecationWarning
         for layer in self.layers:
             if layer.name == name:
                 return layer
-    def __getitem__(self,layerNumber):
-        if len(self.layers) > layerNumber:
-            return self.layers[layerNumber]
-        else:
-            previousLayer = self[layerNumber-1]
-            return self.addLayer(inverted=not(previousLayer.inverted))
     def locationToString(self,location,offset=False):
-        def lengthToString(lengthInMm):
-            assert lengthInMm <= 10**self._integerPlaces
-            return '{length:+0{decimalPlaces}d}'.format(length=int(round(lengthInMm*10**self.decimalPlaces)),decimalPlaces=self.decimalPlaces+1)
-        string = 'X{x}Y{y}'.format(x=lengthToString(location[0]),y=lengthToString(location[1]))
-        if offset:
-            string = string.replace('X','I').replace('Y','J')
-        return string
+        return self.locationsToStrings([location],offset)[0]
+    def locationsToStrings(self,locations,offset=False):
+        '''
+        Formats an (N,2) array of locations (or I/J offsets) in one go, with
+        a single bounds check for the whole batch.
+        '''
+        integerLocations = self._integerLocations(locations)
+        template = 'I%+0*dJ%+0*d' if offset else 'X%+0*dY%+0*d'
+        width = self.decimalPlaces+1
+        return [template % (width,x,width,y) for (x,y) in integerLocations.tolist()]
+    def locationsToIntegers(self,locations):
+        return self._integerLocations(locations).tolist()
+    def _integerLocations(self,locations):
+        locations = numpy.asarray(locations)
+        if self.grid is not None and locations.dtype.kind == 'i':
+            # stored on the grid: exact integer rounding
+            integerLocations = self.grid.toDecimalPlaces(locations.reshape(-1,2),self.decimalPlaces)
+            assert len(integerLocations) == 0 or numpy.abs(integerLocations).max() <= 10**(self._integerPlaces+self.decimalPlaces)
+            return integerLocations
+        scaledLocations = numpy.asarray(locations,dtype=float).reshape(-1,2)*10**self.decimalPlaces
+        if len(scaledLocations) == 0:
+            return numpy.zeros((0,2),dtype=numpy.int64)
+        assert numpy.abs(scaledLocations).max() <= 10**(self._integerPlaces+self.decimalPlaces)
+        # round half away from zero, like the built-in round()
+        return (numpy.sign(scaledLocations)*numpy.floor(numpy.abs(scaledLocations)+0.5)).astype(numpy.int64)
+    @property
+    def integerPlaces(self):
+        if self.optimise:
+            # narrowest format that still holds every coordinate
+            coordinates = numpy.concatenate([numpy.zeros((0,2))]+[layer.coordinates() for layer in self.layers+self.panelLayers]+[block.coordinates() for block in self.blockApertures])
+            if len(coordinates) == 0:
+                return 1
+            largestCoordinate = numpy.abs(self._integerLocations(coordinates)).max()
+            return max(1,len(str(largestCoordinate))-self.decimalPlaces)
+        else:
+            return self._integerPlaces
+    def emitter(self):
+        if self.optimise:
+            return CompactGerberEmitter(self)
+        else:
+            return GerberEmitter(self)
         
     def addRectangularAperture(self,width,height):
         return self._addAperture('R,{width:.{precision}f}X{height:.{precision}f}'.format(width=width,height=height,precision=self.decimalPlaces))
     def addCircularAperture(self,diameter):
         return self._addAperture('C,{diameter:.{precision}f}'.format(diameter=diameter,precision=self.decimalPlaces))
     def _addAperture(self,definition):
-        if len(self.apertures) == 0:
-            apertureNumber = 10
-        else:                  
-            apertureNumber = sorted(self.apertures.keys())[-1]+1
+        if definition in self._apertureNumbers:
+            return self._apertureNumbers[definition]
+        apertureNumber = self._nextApertureNumber
+        self._nextApertureNumber += 1
         self.apertures.update({apertureNumber:definition})
+        self._apertureNumbers.update({definition:apertureNumber})
         return apertureNumber
+    def addBlockAperture(self,key,drawBlock):
+        '''
+        Returns the aperture number of the block for key. The first time,
+        drawBlock(block) fills a new BlockAperture with layers around the origin.
+        '''
+        if key not in self._blockApertureNumbers:
+            block = BlockAperture(self,self._nextApertureNumber)
+            self._nextApertureNumber += 1
+            drawBlock(block)
+            self.blockApertures.append(block)
+            self._blockApertureNumbers[key] = block.apertureNumber
+        return self._blockApertureNumbers[key]
     def _aperturesAsString(self):
-        string = ''
+        chunks = ['%{macro}%\n'.format(macro=macro) for macro in self.apertureMacros]
         for aperture in iter(sorted(self.apertures.items())):
-            string += '%ADD{aperture[0]:02d}{aperture[1]}*%\n'.format(aperture=aperture)
-        return string
+            chunks.append('%ADD{aperture[0]:02d}{aperture[1]}*%\n'.format(aperture=aperture))
+        return ''.join(chunks)
         
-    def __str__(self):
-        string = self.comment('===== Begin FILE IDENTIFICATION =====')
-        string += self.comment('File Format:  Gerber RS274X')
-        string += self.comment('===== End   FILE IDENTIFICATION =====')
-        string += '%FSLAX5{decimalPlaces:d}Y5{decimalPlaces:d}*%\n'.format(decimalPlaces=self.decimalPlaces) + \
-                  '%MOMM*%\n' + \
-                  '%SFA1.0B1.0*%\n%OFA0.0B0.0*%\n'
-        # omit Leading zeroes, Absolute coordinates, 5.decimalPlaces coordinate format, mm
+    def header(self):
+        # omit Leading zeroes, Absolute coordinates, integerPlaces.decimalPlaces coordinate format, mm
         #GerberFile.comment('Format specification') + \
+        chunks = [self.comment('===== Begin FILE IDENTIFICATION ====='),
+                  self.comment('File Format:  Gerber RS274X'),
+                  self.comment('===== End   FILE IDENTIFICATION ====='),
+                  '%FSLAX{integerPlaces:d}{decimalPlaces:d}Y{integerPlaces:d}{decimalPlaces:d}*%\n'.format(integerPlaces=self.integerPlaces,decimalPlaces=self.decimalPlaces) + \
+                  '%MOMM*%\n' + \
+                  '%SFA1.0B1.0*%\n%OFA0.0B0.0*%\n']
+        if self.optimise:
+            chunks.append('G75*\n') # once for the whole file instead of before every outline
         
-        string += self.comment('Image metadata')
+        chunks.append(self.comment('Image metadata'))
         if self.physicalLayer is not None:
-            string += self.comment('Layer_Physical_Order={0:d}'.format(self.physicalLayer))
-        string += self.imageName()
-        string += self.imagePolarity()
+            chunks.append(self.comment('Layer_Physical_Order={0:d}'.format(self.physicalLayer)))
+        chunks.append(self.imageName())
+        chunks.append(self.imagePolarity())
+        return ''.join(chunks)
         
-        string += self._aperturesAsString()
-        
-        for layer in self.layers:
-            string += str(layer)
-            
-        string += 'M02*' # program stop
-        return string
+    def __str__(self):
+        stringFile = StringIO()
+        self.writeTo(stringFile)
+        return stringFile.getvalue()
+    def writeTo(self,fileObject):
+        if self.flatten:
+            return self.flattened().writeTo(fileObject)
+        fileObject.write(self.header())
+        fileObject.write(self._aperturesAsString())
+        for block in self.blockApertures:
+            block.writeTo(fileObject)
+        if self.stepAndRepeat:
+            fileObject.write(self.stepAndRepeat.openCommand(self.decimalPlaces))
+        writeLayers(fileObject,self.layers)
+        if self.stepAndRepeat:
+            fileObject.write(self.stepAndRepeat.closeCommand())
+        writeLayers(fileObject,self.panelLayers)
+        fileObject.write('M02*') # program stop
 
     def writeOut(self,name=None,zipFile=None):
         if self.export:
@@ -150,7 +655,7 @@ class GerberFile(object):
                 name = self.name
             
             if zipFile:
-                zipFile.writestr(name + '.gbr',str(self))
+                writeToZip(zipFile,name + '.gbr',self.writeTo)
             else:
                 outputDirectory = os.path.abspath('../output')
                 if not os.path.exists(outputDirectory):
@@ -158,10 +663,48 @@ class GerberFile(object):
                     os.makedirs(outputDirectory)
                 self.fileHandle = open(outputDirectory + '/' + name + '.gbr','w')
                     
-                self.fileHandle.write(str(self))
+                self.writeTo(self.fileHandle)
                 self.fileHandle.close()
                 
 
+    def flattened(self,tolerance=0.005):
+        '''Copy with the polarity layers evaluated into dark regions, see PolarityFlattener.'''
+        from flatten import PolarityFlattener
+        return PolarityFlattener(self,tolerance).flattened()
+    def statistics(self):
+        '''
+        Counts of what writeTo emits: flashes, strokes, regions, region
+        vertices, apertures, polarity switches and bytes.
+        '''
+        if self.flatten:
+            return self.flattened().statistics()
+        statistics = Statistics(flashes=0,strokes=0,regions=0,regionVertices=0,polaritySwitches=0)
+        for layers in [self.layers,self.panelLayers]+[block.layers for block in self.blockApertures]:
+            for (layer,polarityChanges) in layersToWrite(layers):
+                layerStatistics = layer.statistics()
+                del layerStatistics['apertures'],layerStatistics['bytes']
+                statistics += layerStatistics
+                statistics['polaritySwitches'] += int(polarityChanges)
+        statistics['apertures'] = len(self.apertures)+len(self.blockApertures)
+        byteCounter = ByteCounter()
+        self.writeTo(byteCounter)
+        statistics['bytes'] = byteCounter.bytes
+        return statistics
+    def rasterise(self,dpi=1000.,**kwargs):
+        '''Bitmap of the image, see GerberRasteriser.'''
+        from raster import GerberRasteriser
+        return GerberRasteriser(self,dpi,**kwargs).image()
+    @classmethod
+    def fromString(cls,text,name=None):
+        return GerberReader(text,name).read()
+    @classmethod
+    def fromFile(cls,fileOrPath,name=None):
+        if isinstance(fileOrPath,basestring):
+            with open(fileOrPath) as fileObject:
+                return cls.fromString(fileObject.read(),name)
+        else:
+            return cls.fromString(fileOrPath.read(),name)
+
     def imageName(self):
         return '%IN{0}*%\n'.format(self.name.upper())
 
@@ -172,6 +715,281 @@ class GerberFile(object):
             return '%IPPOS*%\n'
 
 
+class GerberReader(object):
+    '''
+    Reads RS-274X into a GerberFile whose layers hold primitive batches.
+    The data blocks of the whole file are split into word letters and numbers
+    with string translations and interpreted with array operations. Each run
+    of blocks of one kind becomes a batch, so layers keep their drawing order.
+    Draws are read as single strokes and arcs: an outline stroked with an
+    aperture draws the same but is written back as separate strokes.
+    '''
+    commentPattern = re.compile(r'G0*4[^*]*\*')
+    wordPattern = re.compile(r'([A-Z])([+-]?\d+)')
+    formatPattern = re.compile(r'FS([LT])([AI])(?:N\d)?(?:G\d)?X(\d)(\d)Y(\d)(\d)\*')
+    aperturePattern = re.compile(r'ADD(\d+)([^,*]+)(?:,([^*]*))?\*')
+    stepAndRepeatPattern = re.compile(r'SRX(\d+)Y(\d+)I([\d.]+)J([\d.]+)\*')
+    blockAperturePattern = re.compile(r'ABD(\d+)\*')
+    wordLetters = 'GXYIJDM'
+    wordSeparators = string.maketrans(wordLetters+'*',' '*(len(wordLetters)+1))
+    
+    def __init__(self,text,name=None):
+        self.text = text
+        self.name = name
+        
+        self.omitTrailingZeroes = False
+        self.integerPlaces = 5
+        self.decimalPlaces = 5
+        self.unit = 1.
+        self.inverted = False
+        self.apertures = {}
+        self.apertureMacros = []
+        self.polarity = False
+        self.layerPolarities = []
+        # layers before, inside and after the step and repeat block, or the block aperture number
+        self.layerBlocks = []
+        self.implicitLayers = []
+        self.stepAndRepeat = None
+        self.repeatBlock = 'before'
+        self.openBlockApertures = [] # (apertureNumber,outer polarity)
+        self.blockApertureNumbers = [] # in order of completion
+    
+    def _block(self):
+        if self.openBlockApertures:
+            return self.openBlockApertures[-1][0]
+        return self.repeatBlock
+    def _addLayer(self,inverted,implicit=False):
+        self.polarity = inverted
+        self.layerPolarities.append(inverted)
+        self.layerBlocks.append(self._block())
+        self.implicitLayers.append(implicit)
+    def read(self):
+        sections = self.commentPattern.sub('',self.text).split('%')
+        streams = []
+        streamLayers = []
+        for (sectionNumber,section) in enumerate(sections):
+            section = ''.join(section.split())
+            if sectionNumber % 2:
+                self._extendedCommand(section)
+            elif section:
+                if not self.layerPolarities or self.layerBlocks[-1] != self._block():
+                    self._addLayer(self.polarity,implicit=True)
+                if not section.endswith('*'):
+                    raise ValueError, 'Unterminated Gerber block {section}'.format(section=section[-80:])
+                streams.append(section)
+                streamLayers.append(len(self.layerPolarities)-1)
+        
+        gerberFile = GerberFile(self.name or 'Gerber',inverted=self.inverted,decimalPlaces=self.decimalPlaces)
+        gerberFile._integerPlaces = max(self.integerPlaces,gerberFile._integerPlaces)
+        gerberFile.apertureMacros = self.apertureMacros
+        for (apertureNumber,definition) in sorted(self.apertures.items()):
+            gerberFile.apertures[apertureNumber] = definition
+            gerberFile._apertureNumbers.setdefault(definition,apertureNumber)
+            gerberFile._nextApertureNumber = max(gerberFile._nextApertureNumber,apertureNumber+1)
+        layers = [GerberLayer(gerberFile,inverted) for inverted in self.layerPolarities]
+        if streams:
+            blockLayers = numpy.repeat(streamLayers,[stream.count('*') for stream in streams])
+            self._interpret(self._words(''.join(streams)),blockLayers,layers)
+        # drop layers holding only state commands, e.g. before the first %LP
+        kept = [not(implicit) or bool(layer._batches) for (layer,implicit) in zip(layers,self.implicitLayers)]
+        layers = [layer for (layer,keep) in zip(layers,kept) if keep]
+        self.layerBlocks = [block for (block,keep) in zip(self.layerBlocks,kept) if keep]
+        for apertureNumber in self.blockApertureNumbers:
+            block = BlockAperture(gerberFile,apertureNumber)
+            block.layers = [layer for (layer,layerBlock) in zip(layers,self.layerBlocks) if layerBlock == apertureNumber]
+            gerberFile.blockApertures.append(block)
+            gerberFile._nextApertureNumber = max(gerberFile._nextApertureNumber,apertureNumber+1)
+        gerberFile.layers = [layer for (layer,block) in zip(layers,self.layerBlocks) if block in ['before','inside']]
+        gerberFile.panelLayers = [layer for (layer,block) in zip(layers,self.layerBlocks) if block == 'after']
+        gerberFile.stepAndRepeat = self.stepAndRepeat
+        if self.stepAndRepeat and any([layer._batches for (layer,block) in zip(layers,self.layerBlocks) if block == 'before']):
+            raise NotImplementedError, 'Only content inside or after a single step and repeat block is supported'
+        return gerberFile
+    
+    def _words(self,stream):
+        '''Returns {letter: (values, present)} with one entry per block for every word letter.'''
+        letters = numpy.frombuffer(stream.translate(None,'0123456789+-'),dtype=numpy.uint8)
+        unsupported = set(map(chr,numpy.flatnonzero(numpy.bincount(letters,minlength=256)))) - set(self.wordLetters+'*')
+        if unsupported:
+            raise NotImplementedError, 'Unsupported Gerber words {letters}'.format(letters=sorted(unsupported))
+        if self.omitTrailingZeroes:
+            digits = self.integerPlaces+self.decimalPlaces
+            numbers = []
+            for (letter,number) in self.wordPattern.findall(stream):
+                if letter in 'XYIJ':
+                    number = number[0]+number[1:].ljust(digits,'0') if number[0] in '+-' else number.ljust(digits,'0')
+                numbers.append(int(number))
+            numbers = numpy.array(numbers,dtype=numpy.int64)
+        else:
+            numbers = numpy.fromstring(stream.translate(self.wordSeparators),dtype=numpy.int64,sep=' ')
+        
+        isEnd = letters == ord('*')
+        numberOfBlocks = isEnd.sum()
+        blockNumbers = (numpy.cumsum(isEnd) - isEnd)[~isEnd]
+        letters = letters[~isEnd]
+        if len(numbers) != len(letters):
+            raise ValueError, 'Every Gerber word needs a number'
+        words = {}
+        for letter in self.wordLetters:
+            isLetter = letters == ord(letter)
+            values = numpy.zeros(numberOfBlocks,dtype=numpy.int64)
+            present = numpy.zeros(numberOfBlocks,dtype=bool)
+            values[blockNumbers[isLetter]] = numbers[isLetter]
+            present[blockNumbers[isLetter]] = True
+            words[letter] = (values,present)
+        return words
+    
+    def _extendedCommand(self,section):
+        if section.startswith('FS'):
+            match = self.formatPattern.match(section)
+            if not match:
+                raise ValueError, 'Unsupported format statement {section}'.format(section=section)
+            (zeroes,notation,integerPlaces,decimalPlaces,integerPlacesY,decimalPlacesY) = match.groups()
+            if notation != 'A':
+                raise NotImplementedError, 'Incremental coordinates are not supported'
+            if (integerPlaces,decimalPlaces) != (integerPlacesY,decimalPlacesY):
+                raise NotImplementedError, 'X and Y must have the same format'
+            self.omitTrailingZeroes = (zeroes == 'T')
+            self.integerPlaces = int(integerPlaces)
+            self.decimalPlaces = int(decimalPlaces)
+        elif section.startswith('MO'):
+            self.unit = {'MOMM*':1.,'MOIN*':25.4}[section]
+        elif section.startswith('AD'):
+            for match in self.aperturePattern.finditer(section):
+                (apertureNumber,shape,parameters) = match.groups()
+                self.apertures[int(apertureNumber)] = self._apertureDefinition(shape,parameters)
+        elif section.startswith('AM'):
+            if self.unit != 1.:
+                raise NotImplementedError, 'Aperture macros in inch are not supported'
+            self.apertureMacros.append(section)
+        elif section.startswith('LP'):
+            self._addLayer({'LPD*':False,'LPC*':True}[section])
+        elif section.startswith('AB'):
+            match = self.blockAperturePattern.match(section)
+            if match:
+                self.openBlockApertures.append((int(match.group(1)),self.polarity))
+                self.polarity = False
+            elif self.openBlockApertures:
+                (apertureNumber,self.polarity) = self.openBlockApertures.pop()
+                self.blockApertureNumbers.append(apertureNumber)
+            else:
+                raise ValueError, 'Unmatched block aperture end'
+        elif section.startswith('SR'):
+            match = self.stepAndRepeatPattern.match(section)
+            if self.repeatBlock == 'inside':
+                self.repeatBlock = 'after'
+            if match and self.repeatBlock == 'before':
+                (columns,rows,columnPitch,rowPitch) = match.groups()
+                self.stepAndRepeat = StepAndRepeat(int(columns),int(rows),float(columnPitch)*self.unit,float(rowPitch)*self.unit)
+                self.repeatBlock = 'inside'
+            elif match:
+                raise NotImplementedError, 'Only a single step and repeat block is supported'
+        elif section.startswith('IP'):
+            self.inverted = (section == 'IPNEG*')
+        elif section.startswith('IN'):
+            if self.name is None:
+                self.name = section[2:-1]
+        elif section.startswith('SF') or section.startswith('OF'):
+            if section not in ['SFA1.0B1.0*','SFA1B1*','OFA0.0B0.0*','OFA0B0*','OF*']:
+                raise NotImplementedError, 'Scale factors and offsets are not supported'
+        elif section and section[:2] not in ['LN','TF','TA','TO','TD']:
+            raise NotImplementedError, 'Unsupported extended command {section}'.format(section=section)
+    
+    def _apertureDefinition(self,shape,parameters):
+        if parameters is None:
+            return shape
+        if self.unit != 1.:
+            values = parameters.split('X')
+            if shape in ['C','R','O']:
+                scaledIndices = range(len(values))
+            elif shape == 'P':
+                scaledIndices = [0,3]
+            else:
+                raise NotImplementedError, 'Aperture macros in inch are not supported'
+            for index in scaledIndices:
+                if index < len(values):
+                    values[index] = '{0:.{1}f}'.format(float(values[index])*self.unit,self.decimalPlaces)
+            parameters = 'X'.join(values)
+        return shape + ',' + parameters
+    
+    @classmethod
+    def _forwardFill(cls,values,present,initialValue):
+        lastIndices = numpy.maximum.accumulate(numpy.where(present,numpy.arange(len(values)),-1))
+        return numpy.where(lastIndices >= 0,values[lastIndices],initialValue)
+    
+    def _interpret(self,words,blockLayers,layers):
+        gCodes = numpy.where(words['G'][1],words['G'][0],-1)
+        dCodes = numpy.where(words['D'][1],words['D'][0],-1)
+        unsupported = numpy.setdiff1d(gCodes,[-1,1,2,3,36,37,54,55,71,75,90])
+        if len(unsupported):
+            raise NotImplementedError, 'Unsupported G-codes {codes}'.format(codes=unsupported.tolist())
+        scale = self.unit/10**self.decimalPlaces
+        (x,xPresent) = words['X']
+        (y,yPresent) = words['Y']
+        x = self._forwardFill(x*scale,xPresent,0.)
+        y = self._forwardFill(y*scale,yPresent,0.)
+        i = words['I'][0]*scale
+        j = words['J'][0]*scale
+        previousX = numpy.concatenate([[0.],x[:-1]])
+        previousY = numpy.concatenate([[0.],y[:-1]])
+        
+        interpolations = self._forwardFill(gCodes,(gCodes >= 1) & (gCodes <= 3),1)
+        apertures = self._forwardFill(dCodes,dCodes >= 10,0)
+        # coordinate blocks without an operation repeat the previous one (deprecated but common)
+        operations = numpy.where((dCodes >= 1) & (dCodes <= 3),dCodes,0)
+        operations = numpy.where(xPresent | yPresent,self._forwardFill(operations,operations > 0,0),operations)
+        regionNumbers = numpy.cumsum(gCodes == 36)
+        inRegion = (regionNumbers - numpy.cumsum(gCodes == 37)) > 0
+        
+        flashes = ~inRegion & (operations == 3)
+        draws = ~inRegion & (operations == 1)
+        regionVertices = inRegion & ((operations == 1) | (operations == 2))
+        # the primitive each block adds to, 0 for blocks that only change state
+        kinds = numpy.select([flashes,draws & (interpolations == 1),draws & (interpolations != 1),regionVertices],[1,2,3,4],0)
+        
+        for (layerNumber,layer) in enumerate(layers):
+            blocks = numpy.flatnonzero((blockLayers == layerNumber) & (kinds > 0))
+            # runs of blocks of one kind become batches in file order
+            runStarts = numpy.flatnonzero(numpy.concatenate([[True],kinds[blocks][1:] != kinds[blocks][:-1]])) if len(blocks) else numpy.zeros(0,dtype=int)
+            for (runStart,runEnd) in zip(runStarts.tolist(),runStarts[1:].tolist()+[len(blocks)]):
+                run = blocks[runStart:runEnd]
+                kind = kinds[run[0]]
+                if kind == 1:
+                    layer._batch(FlashBatch).extend(numpy.column_stack([x[run],y[run],apertures[run]]))
+                elif kind == 2:
+                    layer._batch(StrokeBatch).extend(numpy.column_stack([previousX[run],previousY[run],x[run],y[run],apertures[run]]))
+                elif kind == 3:
+                    vertices = numpy.zeros((2*len(run),5))
+                    vertices[0::2,0:3] = numpy.column_stack([previousX[run],previousY[run],numpy.repeat(ContourBatch.move,len(run))])
+                    vertices[1::2] = numpy.column_stack([x[run],y[run],interpolations[run],previousX[run]+i[run],previousY[run]+j[run]])
+                    self._addContours(layer,vertices,numpy.arange(0,2*len(run),2),apertures[run])
+                else:
+                    self._addRegions(layer,run,x,y,previousX,previousY,i,j,operations,interpolations,regionNumbers)
+    
+    def _addRegions(self,layer,regionVertices,x,y,previousX,previousY,i,j,operations,interpolations,regionNumbers):
+        vertices = numpy.column_stack([x[regionVertices],y[regionVertices],
+                                       numpy.where(operations[regionVertices] == 2,ContourBatch.move,interpolations[regionVertices]),
+                                       previousX[regionVertices]+i[regionVertices],previousY[regionVertices]+j[regionVertices]])
+        # a region may start drawing from the current point without a D02
+        regions = regionNumbers[regionVertices]
+        implicitStarts = numpy.flatnonzero((numpy.concatenate([[True],regions[1:] != regions[:-1]])) & (vertices[:,2] != ContourBatch.move))
+        if len(implicitStarts):
+            startBlocks = regionVertices[implicitStarts]
+            vertices = numpy.insert(vertices,implicitStarts,numpy.column_stack([previousX[startBlocks],previousY[startBlocks],numpy.repeat(ContourBatch.move,len(startBlocks)),numpy.zeros((len(startBlocks),2))]),axis=0)
+        starts = numpy.flatnonzero(vertices[:,2] == ContourBatch.move)
+        self._addContours(layer,vertices,starts,numpy.zeros(len(starts),dtype=int))
+    
+    def _addContours(self,layer,vertices,starts,apertures):
+        # single vertex contours draw nothing
+        lengths = numpy.diff(numpy.concatenate([starts,[len(vertices)]]))
+        keep = lengths > 1
+        vertices = vertices[numpy.repeat(keep,lengths)]
+        starts = numpy.concatenate([[0],numpy.cumsum(lengths[keep])[:-1]]).astype(int) if keep.any() else numpy.zeros(0,dtype=int)
+        if len(starts):
+            batch = layer._batch(ContourBatch)
+            batch.contours.extend(numpy.column_stack([starts+len(batch.vertices),apertures[keep]]))
+            batch.extend(vertices)
+
 
 if __name__ == '__main__':
     import nose
@@ -1,10 +1,12 @@
 from excellon import Excellon
 from geometry import *
-from rs274x import GerberFile
+from rs274x import GerberFile,StepAndRepeat
+from utility import Statistics
 from stroketext import StrokeText,LayerMarker
 import zipfile
 import os
 import datetime
+import copy
 
 class Classification:
     pass
@@ -129,41 +131,46 @@ class Stack(list):
     @property
     def numberOfFaces(self):
         return len(self)
-    def __init__(self,numberOfFaces,title='Untitled',author='Author',notes=''):
+    def __init__(self,numberOfFaces,title='Untitled',author='Author',notes='',grid=None):
         self.title = title
         self.author = author
         self.creationMoment = datetime.datetime.now()
         self.skipLayerMarkerOutlineNumbers = []
         self.notes = notes
+        self.panelColumns = 1
+        self.panelRows = 1
         list.__init__(self,[None]*numberOfFaces)
         ## file initialisation
-        self._platedFile = Excellon('Drill Plated',plated=True)
-        self._nonPlatedFile = Excellon('Drill Unplated',plated=False)
+        self._platedFile = Excellon('Drill Plated',plated=True,grid=grid,drillIncrement=self.classification.drillIncrement)
+        self._nonPlatedFile = Excellon('Drill Unplated',plated=False,grid=grid,drillIncrement=self.classification.drillIncrement)
         self._drillFile = HoleFile(self._platedFile,self._nonPlatedFile)
         self.addHole = self._drillFile.addHole
+        self.addHoles = self._drillFile.addHoles
+        self.addLooseHoles = self._drillFile.addLooseHoles
+        self.blockFootprints = {} # see BlockFootprint
         
-        self.top = GerberFile('Signal 1 Top',physicalLayer=1)
-        self.topSolderMask = GerberFile('Soldermask Top')
-        self.topSilkScreen = GerberFile('Silkscreen Top')
+        self.top = GerberFile('Signal 1 Top',physicalLayer=1,grid=grid)
+        self.topSolderMask = GerberFile('Soldermask Top',grid=grid)
+        self.topSilkScreen = GerberFile('Silkscreen Top',grid=grid)
         self.topSilkScreenLine = self.topSilkScreen.addCircularAperture(0.23)
         self[0] = Face(self,self.top,self.topSolderMask,self.topSilkScreen,thickness=0.025)
         
-        self.innerOneFile = GerberFile('Signal 2 Inner',physicalLayer=2)
+        self.innerOneFile = GerberFile('Signal 2 Inner',physicalLayer=2,grid=grid)
         self[1] = Face(self,self.innerOneFile,thickness=0.035)        
         
-        self.innerTwoFile = GerberFile('Signal 3 Inner',physicalLayer=3)
+        self.innerTwoFile = GerberFile('Signal 3 Inner',physicalLayer=3,grid=grid)
         self[2] = Face(self,self.innerTwoFile,thickness=0.035)
         
-        self.bottom = GerberFile('Signal 4 Bottom',physicalLayer=4)
-        self.bottomSolderMask = GerberFile('Soldermask Bottom')
-        self.bottomSilkScreen = GerberFile('Silkscreen Bottom')
+        self.bottom = GerberFile('Signal 4 Bottom',physicalLayer=4,grid=grid)
+        self.bottomSolderMask = GerberFile('Soldermask Bottom',grid=grid)
+        self.bottomSilkScreen = GerberFile('Silkscreen Bottom',grid=grid)
         self[3] = Face(self,self.bottom,self.bottomSolderMask,self.bottomSilkScreen,thickness=0.025)
         
         self[-1].opposite = self[ 0]
         self[ 0].opposite = self[-1]        
         
         
-        self.mechanical = GerberFile('Mechanical Outline')
+        self.mechanical = GerberFile('Mechanical Outline',grid=grid)
         self.mechanicalApertureDiameter = 0.2
         self.boardOutline = Square(center=Location(0,0),width=100).outline()        
         
@@ -183,50 +190,143 @@ class Stack(list):
     def height(self):
         return self.rectangularHull.height
     @property
+    def gerberFiles(self):
+        files = [self.mechanical]
+        for face in self:
+            files += [gerberFile for gerberFile in [face.copper,face.solderMask,face._silkscreen] if gerberFile]
+        return files
+    
+    @property
+    def outputFiles(self):
+        return self.gerberFiles + [self._platedFile,self._nonPlatedFile]
+    def statistics(self):
+        '''
+        Statistics of all output files added up, as writeOut would write them:
+        with board outlines and layer markers, and the holes of every board in
+        the panel. The stack itself is left as it is.
+        '''
+        return sum([outputFile.statistics() for outputFile in self._completedCopy().outputFiles],Statistics())
+    def _completedCopy(self):
+        '''
+        The stack as writeOut completes it, without changing or cloning what is
+        drawn: the Gerber files are shared copies that only hold new batches for
+        the panel, board outlines and layer markers, the drill files new ones
+        that are filled with the holes.
+        '''
+        completed = copy.copy(self)
+        completed.mechanical = self.mechanical.sharedCopy()
+        for (faceNumber,face) in enumerate(self):
+            completedFace = copy.copy(face)
+            completedFace.stack = completed
+            (completedFace.copper,completedFace.solderMask,completedFace._silkscreen) = [gerberFile and gerberFile.sharedCopy() for gerberFile in [face.copper,face.solderMask,face._silkscreen]]
+            completed[faceNumber] = completedFace
+        completed.boardOutline = copy.copy(self.boardOutline)
+        drillFiles = []
+        for drillFile in [self._platedFile,self._nonPlatedFile]:
+            drillFiles.append(Excellon(drillFile.name,drillFile.plated,drillFile.grid,drillFile.drillIncrement,repeatCodes=drillFile.repeatCodes))
+            drillFiles[-1].merge(drillFile)
+        (completed._platedFile,completed._nonPlatedFile) = drillFiles
+        completed._drillFile = copy.copy(self._drillFile)
+        (completed._drillFile.platedFile,completed._drillFile.nonPlatedFile) = drillFiles
+        completed._completeOutputFiles()
+        return completed
+    
+    def panelise(self,columns,rows):
+        '''Repeat the board columns x rows times, separated by the break routing gap.'''
+        self.panelColumns = columns
+        self.panelRows = rows
+    def flattenPolarity(self,flatten=True):
+        '''Write every Gerber file as positive regions only, without clear layers.'''
+        for gerberFile in self.gerberFiles:
+            gerberFile.flatten = flatten
+    def optimiseDrillPaths(self,optimise=True):
+        '''Reorder the hits of both drill files for a shorter drill travel when written.'''
+        self._platedFile.optimisePath = optimise
+        self._nonPlatedFile.optimisePath = optimise
+    def drillTravels(self):
+        '''Drill travel (mm) before and after optimisation of both drill files, None before they are written.'''
+        return [drillFile.drillTravel for drillFile in [self._platedFile,self._nonPlatedFile]]
+    def useRepeatCodes(self,use=True):
+        '''Write rows of equally spaced hits with Excellon R codes, or explicitly for fabs without support.'''
+        self._platedFile.repeatCodes = use
+        self._nonPlatedFile.repeatCodes = use
+    def panelStepAndRepeat(self):
+        if self.panelColumns*self.panelRows == 1:
+            return None
+        return StepAndRepeat(self.panelColumns,self.panelRows,
+                             self.width+self.classification.breakRoutingGap,
+                             self.height+self.classification.breakRoutingGap)
+    def panelOutline(self):
+        boardHull = self.rectangularHull
+        lastOffset = self.panelStepAndRepeat().offsets()[-1]
+        panelHull = Rectangle(bottomLeft=boardHull.bottomLeft,topRight=boardHull.topRight+lastOffset)
+        return panelHull.outset(self.classification.panelBorder)
+    @property
     def timeStamp(self):
         return self.creationMoment.strftime('%Y-%m-%d %H:%M')
         
-    def writeOut(self,toZip=False):
-        if toZip:
-            zipFile = zipfile.ZipFile('../'+self.title+'.zip','w',zipfile.ZIP_DEFLATED)
-            outputFile = zipFile.filename
-        else:
-            outputFile = '../output/'
-            zipFile = None
-
+    def _completeOutputFiles(self):
+        '''
+        Adds what only the written files carry: the panel, board outlines and
+        layer markers to the Gerber files and all holes to the drill files.
+        Returns the outline of the whole output.
+        '''
         layerMarkers = []
         for (shapeNumber,shape) in enumerate(self.boardOutline):
             if shapeNumber not in self.skipLayerMarkerOutlineNumbers:
                 layerMarkers += [LayerMarker(Arrow(shape.bottomLeft,E), 4)]
 
         
-        if len(self.boardOutline) > 1:
+        stepAndRepeat = self.panelStepAndRepeat()
+        if stepAndRepeat:
+            panelOutline = self.panelOutline()
+            for gerberFile in self.gerberFiles:
+                gerberFile.stepAndRepeat = stepAndRepeat
+        elif len(self.boardOutline) > 1:
             self.boardOutline += [self.rectangularHull.outset(self.classification.panelBorder)]
         def addApertureAndShapesTo(gerberFile):
             apertureNumber = gerberFile.addCircularAperture(self.mechanicalApertureDiameter)
             for shape in self.boardOutline:
                 shape.outline().draw(gerberFile[30],apertureNumber)
+            if stepAndRepeat:
+                panelOutline.outline().draw(gerberFile.addPanelLayer(),apertureNumber)
             
         addApertureAndShapesTo(self.mechanical)
 #        StrokeText(textString='{title} {timeStamp}\n{notes}'.format(title=self.title,timeStamp=self.timeStamp,notes=self.notes),
 #                   startArrow=Arrow(self.rectangularHull.bottomLeft,E).outsetArrow(2.5),
 #                   gerberLayer=self.mechanical[0]).draw() 
-        self.mechanical.writeOut(zipFile=zipFile)   
-
 
         for face in self:
             addApertureAndShapesTo(face.copper)
             for layerMarker in layerMarkers:
                 layerMarker.draw(face.copper)
-            face.writeOut(zipFile=zipFile)
         
-   
-        self._drillFile.writeOut(zipFile=zipFile)
+        if stepAndRepeat:
+            self._drillFile.fillDrillFiles(stepAndRepeat.offsets())
+            return panelOutline
+        else:
+            self._drillFile.fillDrillFiles()
+            return self.rectangularHull
+        
+    def writeOut(self,toZip=False):
+        if toZip:
+            zipFile = zipfile.ZipFile('../'+self.title+'.zip','w',zipfile.ZIP_DEFLATED)
+            outputFile = zipFile.filename
+        else:
+            outputFile = '../output/'
+            zipFile = None
+
+        outlineHull = self._completeOutputFiles()
+        self.mechanical.writeOut(zipFile=zipFile)
+        for face in self:
+            face.writeOut(zipFile=zipFile)
+        self._platedFile.writeOut(zipFile=zipFile)
+        self._nonPlatedFile.writeOut(zipFile=zipFile)
         
         if zipFile:
             zipFile.close()
             
-        print 'Written out {width:.2f} x {height:.2f} mm to {outputFile}'.format(width=self.width,height=self.height,outputFile = os.path.abspath(outputFile))
+        print 'Written out {width:.2f} x {height:.2f} mm to {outputFile}'.format(width=outlineHull.width,height=outlineHull.height,outputFile = os.path.abspath(outputFile))
         
 if __name__ == '__main__':
     stack = Stack(4)
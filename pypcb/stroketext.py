@@ -52,8 +52,7 @@ class StrokeText(Drawable):
         strokes = strokes + self.startArrow.origin
         
         apertureNumber = self.gerberLayer.gerberFile.addCircularAperture(self.lineWidth)
-        for (fromLocation,toLocation) in zip(strokes[0::2,:],strokes[1::2,:]):
-            self.gerberLayer.addSingleStroke(fromLocation,toLocation,apertureNumber)
+        self.gerberLayer.addStrokes(strokes[0::2,:],strokes[1::2,:],apertureNumber)
     def rectangularHull(self):
         # TODO: fix this
         return Rectangle(self.startArrow,0,0)
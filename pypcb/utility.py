@@ -0,0 +1,92 @@
+import numpy
+import os
+import tempfile
+
+def writeToZip(zipFile,entryName,writeTo):
+    '''
+    Streams the output of writeTo(fileObject) into a new zipFile entry via a
+    temporary file, so the entry never has to be held in memory as a whole.
+    '''
+    (fileDescriptor,temporaryPath) = tempfile.mkstemp()
+    try:
+        with os.fdopen(fileDescriptor,'w') as temporaryFile:
+            writeTo(temporaryFile)
+        zipFile.write(temporaryPath,entryName)
+    finally:
+        os.remove(temporaryPath)
+
+class GrowingArray(object):
+    '''
+    Rows of a fixed number of columns, stored in a preallocated NumPy array
+    that doubles its capacity when full, so appending is amortised O(1).
+    '''
+    def __init__(self,columns,dtype=float,capacity=16):
+        self._data = numpy.empty((capacity,columns),dtype=dtype)
+        self._length = 0
+    def __len__(self):
+        return self._length
+    @property
+    def array(self):
+        return self._data[:self._length]
+    def _reserve(self,length):
+        if length > len(self._data):
+            newData = numpy.empty((max(length,2*len(self._data)),self._data.shape[1]),dtype=self._data.dtype)
+            newData[:self._length] = self._data[:self._length]
+            self._data = newData
+    def append(self,row):
+        self._reserve(self._length+1)
+        self._data[self._length] = row
+        self._length += 1
+    def extend(self,rows):
+        rows = numpy.asarray(rows,dtype=self._data.dtype).reshape(-1,self._data.shape[1])
+        self._reserve(self._length+len(rows))
+        self._data[self._length:self._length+len(rows)] = rows
+        self._length += len(rows)
+
+class CoordinateGrid(object):
+    '''
+    Fixed-point coordinates as int64 multiples of 10**-decimalPlaces mm
+    (6 for nanometres). Snapping rounds half away from zero.
+    '''
+    def __init__(self,decimalPlaces=6):
+        self.decimalPlaces = decimalPlaces
+    def __repr__(self):
+        return 'CoordinateGrid({decimalPlaces:d})'.format(decimalPlaces=self.decimalPlaces)
+    @property
+    def step(self):
+        return 10.**-self.decimalPlaces
+    def snap(self,millimetres):
+        scaled = numpy.asarray(millimetres,dtype=float)*10.**self.decimalPlaces
+        return (numpy.sign(scaled)*numpy.floor(numpy.abs(scaled)+0.5)).astype(numpy.int64)
+    def millimetres(self,units):
+        return numpy.asarray(units)/10.**self.decimalPlaces
+    def toDecimalPlaces(self,units,decimalPlaces):
+        '''Units rounded to integer multiples of 10**-decimalPlaces mm, without floating point.'''
+        units = numpy.asarray(units,dtype=numpy.int64)
+        if decimalPlaces >= self.decimalPlaces:
+            return units*10**(decimalPlaces-self.decimalPlaces)
+        factor = 10**(self.decimalPlaces-decimalPlaces)
+        return numpy.sign(units)*((numpy.abs(units)+factor//2)//factor)
+
+class Statistics(dict):
+    '''Counts by name, that add up name by name (missing names count as 0).'''
+    def __add__(self,other):
+        total = Statistics(self)
+        for (name,count) in other.items():
+            total[name] = total.get(name,0) + count
+        return total
+    __radd__ = __add__
+
+class ByteCounter(object):
+    '''File object that only counts the bytes written to it.'''
+    def __init__(self):
+        self.bytes = 0
+    def write(self,string):
+        self.bytes += len(string)
+
+def raggedRanges(starts,ends):
+    '''(range number, value) for every value in the ranges [start, end).'''
+    lengths = numpy.maximum(ends-starts,0)
+    rangeNumbers = numpy.repeat(numpy.arange(len(lengths)),lengths)
+    values = numpy.arange(lengths.sum()) - numpy.repeat(numpy.cumsum(lengths)-lengths-starts,lengths)
+    return (rangeNumbers,values)
@@ -1,4 +1,8 @@
 import unittest
+import numpy
+import sys
+import zipfile
+from StringIO import StringIO
 
 from pypcb import *
 
@@ -28,6 +32,136 @@ X+1.000Y+0.000
 X-10.500Y-10.000
 M30
 ''')
+    def test_floatNoise(self):
+        self.file.addHole(Location(0.,0.),0.1+0.2)
+        self.file.addHole(Location(1.,0.),0.3)
+        self.assertEqual(len(self.file.tools),1)
+        self.assertEqual(self.file.tools[0].hits,2)
+    def test_drillIncrement(self):
+        drillFile = Excellon('testDrillFile',plated=True,drillIncrement=0.05)
+        drillFile.addHole(Location(0.,0.),0.349)
+        drillFile.addHole(Location(1.,0.),0.351)
+        drillFile.addHole(Location(2.,0.),0.38)
+        self.assertEqual([str(tool) for tool in drillFile.tools],['T1C0.350\n','T2C0.400\n'])
+    def test_consolidate(self):
+        for (x,diameter) in [(0.,1.),(1.,0.5),(2.,0.52),(3.,0.52),(4.,0.6)]:
+            self.file.addHole(Location(x,0.),diameter)
+        self.file.consolidate(0.05)
+        self.assertEqual([(tool.number,tool.diameter,tool.hits) for tool in self.file.tools],[(1,0.52,3),(2,0.6,1),(3,1.,1)])
+        self.assertEqual(self.file.tools[0].drillString(),'T01\nX+2.000Y+0.000\nX+3.000Y+0.000\nX+1.000Y+0.000\n')
+        self.file.addHole(Location(5.,0.),0.5)
+        self.assertEqual(self.file.tools[0].hits,4)
+    def test_grid(self):
+        gridFile = Excellon('testDrillFile',plated=True,grid=CoordinateGrid(6))
+        for drillFile in [self.file,gridFile]:
+            drillFile.addHole(Location(1.5,-1),0.5)
+            drillFile.addHole(Location(0.0015,-10.0005),1.)
+        self.assertEqual(str(gridFile),str(self.file))
+        self.assertIn('X+0.002Y-10.001\n',str(gridFile))
+    def test_statistics(self):
+        self.file.addHole(Location(1.5,-1),0.5)
+        self.file.addHole(Location(1.,0.),1.)
+        self.file.addHole(Location(-10.5,-10.),1.)
+        self.assertEqual(self.file.statistics(),{'tools':2,'hits':3,'bytes':len(str(self.file))})
+    def test_addHoles(self):
+        locations = numpy.array([[1.5,-1.],[0.0015,-10.0005],[-0.0001,999.9994]])
+        gridFile = Excellon('testDrillFile',plated=True,grid=CoordinateGrid(6))
+        for drillFile in [self.file,gridFile]:
+            single = Excellon('testDrillFile',plated=True,grid=drillFile.grid)
+            for location in locations:
+                single.addHole(Location(location),0.5)
+            drillFile.addHoles(locations,0.5)
+            self.assertEqual(drillFile.tools[0].hits,3)
+            self.assertEqual(str(drillFile),str(single))
+        self.assertIn('X+1.500Y-1.000\nX+0.002Y-10.001\nX-0.000Y+999.999\n',str(self.file))
+        self.assertIn('X+1.500Y-1.000\nX+0.002Y-10.001\nX+0.000Y+999.999\n',str(gridFile))
+    def test_roundTrip(self):
+        self.file.addHole(Location(1.5,-1),0.5)
+        self.file.addHoles(numpy.array([[1.,0.],[-10.5,-10.],[0.,999.999]]),1.)
+        readFile = Excellon.fromString(str(self.file),'read')
+        self.assertEqual((readFile.name,readFile.plated),('read',True))
+        self.assertEqual([(tool.number,tool.diameter) for tool in readFile.tools],[(1,0.5),(2,1.)])
+        numpy.testing.assert_array_equal(readFile.tools[1].locations.array,[[1.,0.],[-10.5,-10.],[0.,999.999]])
+        self.assertEqual(str(readFile),str(self.file))
+        readFile.addHole(Location(2.,2.),1.)
+        self.assertEqual(readFile.tools[1].hits,4)
+    def test_readVendorFile(self):
+        readFile = Excellon.fromString('M48\nINCH,LZ\nT1C0.0200\nT2F200S65C0.0400\n%\nT01\nX0125Y-01\nY02\nT2\nX+00005Y00005\nM30\n')
+        self.assertEqual([tool.diameter for tool in readFile.tools],[0.508,1.016])
+        numpy.testing.assert_allclose(readFile.tools[0].locations.array,[[31.75,-25.4],[31.75,50.8]])
+        numpy.testing.assert_allclose(readFile.tools[1].locations.array,[[0.127,0.127]])
+        self.assertRaises(NotImplementedError,Excellon.fromString,'M48\nMETRIC,TZ\nT1C0.5\n%\nT1\nG00X1Y1\nM30\n')
+    def test_readRepeats(self):
+        # the repeated hits are drilled with the tool selected at the R code,
+        # and a coordinate left out after them repeats the last repeated one
+        readFile = Excellon.fromString('M48\nMETRIC,TZ\nT1C0.5\nT2C1.0\n%\nT01\nX+0.000Y+0.000\nT02\nR02X+1.000\nY+5.000\nM30\n')
+        numpy.testing.assert_allclose(readFile.tools[0].locations.array,[[0.,0.]])
+        numpy.testing.assert_allclose(readFile.tools[1].locations.array,[[1.,0.],[2.,0.],[2.,5.]])
+    def test_merge(self):
+        self.file.addHole(Location(1.,0.),0.5)
+        other = Excellon('other',plated=True)
+        other.addHole(Location(0.,0.),1.)
+        other.addHole(Location(0.,1.),0.5)
+        self.file.merge(other,offset=(10.,0.))
+        self.assertEqual([(tool.diameter,tool.locations.array.tolist()) for tool in self.file.tools],[(0.5,[[1.,0.],[10.,1.]]),(1.,[[10.,0.]])])
+    def test_repeatCodes(self):
+        gridFile = Excellon('testDrillFile',plated=True,grid=CoordinateGrid(6))
+        explicitFile = Excellon('testDrillFile',plated=True,repeatCodes=False)
+        row = numpy.column_stack([numpy.arange(5)*0.6,numpy.zeros(5)+1.])
+        for drillFile in [self.file,gridFile,explicitFile]:
+            drillFile.addHoles(numpy.vstack([row,[[2.4,2.],[2.4,3.],[5.,5.]]]),0.5)
+            drillFile.addHoles(numpy.column_stack([numpy.zeros(150),numpy.arange(150)*0.1]),1.)
+        # the corner hit that ends one run starts the next
+        self.assertEqual(self.file.tools[0].drillString(),'T01\nX+0.000Y+1.000\nR04X+0.600Y+0.000\nR02X+0.000Y+1.000\nX+5.000Y+5.000\n')
+        self.assertEqual(self.file.tools[1].drillString(),'T02\nX+0.000Y+0.000\nR99X+0.000Y+0.100\nR50X+0.000Y+0.100\n')
+        self.assertEqual(str(gridFile),str(self.file))
+        self.assertEqual(len(explicitFile.tools[0].drillString().splitlines()),9)
+        for drillFile in [self.file,explicitFile]:
+            readFile = Excellon.fromString(str(drillFile))
+            for (readTool,tool) in zip(readFile.tools,explicitFile.tools):
+                numpy.testing.assert_allclose(readTool.locations.array,tool.locations.array,atol=1e-9)
+    def test_offGridRepeats(self):
+        # a pitch of 1.1025 mm is written as steps of 1.102 and 1.103 mm
+        holes = numpy.column_stack([numpy.arange(400)*1.1025,numpy.arange(400)*0.25])
+        self.file.addHoles(holes,0.5)
+        hitLines = self.file.tools[0].drillString().splitlines()[1:]
+        self.assertLess(len(hitLines),len(holes)/4)
+        readFile = Excellon.fromString(str(self.file))
+        numpy.testing.assert_allclose(readFile.tools[0].locations.array,holes,atol=0.0015)
+    def test_optimiseDrillPath(self):
+        numpy.random.seed(0)
+        holes = numpy.random.uniform(0.,50.,(400,2))
+        for (x,y) in holes[:50]:
+            self.file.addHole(Location(x,y),1.)
+        for (x,y) in holes[50:]:
+            self.file.addHole(Location(x,y),0.5)
+        hitLines = sorted(self.file.drillString().splitlines())
+        (travelBefore,travelAfter) = self.file.optimiseDrillPath()
+        self.assertAlmostEqual(travelBefore,pathLength(holes))
+        self.assertLess(travelAfter,0.15*travelBefore)
+        self.assertAlmostEqual(travelAfter,self.file.travel())
+        self.assertEqual(self.file.drillTravel,(travelBefore,travelAfter))
+        self.assertEqual([(tool.number,tool.diameter,tool.hits) for tool in self.file.tools],[(1,0.5,350),(2,1.,50)])
+        self.assertEqual(sorted(self.file.drillString().splitlines()),hitLines)
+    def test_optimiseOnWrite(self):
+        self.file.optimisePath = True
+        self.file.addHoles(numpy.array([[0.,0.],[5.,0.],[1.,0.],[4.,0.]]),0.5)
+        zipFile = zipfile.ZipFile(StringIO(),'w')
+        output = StringIO()
+        (stdout,sys.stdout) = (sys.stdout,output)
+        try:
+            self.file.writeOut(zipFile=zipFile)
+        finally:
+            sys.stdout = stdout
+        # the travel is kept for the caller, nothing is printed
+        self.assertEqual(output.getvalue(),'')
+        self.assertAlmostEqual(self.file.drillTravel[0],12.)
+        self.assertAlmostEqual(self.file.drillTravel[1],5.)
+    def test_twoOpt(self):
+        # a zigzag over a row of points is straightened out
+        points = numpy.array([[x,0.] for x in [0.,2.,1.,3.,4.,6.,5.,7.]])
+        order = twoOpt(points,numpy.arange(len(points)))
+        self.assertAlmostEqual(pathLength(points[order]),7.)
 
 if __name__ == '__main__':
 #     import nose
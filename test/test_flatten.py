@@ -0,0 +1,88 @@
+import unittest
+import nose
+import numpy
+
+from pypcb import *
+
+class PolarityFlattener_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('flatten',decimalPlaces=4)
+        self.aperture = self.gerberFile.addCircularAperture(2.)
+        self.window = {'bottomLeft':Location(-5.,-5.),'topRight':Location(15.,15.)}
+        self.gerberFile[0].addOutline([Stroke(Location(-4.,-4.)),Stroke(Location(14.,-4.)),Stroke(Location(14.,14.)),Stroke(Location(-4.,14.))])
+    def assertSameImage(self,gerberFile,flatFile):
+        original = GerberRasteriser(gerberFile,dpi=254.,**self.window).image()
+        flat = GerberRasteriser(flatFile,dpi=254.,**self.window).image()
+        self.assertLess((original != flat).sum(),0.002*original.size)
+        self.assertGreater(original.sum(),0)
+    def assertPositive(self,flatFile):
+        self.assertEqual([layer.inverted for layer in flatFile.layers],[False])
+        self.assertNotIn('%LPC',str(flatFile))
+    def test_clearedPlane(self):
+        self.gerberFile[1].addFlashes(numpy.array([[0.,0.],[1.,0.5],[10.,10.]]),self.aperture)
+        self.gerberFile[2].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(0.5))
+        self.gerberFile[2].addStrokes(numpy.array([[0.,5.]]),numpy.array([[8.,6.]]),self.gerberFile.addRectangularAperture(1.,0.5))
+        self.gerberFile[3].addStrokes(numpy.array([[-6.,3.]]),numpy.array([[16.,3.]]),self.gerberFile.addCircularAperture(0.3))
+        flatFile = self.gerberFile.flattened()
+        self.assertPositive(flatFile)
+        self.assertSameImage(self.gerberFile,flatFile)
+    def test_area(self):
+        self.gerberFile[1].flashAperture(Location(5.,5.),self.aperture)
+        regions = PolarityFlattener(self.gerberFile,tolerance=0.001).regions()
+        area = sum([0.5*numpy.cross(region,numpy.roll(region,-1,axis=0)).sum() for region in regions])
+        self.assertAlmostEqual(area,18.**2-numpy.pi,delta=0.01)
+    def test_arcs(self):
+        self.gerberFile[1].addFlashes(numpy.array([[0.,0.],[5.,5.],[10.,0.]]),self.aperture)
+        flatFile = self.gerberFile.flattened()
+        (contourBatch,) = flatFile[0]._batches
+        self.assertEqual(len(contourBatch.contourSlices()),1)
+        # the holes are joined to the outline by cut-ins and drawn as arcs, the
+        # first one in two halves as the cut-in of the last one ends on it
+        self.assertEqual(len(contourBatch.vertices),17)
+        self.assertEqual((contourBatch.vertices.array[:,2] == ContourBatch.clockWise).sum(),4)
+        self.assertSameImage(self.gerberFile,flatFile)
+    def test_keptFlashes(self):
+        self.gerberFile[1].flashAperture(Location(0.,0.),self.aperture)
+        pad = self.gerberFile.addCircularAperture(1.)
+        self.gerberFile[2].addFlashes(numpy.array([[0.,0.],[10.,10.]]),pad)
+        self.gerberFile[3].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(0.5))
+        flatFile = self.gerberFile.flattened()
+        self.assertPositive(flatFile)
+        # the pad that no clear layer touches stays a flash
+        (flashBatch,) = [batch for batch in flatFile[0]._batches if type(batch) is FlashBatch]
+        self.assertEqual(flashBatch.inMillimetres().tolist(),[[10.,10.,pad]])
+        self.assertEqual(flatFile.apertures[pad],self.gerberFile.apertures[pad])
+        self.assertSameImage(self.gerberFile,flatFile)
+    def test_blockAperture(self):
+        def drawRing(block):
+            block[0].flashAperture(Location(0.,0.),self.aperture)
+            block[1].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(1.))
+        ring = self.gerberFile.addBlockAperture('ring',drawRing)
+        self.gerberFile[1].addFlashes(numpy.array([[0.,0.],[5.,5.]]),ring)
+        self.gerberFile[2].flashAperture(Location(10.,0.),ring)
+        flatFile = self.gerberFile.flattened()
+        self.assertPositive(flatFile)
+        self.assertEqual(flatFile.blockApertures,[])
+        self.assertSameImage(self.gerberFile,flatFile)
+    def test_stepAndRepeat(self):
+        self.gerberFile[1].flashAperture(Location(0.,0.),self.aperture)
+        self.gerberFile.stepAndRepeat = StepAndRepeat(2,1,20.,0.)
+        self.gerberFile.addPanelLayer().addSingleStroke(Location(-5.,-5.),Location(35.,-5.),self.aperture)
+        self.window['topRight'] = Location(45.,15.)
+        flatFile = self.gerberFile.flattened()
+        self.assertPositive(flatFile)
+        self.assertIn('%SRX2Y1',str(flatFile))
+        self.assertSameImage(self.gerberFile,flatFile)
+    def test_flattenOnWrite(self):
+        self.gerberFile[1].flashAperture(Location(0.,0.),self.aperture)
+        self.gerberFile.flatten = True
+        self.assertNotIn('%LPC',str(self.gerberFile))
+        self.assertEqual(str(self.gerberFile),str(self.gerberFile.flattened()))
+    def test_nothingDark(self):
+        blankFile = GerberFile('blank')
+        blankFile[1].flashAperture(Location(0.,0.),blankFile.addCircularAperture(1.))
+        self.assertEqual(blankFile.flattened().layers,[])
+
+if __name__ == '__main__':
+    import nose
+    nose.run(argv=['-w','../test','-v'])
@@ -10,6 +10,37 @@ class Location_test(unittest.TestCase):
         b = Location(3.,-1.5)
         self.assertEqual(type(a-b),PlaneVector)
         (a-b).assertAlmostEqual(PlaneVector(-2.,3.5))
+    def test_arithmetic(self):
+        a = Location(1.,2.)
+        self.assertEqual(type(a+PlaneVector(1.,1.)),Location)
+        self.assertEqual(type(PlaneVector(1.,1.)+a),Location)
+        self.assertEqual(type(a-PlaneVector(1.,1.)),Location)
+        self.assertEqual((a*2.).tolist(),[2.,4.])
+        self.assertEqual(type(numpy.float64(2.)*a),Location)
+        self.assertEqual((a+numpy.array([1.,1.])).tolist(),[2.,3.])
+        self.assertEqual(type(numpy.array([1.,1.])+a),Location)
+        numpy.testing.assert_array_equal(numpy.zeros((3,2))+a,[[1.,2.]]*3)
+    def test_numpy(self):
+        points = [Location(1.,2.),Location(3.,4.)]
+        numpy.testing.assert_array_equal(numpy.asarray(points[0]),[1.,2.])
+        numpy.testing.assert_array_equal(PlaneVector.toArray(points),[[1.,2.],[3.,4.]])
+        self.assertEqual(Location.listFromArray(numpy.array([[1.,2.],[3.,4.]])),points)
+        self.assertEqual(type(Location.listFromArray(numpy.array([[1.,2.]]))[0]),Location)
+        self.assertEqual(Location(numpy.array([5.,6.])),Location(5.,6.))
+    def test_copy(self):
+        a = Location(1.,2.)
+        import copy,pickle
+        for copied in [copy.deepcopy(a),pickle.loads(pickle.dumps(a,2))]:
+            self.assertEqual(copied,a)
+            self.assertEqual(type(copied),Location)
+    def test_immutable(self):
+        a = Location(1.,2.)
+        self.assertRaises(AttributeError,setattr,a,'x',3.)
+        self.assertEqual({a:1}[Location(1.,2.)],1)
+        hole = Hole(a,0.5)
+        self.assertTrue(hole.location is a)
+        hole.translate(PlaneVector(1.,0.))
+        self.assertEqual((hole.location,a),(Location(2.,2.),Location(1.,2.)))
 
 class UnitVector_test(unittest.TestCase):
     def setUp(self):
@@ -18,6 +49,11 @@ class UnitVector_test(unittest.TestCase):
         self.direction.assertAlmostEqual(numpy.array([-1/numpy.sqrt(2),+1/numpy.sqrt(2)]))
         
 class Direction_test(unittest.TestCase):
+    def test_orthogonal(self):
+        self.assertEqual(type(E.orthogonal()),Direction)
+        E.orthogonal().assertAlmostEqual(S)
+        self.assertAlmostEqual(N.angle(),0.5*numpy.pi)
+        self.assertEqual(str(NE),'NE')
     def test_parallel(self):
         self.assertTrue(NE.parallelWith(NE))
         self.assertTrue(NE.parallelWith(SW))
@@ -28,6 +64,13 @@ class Arrow_test(unittest.TestCase):
         self.arrow = Arrow(Location(0.,1.),Direction(-1.,1.))
     def test_angle(self):
         self.assertAlmostEqual(self.arrow.angle(),0.75*numpy.pi)
+    def test_immutable(self):
+        self.assertRaises(AttributeError,setattr,self.arrow,'origin',Location(0.,0.))
+        import copy,pickle
+        self.assertTrue(copy.deepcopy(self.arrow) is self.arrow)
+        pickle.loads(pickle.dumps(self.arrow,2)).assertAlmostEqual(self.arrow)
+        arrow = Arrow(numpy.array([1.,2.]),E)
+        self.assertEqual(type(arrow.origin),Location)
     def test_along(self):
         alongLocation = self.arrow.along(numpy.sqrt(8.))
         alongLocation.assertAlmostEqual(Location(-2.,3.))
@@ -44,6 +87,37 @@ class Arrow_test(unittest.TestCase):
         leftRight[0].assertAlmostEqual(Location(-1.,0.))
         leftRight[1].assertAlmostEqual(Location(1.,2.))
 
+class ArrowArray_test(unittest.TestCase):
+    def setUp(self):
+        self.arrowList = [Arrow(Location(0.,1.),Direction(-1.,1.)),Arrow(Location(2.,-3.),E),Arrow(Location(-1.,4.),Direction(0.3,-2.))]
+        self.arrows = ArrowArray.fromArrows(self.arrowList)
+    def assertArrowsAlmostEqual(self,arrowArray,arrowList):
+        self.assertEqual(len(arrowArray),len(arrowList))
+        for (arrow,expected) in zip(arrowArray,arrowList):
+            arrow.assertAlmostEqual(expected)
+    def test_sequence(self):
+        self.assertEqual(type(self.arrows[1]),Arrow)
+        self.assertArrowsAlmostEqual(self.arrows[1:],self.arrowList[1:])
+        self.assertArrowsAlmostEqual(self.arrows[numpy.array([True,False,True])],self.arrowList[::2])
+    def test_matchesArrow(self):
+        lengths = numpy.array([1.,-2.,0.5])
+        numpy.testing.assert_allclose(self.arrows.along(lengths),[arrow.along(length) for (arrow,length) in zip(self.arrowList,lengths)])
+        numpy.testing.assert_allclose(self.arrows.angles(),[arrow.angle() for arrow in self.arrowList])
+        self.assertArrowsAlmostEqual(self.arrows.rotated(0.3),[arrow.rotated(0.3) for arrow in self.arrowList])
+        self.assertArrowsAlmostEqual(self.arrows.outsetArrow(lengths),[arrow.outsetArrow(length) for (arrow,length) in zip(self.arrowList,lengths)])
+        self.assertArrowsAlmostEqual(self.arrows.rotatedAround(Location(1.,1.),-0.25*numpy.pi),[arrow.rotatedAround(Location(1.,1.),-0.25*numpy.pi) for arrow in self.arrowList])
+        (lefts,rights) = self.arrows.leftRight(2.)
+        for (arrow,left,right) in zip(self.arrowList,lefts,rights):
+            arrow.left(2.).assertAlmostEqual(Location(left))
+            arrow.right(2.).assertAlmostEqual(Location(right))
+    def test_broadcast(self):
+        angles = numpy.linspace(0.,numpy.pi,5)
+        fan = ArrowArray.fromArrows(self.arrowList[:1]).rotated(angles).alongArrow(2.)
+        self.assertArrowsAlmostEqual(fan,[self.arrowList[0].rotated(angle).alongArrow(2.) for angle in angles])
+    def test_repeatRight(self):
+        arrow = self.arrowList[2]
+        self.assertArrowsAlmostEqual(arrow.repeatRight(0.635,4),[arrow.outsetArrow(0.635*index) for index in range(4)])
+
 class ALine_test(unittest.TestCase):
     def test_horizontalLinesDontIntersect(self):
         topLine = ALine(arrow=Arrow(Location(0,1),E))
@@ -114,6 +188,16 @@ class LineList_test(unittest.TestCase):
         intersection = self.rectangleLines.firstIntersection(self.cuttingLineSegment)
         intersection[0].assertAlmostEqual(Location(1,0))         
         self.assertEqual(intersection[1],0)
+    def test_stampBatch(self):
+        for center in [False,True]:
+            arrows = []
+            self.rectangleLines.stamp(0.3,arrows.append,center=center)
+            batches = []
+            self.rectangleLines.stampBatch(0.3,batches.append,center=center)
+            self.assertEqual(len(batches),1)
+            self.assertEqual(len(batches[0]),len(arrows))
+            for (arrow,batchArrow) in zip(arrows,batches[0]):
+                arrow.assertAlmostEqual(batchArrow)
 
         
 class Trace_test(unittest.TestCase):
@@ -131,6 +215,18 @@ class Trace_test(unittest.TestCase):
     def test_along2(self):
         alongArrow = self.trace.alongArrow(numpy.pi/2+1+numpy.pi/4)
         alongArrow.assertAlmostEqual(Arrow(Location(2.-1./numpy.sqrt(2),2.+1./numpy.sqrt(2)),Direction(1.,1.)))
+    def test_alongArrows(self):
+        lengths = [-0.5,0.,0.3,numpy.pi/2,2.,numpy.pi+1.,numpy.pi+2.5]
+        for (length,arrow) in zip(lengths,self.trace.alongArrows(lengths)):
+            arrow.assertAlmostEqual(self.trace.alongArrow(length))
+    def test_segmentEnds(self):
+        self.assertAlmostEqual(self.trace.length,numpy.pi+1.)
+        self.trace.append(LineSegment(2.))
+        self.assertAlmostEqual(self.trace.length,numpy.pi+3.)
+        self.trace.alongArrow(numpy.pi+2.).assertAlmostEqual(Arrow(Location(3.,3.),Direction(1.,0.)))
+        del self.trace[0]
+        self.assertEqual(len(self.trace.segmentEnds),3)
+        self.assertAlmostEqual(self.trace.length,numpy.pi/2+3.)
     def test_insert(self):
         trace = Trace(Arrow(Location(2.,0.),Direction(0.,-1.)))
         trace.append(LineSegment(1.))
@@ -237,6 +333,45 @@ class Outline_test(unittest.TestCase):
 #                                                    Location(0,0),
 #                                                    Location(2,0) ]))                                                    
 
+class HoleFile_test(unittest.TestCase):
+    def test_addHoles(self):
+        holeFile = HoleFile(Excellon('plated',plated=True),Excellon('nonPlated',plated=False))
+        holeFile.addHole(Hole(Location(1.,2.),0.5))
+        holeFile.addHoles(numpy.array([[3.,4.],[5.,6.]]),0.5)
+        holeFile.addHoles(numpy.array([[7.,8.]]),3.,plated=False)
+        holeFile.platedFile.writeOut = holeFile.nonPlatedFile.writeOut = lambda *args,**kwargs: None
+        holeFile.writeOut(offsets=[Vector([0.,0.]),Vector([10.,0.])])
+        self.assertEqual(holeFile.platedFile.tools[0].locations.array.tolist(),[[1.,2.],[3.,4.],[5.,6.],[11.,2.],[13.,4.],[15.,6.]])
+        self.assertEqual(holeFile.nonPlatedFile.tools[0].locations.array.tolist(),[[7.,8.],[17.,8.]])
+    def test_looseHoles(self):
+        holeFile = HoleFile(None,None)
+        for x in [0.,0.05,0.08,1.,2.,2.09]:
+            holeFile.addHole(Hole(Location(x,0.),0.3),fixed=False)
+        self.assertEqual([hole.location.tolist() for hole in holeFile.fixedHoles],[[0.025,0.],[2.045,0.]])
+        self.assertEqual([hole.location.tolist() for hole in holeFile.looseHoles],[[0.08,0.],[1.,0.]])
+    def test_looseHolesOfOtherKinds(self):
+        holeFile = HoleFile(None,None)
+        holeFile.addHole(Hole(Location(0.,0.),0.3),fixed=False)
+        holeFile.addHole(Hole(Location(0.05,0.),0.4),fixed=False)
+        holeFile.addHole(Hole(Location(0.,0.05),0.3,plated=False),fixed=False)
+        holeFile.addLooseHoles(numpy.array([[0.05,0.05]]),0.5)
+        self.assertEqual(holeFile.fixedHoles,[])
+        self.assertEqual([hole.diameter for hole in holeFile.looseHoles],[0.3,0.4,0.3,0.5])
+        holeFile.addLooseHoles(numpy.array([[0.02,0.]]),0.3)
+        self.assertEqual([(hole.location.tolist(),hole.diameter,hole.plated) for hole in holeFile.fixedHoles],[([0.01,0.],0.3,True)])
+    def test_addLooseHoles(self):
+        numpy.random.seed(0)
+        locations = numpy.random.uniform(0.,5.,(500,2))
+        (single,bulk) = (HoleFile(None,None),HoleFile(None,None))
+        single.addHole(Hole(Location(1.,1.),0.3),fixed=False)
+        bulk.addHole(Hole(Location(1.,1.),0.3),fixed=False)
+        for location in locations:
+            single.addHole(Hole(Location(location),0.3),fixed=False)
+        bulk.addLooseHoles(locations,0.3)
+        for holes in ['fixedHoles','looseHoles']:
+            self.assertEqual([hole.location.tolist() for hole in getattr(bulk,holes)],[hole.location.tolist() for hole in getattr(single,holes)])
+        self.assertTrue(len(bulk.fixedHoles) > 0)
+
 if __name__ == '__main__':
     import nose
     nose.run(argv=['-w','../test','-v'])
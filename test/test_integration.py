@@ -23,6 +23,80 @@ G37*
 ''')
 
 
+class ViaPair(BlockFootprint):
+    '''Two vias on either side of location, placed with drawAt.'''
+    def __init__(self,location,stack):
+        self.location = location
+        self.stack = stack
+    def footprintKey(self):
+        return ()
+    def drawFootprint(self):
+        via = MinimumVia(location=self.location,padFaceDiameterTuples=[(self.stack[0],1.)],stack=self.stack)
+        via.drawAt(numpy.array([[-1.,0.],[1.,0.]])+self.location[:2])
+
+class BlockFootprint_test(unittest.TestCase):
+    def setUp(self):
+        self.stack = Stack(4)
+    def drawVia(self,location):
+        via = Via(location,padFaceDiameterTuples=[(self.stack[0],1.)],isolateFaces=[self.stack[0]],stack=self.stack)
+        via.useBlockApertures = True
+        via.draw()
+    def test_via(self):
+        self.drawVia(Location(0.,0.))
+        self.drawVia(Location(3.,1.))
+        numpy.testing.assert_allclose(self.stack.top[20].flashes[:,:2],[[0.,0.],[3.,1.]])
+        numpy.testing.assert_allclose(self.stack.top[11].flashes[:,:2],[[0.,0.],[3.,1.]])
+        self.assertEqual(len(self.stack.blockFootprints),1)
+        self.assertEqual([hole.location.tolist() for hole in self.stack._drillFile.fixedHoles],[[0.,0.],[3.,1.]])
+    def test_drawAt(self):
+        for useBlockApertures in [False,True]:
+            (single,bulk) = (Stack(4),Stack(4))
+            locations = numpy.array([[0.,0.],[3.,1.],[-2.,5.]])
+            for location in locations:
+                via = Via(Location(location),padFaceDiameterTuples=[(single[0],1.)],isolateFaces=[single[0]],stack=single)
+                via.useBlockApertures = useBlockApertures
+                via.draw()
+            via = Via(Location(0.,0.),padFaceDiameterTuples=[(bulk[0],1.)],isolateFaces=[bulk[0]],stack=bulk)
+            via.useBlockApertures = useBlockApertures
+            via.drawAt(locations)
+            for (singleFile,bulkFile) in zip(single.gerberFiles,bulk.gerberFiles):
+                self.assertEqual(str(singleFile),str(bulkFile))
+            self.assertEqual([locations.tolist() for (locations,diameter,plated) in single._drillFile.holeGroups()],[locations.tolist() for (locations,diameter,plated) in bulk._drillFile.holeGroups()])
+    def holeLocations(self,stack):
+        return sorted([location for (locations,diameter,plated) in stack._drillFile.holeGroups() for location in locations.tolist()])
+    def drawnLines(self,stack):
+        return [sorted(str(gerberFile).splitlines()) for gerberFile in stack.gerberFiles]
+    def test_nestedDrawAt(self):
+        locations = numpy.array([[0.,0.],[5.,0.],[0.,5.]])
+        expected = sorted((locations[:,numpy.newaxis]+[[-1.,0.],[1.,0.]]).reshape(-1,2).tolist())
+        for useBlockApertures in [False,True]:
+            stack = Stack(4)
+            for location in locations:
+                viaPair = ViaPair(Location(location),stack)
+                viaPair.useBlockApertures = useBlockApertures
+                viaPair.draw()
+            self.assertEqual(self.holeLocations(stack),expected)
+            bulk = Stack(4)
+            viaPair = ViaPair(Location(0.,0.),bulk)
+            viaPair.useBlockApertures = useBlockApertures
+            viaPair.drawAt(locations)
+            self.assertEqual(self.holeLocations(bulk),expected)
+            self.assertEqual(self.drawnLines(bulk),self.drawnLines(stack))
+    def test_copiedFootprint(self):
+        locations = numpy.array([[0.,0.],[20.,0.],[0.,30.]])
+        for footprintClass in [MolexSma,MolexSmdSma]:
+            (single,bulk) = (Stack(4),Stack(4))
+            for location in locations:
+                footprintClass(Arrow(Location(location),E),single[0]).draw()
+            footprintClass(Arrow(Location(0.,0.),E),bulk[0]).drawAt(locations)
+            self.assertEqual(self.holeLocations(bulk),self.holeLocations(single))
+            self.assertEqual(self.drawnLines(bulk),self.drawnLines(single))
+    def test_minimumViaLocationsAlong(self):
+        arrows = ArrowArray([[0.,0.],[3.,1.],[-2.,5.]],[[1.,0.],[0.,1.],[0.6,-0.8]])
+        for inner in [False,True]:
+            singleLocations = [MinimumVia(arrow,inner=inner,stack=self.stack).location[:2] for arrow in arrows]
+            numpy.testing.assert_allclose(MinimumVia.locationsAlong(arrows,self.stack,inner=inner),singleLocations)
+
 class Coplanar_test(unittest.TestCase):
     def setUp(self):
         self.path = CoplanarTrace(startArrow=Arrow(Location(0.,0.),Direction(1.,0.)) ,width=10., gap=0.2)
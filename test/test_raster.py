@@ -0,0 +1,76 @@
+import unittest
+import nose
+import numpy
+from StringIO import StringIO
+
+from pypcb import *
+
+class GerberRasteriser_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('raster',decimalPlaces=4)
+        self.aperture = self.gerberFile.addCircularAperture(2.)
+        self.window = {'bottomLeft':Location(-5.,-5.),'topRight':Location(15.,15.)}
+    def darkArea(self,tileSize=1024):
+        image = GerberRasteriser(self.gerberFile,dpi=254.,tileSize=tileSize,**self.window).image()
+        return image.sum()*0.1**2
+    def test_flashAndClear(self):
+        self.gerberFile[0].flashAperture(Location(0.,0.),self.aperture)
+        self.gerberFile[1].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(1.))
+        self.assertAlmostEqual(self.darkArea(),numpy.pi*(1.-0.25),delta=0.05)
+    def test_polarityOrder(self):
+        self.gerberFile[1].flashAperture(Location(0.,0.),self.aperture)
+        self.gerberFile[2].flashAperture(Location(0.,0.),self.aperture)
+        self.assertAlmostEqual(self.darkArea(),numpy.pi,delta=0.05)
+    def test_strokes(self):
+        self.gerberFile[0].addStrokes(numpy.array([[0.,0.]]),numpy.array([[6.,8.]]),self.aperture)
+        self.gerberFile[0].addStrokes(numpy.array([[10.,0.]]),numpy.array([[10.,4.]]),self.gerberFile.addRectangularAperture(2.,1.))
+        self.assertAlmostEqual(self.darkArea(),(10.*2.+numpy.pi)+(2.*5.),delta=0.1)
+    def test_regionWithArc(self):
+        self.gerberFile[0].addOutline([Stroke(Location(0.,0.)),Stroke(Location(4.,0.)),Arc(Location(4.,4.),Location(4.,2.),True),Stroke(Location(0.,4.))])
+        self.assertAlmostEqual(self.darkArea(),16.+2.*numpy.pi,delta=0.1)
+    def test_vertexOnPixelRow(self):
+        # the apex lies exactly on the centre of a pixel row
+        apexHeight = -5.+31.5*0.1
+        self.gerberFile[0].addOutline([Stroke(Location(0.,apexHeight-1.)),Stroke(Location(4.,apexHeight)),Stroke(Location(0.,apexHeight+1.))])
+        self.assertAlmostEqual(self.darkArea(),4.,delta=0.1)
+    def test_tiles(self):
+        self.gerberFile[0].addOutline([Stroke(Location(0.,0.)),Stroke(Location(4.,0.)),Arc(Location(4.,4.),Location(4.,2.),True),Stroke(Location(0.,4.))])
+        self.gerberFile[1].addFlashes(numpy.array([[1.,1.],[3.,2.]]),self.aperture)
+        large = GerberRasteriser(self.gerberFile,dpi=254.,**self.window).image()
+        small = GerberRasteriser(self.gerberFile,dpi=254.,tileSize=13,**self.window).image()
+        numpy.testing.assert_array_equal(large,small)
+    def test_blockAperture(self):
+        def drawRing(block):
+            block[0].flashAperture(Location(0.,0.),self.aperture)
+            block[1].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(1.))
+        ring = self.gerberFile.addBlockAperture('ring',drawRing)
+        self.gerberFile[0].flashAperture(Location(0.,0.),ring)
+        self.assertAlmostEqual(self.darkArea(),numpy.pi*0.75,delta=0.05)
+        # flashed with clear polarity, the block is toggled
+        self.gerberFile[0].flashAperture(Location(5.,0.),self.aperture)
+        self.gerberFile[1].flashAperture(Location(5.,0.),ring)
+        self.assertAlmostEqual(self.darkArea(),numpy.pi*0.75+numpy.pi*0.25,delta=0.05)
+    def test_stepAndRepeat(self):
+        self.gerberFile[0].flashAperture(Location(0.,0.),self.aperture)
+        self.gerberFile.stepAndRepeat = StepAndRepeat(2,3,4.,5.)
+        self.assertAlmostEqual(self.darkArea(),6.*numpy.pi,delta=0.2)
+    def test_negative(self):
+        self.gerberFile.inverted = True
+        self.gerberFile[0].flashAperture(Location(0.,0.),self.aperture)
+        self.assertAlmostEqual(self.darkArea(),400.-numpy.pi,delta=0.05)
+    def test_literalCommands(self):
+        self.gerberFile[0].addDrawCommands('G54D10*\n'+self.gerberFile.locationToString(Location(1.,1.))+'D03*\n')
+        self.assertAlmostEqual(self.darkArea(),numpy.pi,delta=0.05)
+    def test_writePbm(self):
+        self.gerberFile[0].flashAperture(Location(0.,0.),self.aperture)
+        rasteriser = GerberRasteriser(self.gerberFile,dpi=254.)
+        fileObject = StringIO()
+        rasteriser.writePbm(fileObject)
+        (rows,columns) = rasteriser.shape
+        header = 'P4\n{columns} {rows}\n'.format(columns=columns,rows=rows)
+        self.assertTrue(fileObject.getvalue().startswith(header))
+        self.assertEqual(len(fileObject.getvalue()),len(header)+rows*((columns+7)//8))
+
+if __name__ == '__main__':
+    import nose
+    nose.run(argv=['-w','../test','-v'])
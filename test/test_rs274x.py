@@ -4,6 +4,8 @@
 import unittest
 import nose
 import numpy
+import zipfile
+from StringIO import StringIO
 
 from pypcb import *
 
@@ -15,6 +17,11 @@ class GerberLayer_test(unittest.TestCase):
         self.assertEqual(str(self.layer), \
 '''%LPD*%
 ''')
+    def test_addDrawCommands(self):
+        self.layer.addDrawCommands('G04 first*\n')
+        self.layer.addDrawCommands('G04 second*\n')
+        self.assertEqual(self.layer.drawCommands,'G04 first*\nG04 second*\n')
+        self.assertEqual(str(self.layer),'%LPD*%\nG04 first*\nG04 second*\n')
 
 class GerberFile_test(unittest.TestCase):
     def setUp(self):
@@ -22,9 +29,28 @@ class GerberFile_test(unittest.TestCase):
     
     def test_layer(self):
         self.assertFalse(self.gerberFile[0].inverted)
+    def test_sparseLayers(self):
+        self.assertTrue(self.gerberFile[21].inverted)
+        self.assertFalse(self.gerberFile[30].inverted)
+        self.assertEqual(len(self.gerberFile.layers),2)
+        self.assertIs(self.gerberFile.layers[0],self.gerberFile[21])
+    def test_emptyLayersOmitted(self):
+        aperture = self.gerberFile.addCircularAperture(.5)
+        self.gerberFile[21]
+        for layerNumber in [10,20,30]:
+            self.gerberFile[layerNumber].flashAperture(Location(0.,0.),aperture)
+        self.gerberFile[11].flashAperture(Location(0.,0.),aperture)
+        text = str(self.gerberFile)
+        self.assertEqual([text.count('%LPD*%'),text.count('%LPC*%')],[2,1])
+        self.assertEqual(text.count('D03*'),4)
         
     def test_location(self):
         self.assertEqual(self.gerberFile.locationToString(Location(1.123456,0)),'X+11235Y+0000')
+    def test_locations(self):
+        locations = numpy.array([[1.123456,0],[-1.1,2],[0.00005,-0.00005]])
+        self.assertEqual(self.gerberFile.locationsToStrings(locations),['X+11235Y+0000','X-11000Y+20000','X+0001Y-0001'])
+        self.assertEqual(self.gerberFile.locationsToStrings(locations[1:2],offset=True),['I-11000J+20000'])
+        self.assertEqual(self.gerberFile.locationsToStrings(numpy.zeros((0,2))),[])
     def test_offset(self):
         self.assertEqual(self.gerberFile.locationToString(Location(-1.1,2),offset=True),'I-11000J+20000')
         
@@ -34,6 +60,14 @@ class GerberFile_test(unittest.TestCase):
     def test_circularAperture(self):
         apertureNumber = self.gerberFile.addCircularAperture(.5)
         self.assertEqual(self.gerberFile._aperturesAsString(),'%ADD{apertureNumber:02d}C,0.5000*%\n'.format(apertureNumber=apertureNumber))
+    def test_apertureDeduplication(self):
+        firstNumber = self.gerberFile.addCircularAperture(.35)
+        secondNumber = self.gerberFile.addRectangularAperture(.1,.2)
+        self.assertEqual(self.gerberFile.addCircularAperture(.35),firstNumber)
+        self.assertEqual(self.gerberFile.addCircularAperture(.35000001),firstNumber)
+        self.assertEqual(self.gerberFile.addRectangularAperture(.1,.2),secondNumber)
+        self.assertEqual(self.gerberFile.addCircularAperture(.4),secondNumber+1)
+        self.assertEqual(len(self.gerberFile.apertures),3)
     def test_outlineTrace(self):
         aperture = self.gerberFile.addCircularAperture(.5)
         layer = self.gerberFile[0]
@@ -50,8 +84,315 @@ G01X+40000Y+40000D01*
 G01X+10000Y+40000D01*
 G01X+10000Y+10000D01*
 ''')
+    def test_strokes(self):
+        aperture = self.gerberFile.addCircularAperture(.5)
+        layer = self.gerberFile[0]
+        layer.addStrokes(numpy.array([[0.,0.],[1.,1.]]),numpy.array([[1.,0.],[1.,2.]]),aperture)
+        self.assertEqual(layer.drawCommands, \
+'''D10*
+G75*
+G01X+0000Y+0000D02*
+G01X+10000Y+0000D01*
+D10*
+G75*
+G01X+10000Y+10000D02*
+G01X+10000Y+20000D01*
+''')
+    def test_writeTo(self):
+        aperture = self.gerberFile.addCircularAperture(.5)
+        self.gerberFile[0].flashAperture(Location(1.,2.),aperture)
+        self.gerberFile[1].flashAperture(Location(1.,2.),aperture)
+        outputFile = StringIO()
+        self.gerberFile.writeTo(outputFile)
+        self.assertEqual(outputFile.getvalue(),str(self.gerberFile))
+        self.assertTrue(outputFile.getvalue().endswith('%LPC*%\nG54D10*\nX+10000Y+20000D03*\nM02*'))
+    def test_writeOutToZip(self):
+        aperture = self.gerberFile.addCircularAperture(.5)
+        self.gerberFile[0].flashAperture(Location(1.,2.),aperture)
+        zipBuffer = StringIO()
+        zipFile = zipfile.ZipFile(zipBuffer,'w',zipfile.ZIP_DEFLATED)
+        self.gerberFile.writeOut(zipFile=zipFile)
+        zipFile.close()
+        self.assertEqual(zipfile.ZipFile(zipBuffer).read('gerberFileUnderTest.gbr'),str(self.gerberFile))
+
+
+class GerberLayerPrimitives_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('primitives',decimalPlaces=4)
+        self.aperture = self.gerberFile.addCircularAperture(.5)
+        self.layer = self.gerberFile[0]
+    def test_flashes(self):
+        self.layer.flashAperture(Location(1.,2.),self.aperture)
+        self.layer.addFlashes(numpy.array([[3.,4.],[5.,6.]]),self.aperture)
+        numpy.testing.assert_allclose(self.layer.flashes,[[1.,2.,10.],[3.,4.,10.],[5.,6.,10.]])
+    def test_strokes(self):
+        self.layer.addSingleStroke(Location(0.,0.),Location(1.,0.),self.aperture)
+        numpy.testing.assert_allclose(self.layer.strokes,[[0.,0.,1.,0.,10.]])
+    def test_order(self):
+        self.layer.flashAperture(Location(1.,2.),self.aperture)
+        self.layer.addSingleStroke(Location(0.,0.),Location(1.,0.),self.aperture)
+        self.layer.flashAperture(Location(3.,4.),self.aperture)
+        self.assertEqual(self.layer.drawCommands, \
+'''G54D10*
+X+10000Y+20000D03*
+D10*
+G75*
+G01X+0000Y+0000D02*
+G01X+10000Y+0000D01*
+G54D10*
+X+30000Y+40000D03*
+''')
+    def test_translate(self):
+        self.layer.flashAperture(Location(1.,2.),self.aperture)
+        self.layer.addOutline([Stroke(Location(0.,-5.)),Arc(Location(25.,20.),Location(0.,20.),True)])
+        self.layer.translate(PlaneVector(1.,-1.))
+        self.assertEqual(self.layer.drawCommands, \
+'''G54D10*
+X+20000Y+10000D03*
+G36*
+G75*
+G01X+10000Y-60000D02*
+G03X+260000Y+190000I+0000J+250000D01*
+G37*
+''')
+    def test_coordinates(self):
+        self.layer.addOutline([Stroke(Location(0.,-5.)),Arc(Location(25.,20.),Location(0.,20.),True)])
+        numpy.testing.assert_allclose(self.layer.coordinates(),[[0.,-5.],[25.,20.],[0.,25.]])
 
+class OptimisedGerberFile_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('optimised',decimalPlaces=4,optimise=True)
+        self.aperture = self.gerberFile.addCircularAperture(.5)
+    def test_flashes(self):
+        layer = self.gerberFile[0]
+        layer.flashAperture(Location(1.,2.),self.aperture)
+        layer.flashAperture(Location(1.,3.),self.aperture)
+        self.assertEqual(layer.drawCommands,'D10*\nX10000Y20000D03*\nY30000D03*\n')
+    def test_chainedStrokes(self):
+        layer = self.gerberFile[0]
+        layer.addStrokes(numpy.array([[0.,0.],[1.,1.]]),numpy.array([[1.,1.],[1.,2.]]),self.aperture)
+        self.assertEqual(layer.drawCommands,'D10*\nX0Y0D02*\nG01X10000Y10000D01*\nY20000D01*\n')
+    def test_region(self):
+        layer = self.gerberFile[1]
+        layer.addOutline([Stroke(Location(0.,-5.)),Arc(Location(25.,20.),Location(0.,20.),True),Stroke(Location(15.,20.))])
+        layer.flashAperture(Location(1.,3.),self.aperture)
+        self.assertEqual(str(layer), \
+'''%LPC*%
+G36*
+X0Y-50000D02*
+G03X250000Y200000I0J250000D01*
+G01X150000D01*
+G37*
+D10*
+X10000Y30000D03*
+''')
+    def test_narrowestFormat(self):
+        self.gerberFile[0].flashAperture(Location(12.5,-3.),self.aperture)
+        self.assertIn('%FSLAX24Y24*%\n',self.gerberFile.header())
+        self.assertIn('G75*\n',self.gerberFile.header())
+        self.gerberFile[0].flashAperture(Location(0.,-123.),self.aperture)
+        self.assertIn('%FSLAX34Y34*%\n',self.gerberFile.header())
 
+class GerberReader_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('roundtrip',decimalPlaces=4)
+        aperture = self.gerberFile.addCircularAperture(.5)
+        self.gerberFile[0].addFlashes(numpy.array([[1.,2.],[1.,3.]]),aperture)
+        self.gerberFile[1].addOutline([Stroke(Location(0.,-5.)),Arc(Location(25.,20.),Location(0.,20.),True),Stroke(Location(15.,20.))])
+        self.gerberFile[2].addStrokes(numpy.array([[0.,0.],[1.,1.]]),numpy.array([[1.,1.],[1.,2.]]),aperture)
+    def test_roundTrip(self):
+        readFile = GerberFile.fromString(str(self.gerberFile))
+        self.assertEqual(readFile.name,'ROUNDTRIP')
+        self.assertEqual(readFile.apertures,{10:'C,0.5000'})
+        self.assertEqual([layer.inverted for layer in readFile.layers],[False,True,False])
+        self.assertEqual(str(readFile),str(self.gerberFile))
+    def test_compactRoundTrip(self):
+        self.gerberFile.optimise = True
+        readFile = GerberFile.fromFile(StringIO(str(self.gerberFile)))
+        readFile.optimise = True
+        self.assertEqual(str(readFile),str(self.gerberFile))
+        numpy.testing.assert_allclose(readFile[0].flashes,self.gerberFile[0].flashes)
+        numpy.testing.assert_allclose(readFile[2].strokes,self.gerberFile[2].strokes)
+    def test_interleavedRoundTrip(self):
+        gerberFile = GerberFile('interleaved',decimalPlaces=4)
+        aperture = gerberFile.addCircularAperture(.5)
+        layer = gerberFile[0]
+        layer.flashAperture(Location(1.,2.),aperture)
+        layer.addSingleStroke(Location(0.,0.),Location(3.,0.),aperture)
+        layer.flashAperture(Location(3.,0.),aperture)
+        layer.addOutline([Stroke(Location(5.,5.)),Stroke(Location(6.,5.)),Stroke(Location(6.,6.))])
+        layer.addSingleStroke(Location(6.,6.),Location(8.,6.),aperture)
+        layer.flashAperture(Location(5.,0.),aperture)
+        for optimise in [False,True]:
+            gerberFile.optimise = optimise
+            readFile = GerberFile.fromString(str(gerberFile))
+            readFile.optimise = optimise
+            self.assertEqual(str(readFile),str(gerberFile))
+    def test_vendorConventions(self):
+        readFile = GerberFile.fromString('''%FSTAX23Y23*%
+%MOIN*%
+%ADD11C,0.01*%
+G04 trailing zeroes omitted, modal D01 and a region without D02*
+D11*
+X001Y001D02*
+X002D01*
+Y002*
+G36*
+G01X003*
+Y003*
+X002*
+G37*
+M02*''')
+        self.assertEqual(readFile.apertures,{11:'C,0.254'})
+        numpy.testing.assert_allclose(readFile[0].strokes,[[2.54,2.54,5.08,2.54,11.],[5.08,2.54,5.08,5.08,11.]])
+        contours = readFile[0].contourBatches[0]
+        numpy.testing.assert_allclose(contours.vertices.array[:,0:3],[[5.08,5.08,0.],[7.62,5.08,1.],[7.62,7.62,1.],[5.08,7.62,1.]])
+    def test_unsupported(self):
+        self.assertRaises(NotImplementedError,GerberFile.fromString,'%FSLAX24Y24*%\nG74*\nM02*')
+        self.assertRaises(NotImplementedError,GerberFile.fromString,'%FSLAX24Y24*%\nN10X100Y100D01*\nM02*')
+    def test_stepAndRepeat(self):
+        self.gerberFile.stepAndRepeat = StepAndRepeat(4,4,12.,14.5)
+        self.gerberFile.addPanelLayer().addFlashes(numpy.array([[-7.,-7.]]),10)
+        readFile = GerberFile.fromString(str(self.gerberFile))
+        self.assertEqual(readFile.stepAndRepeat.columns,4)
+        self.assertAlmostEqual(readFile.stepAndRepeat.rowPitch,14.5)
+        self.assertEqual(len(readFile.layers),3)
+        self.assertEqual(len(readFile.panelLayers),1)
+        self.assertEqual(str(readFile),str(self.gerberFile))
+
+class StepAndRepeat_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('panel',decimalPlaces=3)
+        self.aperture = self.gerberFile.addCircularAperture(.5)
+        self.gerberFile[0].flashAperture(Location(1.,2.),self.aperture)
+        self.gerberFile[1].flashAperture(Location(1.,2.),self.aperture)
+    def test_offsets(self):
+        numpy.testing.assert_allclose(StepAndRepeat(2,3,10.,20.).offsets(),[[0.,0.],[10.,0.],[0.,20.],[10.,20.],[0.,40.],[10.,40.]])
+    def test_block(self):
+        self.gerberFile.stepAndRepeat = StepAndRepeat(4,4,12.,14.5)
+        self.gerberFile.addPanelLayer().flashAperture(Location(0.,0.),self.aperture)
+        text = str(self.gerberFile)
+        self.assertEqual(text.count('%SRX4Y4I12.000J14.500*%\n%LPD*%'),1)
+        self.assertEqual(text.count('%SR*%\n%LPD*%'),1)
+        self.assertEqual(text.count('D03*'),3)
+        self.assertLess(text.index('%LPC*%'),text.index('%SR*%'))
+
+
+class BlockAperture_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('blocks',decimalPlaces=3)
+        self.aperture = self.gerberFile.addCircularAperture(.5)
+        self.drawCount = 0
+    def drawRing(self,block):
+        self.drawCount += 1
+        block[0].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(2.))
+        block[1].flashAperture(Location(0.,0.),self.aperture)
+    def test_definedOnce(self):
+        first = self.gerberFile.addBlockAperture('ring',self.drawRing)
+        second = self.gerberFile.addBlockAperture('ring',self.drawRing)
+        self.assertEqual(first,second)
+        self.assertEqual(self.drawCount,1)
+        self.gerberFile[0].addFlashes(numpy.array([[5.,5.],[9.,5.]]),first)
+        text = str(self.gerberFile)
+        self.assertEqual(text.count('%ABD11*%\n%LPD*%\nG54D12*\nX+000Y+000D03*\n%LPC*%\nG54D10*\nX+000Y+000D03*\n%AB*%\n'),1)
+        self.assertLess(text.index('%ADD12C'),text.index('%ABD11*%'))
+        self.assertEqual(text.count('G54D11*'),2)
+    def test_recording(self):
+        with BlockRecording('pair') as recording:
+            self.gerberFile[0].addFlashes(numpy.array([[5.,5.],[6.,5.]]),self.aperture)
+            self.gerberFile[1].flashAperture(Location(5.,6.),self.aperture)
+        self.assertEqual(len(self.gerberFile[0].flashes),0)
+        flashes = recording.flashes(Location(5.,5.))
+        self.assertEqual(flashes[0][0],self.gerberFile[0])
+        self.assertEqual(flashes[0][1],11)
+        numpy.testing.assert_allclose(self.gerberFile.blockApertures[0].layers[0].flashes,[[0.,0.,10.],[1.,0.,10.]])
+        # a single flash needs no block
+        self.assertEqual(flashes[1][1],self.aperture)
+        numpy.testing.assert_allclose(flashes[1][2],[0.,1.])
+        self.assertEqual(len(self.gerberFile.blockApertures),1)
+    def test_recordingLiteralCommands(self):
+        with BlockRecording('literal'):
+            self.assertRaises(ValueError,self.gerberFile[0].addDrawCommands,'G04 literal*\n')
+        self.assertEqual(self.gerberFile[0].drawCommands,'')
+        self.gerberFile[0].addDrawCommands('G04 literal*\n')
+        self.assertRaises(ValueError,self.gerberFile[0].translate,numpy.array([1.,0.]))
+    def test_roundTrip(self):
+        apertureNumber = self.gerberFile.addBlockAperture('ring',self.drawRing)
+        self.gerberFile[1].flashAperture(Location(5.,5.),apertureNumber)
+        readFile = GerberFile.fromString(str(self.gerberFile))
+        self.assertEqual([layer.inverted for layer in readFile.layers],[True])
+        self.assertEqual([len(block.layers) for block in readFile.blockApertures],[2])
+        self.assertEqual(str(readFile),str(self.gerberFile))
+
+class GridGerberFile_test(unittest.TestCase):
+    def setUp(self):
+        self.floatFile = GerberFile('grid',decimalPlaces=4)
+        self.gridFile = GerberFile('grid',decimalPlaces=4,grid=CoordinateGrid(6))
+    def draw(self,gerberFile):
+        aperture = gerberFile.addCircularAperture(.5)
+        gerberFile[0].addFlashes(numpy.array([[0.1+0.2,1.],[-2.00005,3.]]),aperture)
+        gerberFile[1].addSingleStroke(Location(0.,0.),Location(1.23456,-7.),aperture)
+        gerberFile[2].addOutline([Stroke(Location(0.,0.)),Stroke(Location(4.,0.)),Arc(Location(4.,4.),Location(4.,2.),True),Stroke(Location(0.,4.))])
+    def test_sameOutput(self):
+        self.draw(self.floatFile)
+        self.draw(self.gridFile)
+        self.assertEqual(str(self.gridFile),str(self.floatFile))
+        self.gridFile.optimise = self.floatFile.optimise = True
+        self.assertEqual(str(self.gridFile),str(self.floatFile))
+    def test_storedOnGrid(self):
+        self.draw(self.gridFile)
+        batch = self.gridFile[0]._batches[0]
+        self.assertEqual(batch.flashes.array.dtype,numpy.int64)
+        self.assertEqual(batch.flashes.array[0].tolist(),[300000,1000000,10])
+        numpy.testing.assert_array_equal(self.gridFile[0].flashes[:,0:2],[[0.3,1.],[-2.00005,3.]])
+    def test_translate(self):
+        self.draw(self.gridFile)
+        self.gridFile[0].translate(numpy.array([0.1,0.2]))
+        self.gridFile[0].translate(numpy.array([-0.1,-0.2]))
+        self.assertEqual(self.gridFile[0]._batches[0].flashes.array[:,0:2].tolist(),[[300000,1000000],[-2000050,3000000]])
+    def test_rasterise(self):
+        self.draw(self.floatFile)
+        self.draw(self.gridFile)
+        numpy.testing.assert_array_equal(self.gridFile.rasterise(dpi=254.),self.floatFile.rasterise(dpi=254.))
+
+class Statistics_test(unittest.TestCase):
+    def setUp(self):
+        self.gerberFile = GerberFile('statistics',decimalPlaces=3)
+        self.aperture = self.gerberFile.addCircularAperture(.5)
+        self.gerberFile[0].addFlashes(numpy.array([[0.,0.],[1.,0.],[2.,0.]]),self.aperture)
+        self.gerberFile[0].addOutline([Stroke(Location(0.,0.)),Stroke(Location(1.,0.)),Stroke(Location(1.,1.))])
+        self.gerberFile[1].addStrokes(numpy.array([[0.,0.],[1.,1.]]),numpy.array([[1.,0.],[2.,2.]]),self.gerberFile.addRectangularAperture(.1,.2))
+        self.gerberFile[1].addOutline([Stroke(Location(0.,0.)),Stroke(Location(1.,0.)),Stroke(Location(1.,1.))],self.aperture)
+        self.gerberFile[2].flashAperture(Location(5.,5.),self.aperture)
+    def test_layer(self):
+        statistics = self.gerberFile[0].statistics()
+        self.assertEqual((statistics['flashes'],statistics['strokes'],statistics['regions'],statistics['regionVertices'],statistics['apertures']),(3,0,1,3,1))
+        self.assertEqual(statistics['bytes'],len(self.gerberFile[0].drawCommands))
+        statistics = self.gerberFile[1].statistics()
+        self.assertEqual((statistics['flashes'],statistics['strokes'],statistics['regions'],statistics['apertures']),(0,2+3,0,2))
+    def test_file(self):
+        statistics = self.gerberFile.statistics()
+        self.assertEqual((statistics['flashes'],statistics['strokes'],statistics['regions'],statistics['regionVertices']),(4,5,1,3))
+        self.assertEqual((statistics['apertures'],statistics['polaritySwitches']),(2,3))
+        self.assertEqual(statistics['bytes'],len(str(self.gerberFile)))
+    def test_blocks(self):
+        def drawBlock(block):
+            block[0].flashAperture(Location(0.,0.),self.aperture)
+            block[2].flashAperture(Location(1.,0.),self.aperture)
+        self.gerberFile[2].flashAperture(Location(5.,5.),self.gerberFile.addBlockAperture('pair',drawBlock))
+        statistics = self.gerberFile.statistics()
+        self.assertEqual((statistics['flashes'],statistics['apertures'],statistics['polaritySwitches']),(4+1+2,3,3+1))
+    def test_sharedCopy(self):
+        original = str(self.gerberFile)
+        copied = self.gerberFile.sharedCopy()
+        copied[0].addFlashes(numpy.array([[3.,0.]]),self.aperture)
+        copied[3].flashAperture(Location(0.,0.),copied.addCircularAperture(1.))
+        self.assertEqual(str(self.gerberFile),original)
+        # drawn into batches of its own, the copy writes what the original would
+        self.gerberFile[0].addFlashes(numpy.array([[3.,0.]]),self.aperture)
+        self.gerberFile[3].flashAperture(Location(0.,0.),self.gerberFile.addCircularAperture(1.))
+        self.assertEqual(str(copied),str(self.gerberFile))
+        self.assertEqual(copied.statistics(),self.gerberFile.statistics())
 
 if __name__ == '__main__':
     import nose
@@ -13,6 +13,59 @@ class Eurocircuits_test(unittest.TestCase):
         self.assertAlmostEqual(self.classification.normaliseProductionHoleDiameter(mil(32)),0.80)
         self.assertAlmostEqual(self.classification.normaliseProductionHoleDiameter(mil(33)),0.85)
 
+class Panel_test(unittest.TestCase):
+    def setUp(self):
+        self.stack = Stack(4)
+        self.stack.boardOutline = DrawGroup([Rectangle(bottomLeft=Location(0.,0.),topRight=Location(30.,20.))])
+    def test_single(self):
+        self.assertIsNone(self.stack.panelStepAndRepeat())
+    def test_panel(self):
+        self.stack.panelise(4,3)
+        stepAndRepeat = self.stack.panelStepAndRepeat()
+        self.assertEqual((stepAndRepeat.columns,stepAndRepeat.rows),(4,3))
+        self.assertAlmostEqual(stepAndRepeat.columnPitch,32.)
+        self.assertAlmostEqual(stepAndRepeat.rowPitch,22.)
+        panelOutline = self.stack.panelOutline()
+        self.assertAlmostEqual(panelOutline.width,4*30.+3*2.+2*7.)
+        self.assertAlmostEqual(panelOutline.height,3*20.+2*2.+2*7.)
+
+class FlattenPolarity_test(unittest.TestCase):
+    def test_allFiles(self):
+        stack = Stack(4)
+        stack.flattenPolarity()
+        self.assertTrue(all([gerberFile.flatten for gerberFile in stack.gerberFiles]))
+        self.assertTrue(stack[0].solderMask.flatten)
+
+class Statistics_test(unittest.TestCase):
+    def setUp(self):
+        self.stack = Stack(4)
+        self.stack.boardOutline = DrawGroup([Rectangle(bottomLeft=Location(0.,0.),topRight=Location(30.,20.))])
+        self.stack[0].copper[0].flashAperture(Location(5.,5.),self.stack[0].copper.addCircularAperture(1.))
+        self.stack[3].copper[1].flashAperture(Location(5.,5.),self.stack[3].copper.addCircularAperture(1.))
+        self.stack.addHole(Hole(Location(5.,5.),0.5))
+        self.stack.addHole(Hole(Location(25.,5.),1.,plated=False))
+        self.stack.addHoles(numpy.array([[10.,10.],[12.,10.],[14.,10.]]),0.8)
+    def test_holes(self):
+        statistics = self.stack.statistics()
+        self.assertEqual((statistics['tools'],statistics['hits']),(3,5))
+        self.stack.panelise(2,3)
+        statistics = self.stack.statistics()
+        self.assertEqual((statistics['tools'],statistics['hits']),(3,5*6))
+    def test_unchanged(self):
+        before = [str(gerberFile) for gerberFile in self.stack.gerberFiles]
+        self.stack.panelise(2,1)
+        self.stack.statistics()
+        self.assertEqual(self.stack._platedFile.tools,[])
+        self.assertEqual(len(self.stack.boardOutline),1)
+        self.assertEqual([str(gerberFile) for gerberFile in self.stack.gerberFiles],before)
+    def test_sum(self):
+        statistics = self.stack.statistics()
+        self.stack._completeOutputFiles()
+        self.assertEqual(statistics['flashes'],2)
+        self.assertGreater(statistics['strokes'],4*5)
+        self.assertEqual(statistics,sum([outputFile.statistics() for outputFile in self.stack.outputFiles],Statistics()))
+        self.assertEqual(statistics['bytes'],sum([len(str(outputFile)) for outputFile in self.stack.outputFiles]))
+
 if __name__ == '__main__':
     import nose
     nose.run(argv=['-w','../test','-v'])
@@ -8,6 +8,29 @@ class RotatableList_test(unittest.TestCase):
         self.assertEqual(self.testList >> 2,RotatableList([4,5,1,2,3]))
     def test_loopback(self):
         self.assertEqual(self.testList >> 2 << 2,self.testList)
+
+class GrowingArray_test(unittest.TestCase):
+    def test_growth(self):
+        growingArray = GrowingArray(2,capacity=1)
+        growingArray.append([1.,2.])
+        growingArray.extend([[3.,4.],[5.,6.],[7.,8.]])
+        self.assertEqual(len(growingArray),4)
+        self.assertEqual(growingArray.array.tolist(),[[1.,2.],[3.,4.],[5.,6.],[7.,8.]])
+
+class CoordinateGrid_test(unittest.TestCase):
+    def setUp(self):
+        self.grid = CoordinateGrid(6)
+    def test_snap(self):
+        self.assertEqual(self.grid.snap([0.1+0.2,-1.0000005]).tolist(),[300000,-1000001])
+        self.assertEqual(self.grid.millimetres(self.grid.snap(2.5)),2.5)
+    def test_toDecimalPlaces(self):
+        self.assertEqual(self.grid.toDecimalPlaces([1234500,-1234500,1234499],3).tolist(),[1235,-1235,1234])
+        self.assertEqual(self.grid.toDecimalPlaces([12],8).tolist(),[1200])
+
+class Statistics_test(unittest.TestCase):
+    def test_sum(self):
+        total = sum([Statistics(flashes=1,bytes=10),Statistics(bytes=5,hits=2)],Statistics())
+        self.assertEqual(total,{'flashes':1,'bytes':15,'hits':2})
         
 if __name__ == '__main__':
 #     import nose